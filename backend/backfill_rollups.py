@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Rebuild the per-user analytics rollups (user_rollups) from the analyses
+collection. Run once after deploying rollups, or to repair drift. Until it
+has run, dashboards of users with older analyses show partial totals.
+
+Safe to run against live traffic: each user's rollup is reset with a cutoff
+just ahead of now, analyses created before the cutoff are added once they
+are all stored, and live updates keep counting analyses after it.
+
+    python backfill_rollups.py                 # every user with analyses
+    python backfill_rollups.py --user USER_ID  # a single user
+"""
+
+import argparse
+import asyncio
+import time
+
+from server import client, db, ensure_indexes, fill_user_rollup, reset_user_rollup, wait_for_rollup_cutoff
+
+CHUNK = 200
+
+async def backfill(user_ids, concurrency: int):
+    sem = asyncio.Semaphore(concurrency)
+    done = 0
+
+    async def bounded(coro):
+        async with sem:
+            return await coro
+
+    # Users are reset a chunk at a time so the wait for their cutoffs is shared.
+    for start in range(0, len(user_ids), CHUNK):
+        chunk = user_ids[start:start + CHUNK]
+        cutoffs = await asyncio.gather(*(bounded(reset_user_rollup(uid)) for uid in chunk))
+        await wait_for_rollup_cutoff(max(cutoffs))
+        rollups = await asyncio.gather(*(bounded(fill_user_rollup(uid, since)) for uid, since in zip(chunk, cutoffs)))
+        done += len(chunk)
+        print(f"  {done}/{len(user_ids)} users (last: {chunk[-1]}, {rollups[-1]['count']} analyses)")
+
+async def main():
+    ap = argparse.ArgumentParser(description="Rebuild user_rollups from analyses")
+    ap.add_argument("--user", action="append", help="user_id to rebuild (repeatable)")
+    ap.add_argument("--concurrency", type=int, default=8)
+    args = ap.parse_args()
+    await ensure_indexes()
+    user_ids = args.user or await db.analyses.distinct("user_id")
+    print(f"Rebuilding rollups for {len(user_ids)} users")
+    started = time.monotonic()
+    await backfill(user_ids, args.concurrency)
+    print(f"Done in {time.monotonic() - started:.1f}s")
+    client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
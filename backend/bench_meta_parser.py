@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the page meta extraction used by video-link analysis.
+
+Compares the previous approach (download the whole page, decode it and run
+three regexes over it) with the incremental head-only HeadMetaParser, and
+reports bytes read, time and peak memory for each saved page.
+
+    python bench_meta_parser.py [PAGE.html ...] [--runs N]
+
+Save pages with e.g. `curl -A Mozilla/5.0 -L -o tiktok.html <video url>`.
+Without arguments, synthetic pages shaped like TikTok, Instagram and YouTube
+video pages (large inline body state after a modest <head>) are used.
+
+The synthetic pages are not representative: their head size, tag mix and
+body size are guesses, so they only show the shape of the difference. No
+real pages ship with the repo (they carry creator data and change often);
+quote numbers only from runs against freshly saved pages.
+"""
+
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "bench")
+sys.path.insert(0, str(Path(__file__).parent))
+
+from server import HeadMetaParser, PAGE_META_CHUNK  # noqa: E402
+
+def legacy_extract(chunks) -> tuple:
+    # What fetch_page_meta did before: read everything, then three regexes.
+    body = b"".join(chunks)
+    html = body.decode("utf-8", errors="replace")
+    meta = {}
+    og_desc = re.search(r'<meta[^>]*property=["\']og:description["\'][^>]*content=["\']([^"\']*)["\']', html)
+    og_title = re.search(r'<meta[^>]*property=["\']og:title["\'][^>]*content=["\']([^"\']*)["\']', html)
+    og_img = re.search(r'<meta[^>]*property=["\']og:image["\'][^>]*content=["\']([^"\']*)["\']', html)
+    if og_desc:
+        meta["description"] = og_desc.group(1)[:500]
+    if og_title:
+        meta["title"] = og_title.group(1)
+    if og_img:
+        meta["thumbnail"] = og_img.group(1)
+    return meta, len(body)
+
+def head_extract(chunks) -> tuple:
+    parser = HeadMetaParser()
+    for chunk in chunks:
+        if parser.feed_bytes(chunk):
+            break
+    return parser.meta, parser.bytes_read
+
+def synthetic_page(kind: str, body_kb: int, head_kb: int, seed: int) -> bytes:
+    rng = random.Random(seed)
+    words = ["viral", "trend", "recipe", "dance", "tutorial", "vlog", "fyp", "summer", "coffee", "travel"]
+    caption = " ".join(rng.choice(words) for _ in range(25)) + " #fyp #viral #" + kind
+    head = [
+        "<!DOCTYPE html><html lang=\"en\"><head><meta charset=\"utf-8\">",
+        f"<title>{kind} video</title>",
+        f'<meta property="og:title" content="{kind.title()} creator on {kind}">',
+        f'<meta property="og:description" content="{caption}">',
+        f'<meta property="og:image" content="https://cdn.{kind}.example/thumb/{seed}.jpg">',
+    ]
+    for i in range(40):
+        head.append(f'<link rel="preload" href="https://static.{kind}.example/chunk-{i}-{rng.getrandbits(64):x}.js" as="script">')
+    css = "".join(f".c{i}{{margin:{rng.randint(0, 40)}px;color:#{rng.getrandbits(24):06x}}}" for i in range(head_kb * 30))
+    head.append(f"<style>{css[:head_kb * 1024]}</style></head>")
+    state = ",".join(f'"k{i}":"{rng.getrandbits(128):032x}"' for i in range(body_kb * 1024 // 44))
+    body = f'<body><div id="app"></div><script id="__STATE__" type="application/json">{{{state}}}</script></body></html>'
+    return ("".join(head) + body).encode()
+
+def sample_pages() -> dict:
+    return {
+        "synthetic-tiktok": synthetic_page("tiktok", body_kb=1500, head_kb=60, seed=1),
+        "synthetic-instagram": synthetic_page("instagram", body_kb=1200, head_kb=180, seed=2),
+        "synthetic-youtube": synthetic_page("youtube", body_kb=900, head_kb=120, seed=3),
+    }
+
+def measure(fn, page: bytes, runs: int) -> dict:
+    chunks = [page[i:i + PAGE_META_CHUNK] for i in range(0, len(page), PAGE_META_CHUNK)]
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        meta, read = fn(iter(chunks))
+        times.append((time.perf_counter() - started) * 1000)
+    tracemalloc.start()
+    fn(iter(chunks))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"meta": meta, "bytes_read": read, "ms": statistics.median(times), "peak_kb": peak / 1024}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("pages", nargs="*", help="saved HTML pages")
+    ap.add_argument("--runs", type=int, default=20)
+    args = ap.parse_args()
+    pages = {Path(p).name: Path(p).read_bytes() for p in args.pages}
+    if not pages:
+        print("No pages given: using synthetic pages, which are not representative of real sites.\n")
+        pages = sample_pages()
+
+    print(f"{'page':<22}{'method':<8}{'size KB':>9}{'read KB':>9}{'ms':>9}{'peak KB':>10}  fields")
+    for name, page in pages.items():
+        for label, fn in (("legacy", legacy_extract), ("head", head_extract)):
+            r = measure(fn, page, args.runs)
+            print(f"{name:<22}{label:<8}{len(page) / 1024:>9.0f}{r['bytes_read'] / 1024:>9.0f}"
+                  f"{r['ms']:>9.2f}{r['peak_kb']:>10.0f}  {','.join(sorted(r['meta']))}")
+
+if __name__ == "__main__":
+    main()
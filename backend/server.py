@@ -1,25 +1,205 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Depends
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring, ASCENDING, DESCENDING, TEXT, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
 import logging
 import json
+import csv
+import io
+import base64
+import codecs
 import httpx
+from html.parser import HTMLParser
 from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
 import uuid
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import re
 import random
+import hashlib
+import hmac
+import math
+import unicodedata
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# ── Metrics ─────────────────────────────────────────────
+# A small in-process registry rendered in the Prometheus text format at
+# /metrics. Metrics are updated from the event loop and from the driver's
+# threads (Mongo command events), so every update takes the metric's lock.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_str(names, values, extra: tuple = ()) -> str:
+    pairs = [f'{n}="{_escape_label(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels=(), fn=None):
+        # fn, if given, is called at scrape time and returns {label values: value}.
+        self.name, self.help, self.labels, self.fn = name, help, tuple(labels), fn
+        self._values: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def samples(self):
+        if self.fn is not None:
+            return [(self.name, k if isinstance(k, tuple) else (k,), v) for k, v in self.fn().items()]
+        with self._lock:
+            return [(self.name, k, v) for k, v in self._values.items()]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, value in self.samples():
+            lines.append(f"{name}{_label_str(self.labels, key)} {_fmt(value)}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Per-bucket counts, then sum; rendered cumulatively.
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = [(k, list(v)) for k, v in self._values.items()]
+        for key, counts in series:
+            total = 0
+            for bound, n in zip(self.buckets, counts):
+                total += n
+                labels = _label_str(self.labels, key, ("le", _fmt(bound)))
+                lines.append(f"{self.name}_bucket{labels} {total}")
+            lines.append(f"{self.name}_sum{_label_str(self.labels, key)} {_fmt(counts[-1])}")
+            lines.append(f"{self.name}_count{_label_str(self.labels, key)} {total}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def add(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {type(e).__name__}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+http_request_seconds = metrics.add(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template, method and status.",
+    ("method", "route", "status")))
+http_in_flight = metrics.add(Gauge(
+    "http_requests_in_flight", "HTTP requests being served, by rate-limit route group.", ("group",)))
+mongo_command_seconds = metrics.add(Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency by collection and command.",
+    ("collection", "command"), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)))
+mongo_command_failures = metrics.add(Counter(
+    "mongodb_command_failures_total", "Failed MongoDB commands by collection and command.", ("collection", "command")))
+llm_call_seconds = metrics.add(Histogram(
+    "llm_call_duration_seconds", "LLM provider call latency by mode and outcome.", ("mode", "outcome"),
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)))
+llm_fallbacks_total = metrics.add(Counter(
+    "llm_fallbacks_total", "Responses served from a canned fallback after an LLM failure.", ("context",)))
+outbound_http_seconds = metrics.add(Histogram(
+    "outbound_http_request_duration_seconds", "Outbound HTTP latency by host and status.", ("host", "status")))
+loop_lag_seconds = metrics.add(Histogram(
+    "event_loop_lag_seconds", "Event-loop scheduling delay per sample.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)))
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self._pending: Dict[tuple, str] = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if not isinstance(target, str):
+            target = event.command.get("collection", "")
+        self._pending[(event.connection_id, event.request_id)] = target if isinstance(target, str) else ""
+
+    def _finish(self, event) -> str:
+        return self._pending.pop((event.connection_id, event.request_id), "")
+
+    def succeeded(self, event):
+        mongo_command_seconds.observe(event.duration_micros / 1e6, collection=self._finish(event), command=event.command_name)
+
+    def failed(self, event):
+        collection = self._finish(event)
+        mongo_command_seconds.observe(event.duration_micros / 1e6, collection=collection, command=event.command_name)
+        mongo_command_failures.inc(collection=collection, command=event.command_name)
+
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandMetrics()])
 db = client[os.environ['DB_NAME']]
 
 app = FastAPI()
@@ -42,6 +222,9 @@ class AnalyzeContentRequest(BaseModel):
     content: str
     platform: str = "general"
 
+class BatchAnalyzeContentRequest(BaseModel):
+    items: List[AnalyzeContentRequest]
+
 class VideoLinkRequest(BaseModel):
     url: str
 
@@ -109,9 +292,9 @@ PLANS = {
 }
 
 PLAN_FEATURES = {
-    "free": {"daily_limit": 3, "history_limit": 10, "competitors": False, "favorites": False, "advanced": False, "deep": False},
-    "pro": {"daily_limit": -1, "history_limit": -1, "competitors": True, "favorites": True, "advanced": True, "deep": False},
-    "premium": {"daily_limit": -1, "history_limit": -1, "competitors": True, "favorites": True, "advanced": True, "deep": True},
+    "free": {"daily_limit": 3, "history_limit": 10, "competitors": False, "favorites": False, "advanced": False, "deep": False, "export": False},
+    "pro": {"daily_limit": -1, "history_limit": -1, "competitors": True, "favorites": True, "advanced": True, "deep": False, "export": True},
+    "premium": {"daily_limit": -1, "history_limit": -1, "competitors": True, "favorites": True, "advanced": True, "deep": True, "export": True},
 }
 
 LEVELS = [
@@ -136,47 +319,839 @@ ACHIEVEMENTS_DEF = {
     "pro_upgrade": {"name": "Going Pro", "desc": "Upgrade to a paid plan", "xp": 50, "icon": "star"},
 }
 
-# ── Auth Helpers ────────────────────────────────────────
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+# ── Indexes ─────────────────────────────────────────────
+# Declared indexes per collection: (keys, options). ensure_indexes() reconciles
+# these on startup, rebuilding any index whose definition has drifted.
+INDEX_SPECS = {
+    "users": [
+        ([("user_id", ASCENDING)], {"name": "user_id_unique", "unique": True}),
+        ([("email", ASCENDING)], {"name": "email_unique", "unique": True}),
+    ],
+    "user_sessions": [
+        ([("session_token", ASCENDING)], {"name": "session_token_unique", "unique": True}),
+        ([("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+        ([("user_id", ASCENDING)], {"name": "user_id"}),
+    ],
+    "session_revocations": [
+        ([("key", ASCENDING)], {"name": "key_unique", "unique": True}),
+        ([("revoked_at", ASCENDING)], {"name": "revoked_at"}),
+        ([("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+    ],
+    "analyses": [
+        ([("analysis_id", ASCENDING)], {"name": "analysis_id_unique", "unique": True}),
+        ([("user_id", ASCENDING), ("created_at", DESCENDING), ("analysis_id", DESCENDING)], {"name": "user_created"}),
+        ([("user_id", ASCENDING), ("favorited", ASCENDING), ("created_at", DESCENDING), ("analysis_id", DESCENDING)],
+         {"name": "user_favorites", "partialFilterExpression": {"favorited": True}}),
+        # Search: the user_id prefix keeps each lookup inside one user's history.
+        ([("user_id", ASCENDING)] + [(f, TEXT) for f in (
+            "content", "video_data.title", "video_data.description", "video_data.hashtags", "result.summary",
+            "result.strengths", "result.weaknesses", "result.suggestions", "result.hashtag_recommendations")],
+         {"name": "user_text", "weights": {"content": 5, "video_data.title": 4, "video_data.hashtags": 3,
+                                           "video_data.description": 2, "result.summary": 2}}),
+    ],
+    "payment_transactions": [
+        ([("session_id", ASCENDING)], {"name": "session_id_unique", "unique": True}),
+        ([("user_id", ASCENDING), ("created_at", DESCENDING)], {"name": "user_created"}),
+    ],
+    "user_stats": [
+        ([("user_id", ASCENDING)], {"name": "user_id_unique", "unique": True}),
+    ],
+    "user_rollups": [
+        ([("user_id", ASCENDING)], {"name": "user_id_unique", "unique": True}),
+    ],
+    "user_achievements": [
+        ([("user_id", ASCENDING), ("achievement_id", ASCENDING)], {"name": "user_achievement_unique", "unique": True}),
+    ],
+    "social_connections": [
+        ([("user_id", ASCENDING), ("platform", ASCENDING)], {"name": "user_platform_unique", "unique": True}),
+    ],
+    "growth_plans": [
+        ([("user_id", ASCENDING)], {"name": "user_id_unique", "unique": True}),
+    ],
+    "analysis_cache": [
+        ([("key", ASCENDING)], {"name": "key_unique", "unique": True}),
+        ([("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+        ([("last_hit_at", ASCENDING)], {"name": "last_hit_at"}),
+    ],
+    "analysis_jobs": [
+        ([("job_id", ASCENDING)], {"name": "job_id_unique", "unique": True}),
+        ([("status", ASCENDING), ("created_at", ASCENDING)], {"name": "status_created"}),
+        ([("user_id", ASCENDING), ("created_at", DESCENDING)], {"name": "user_created"}),
+        ([("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+    ],
+    "daily_quotas": [
+        ([("user_id", ASCENDING), ("day", ASCENDING)], {"name": "user_day_unique", "unique": True}),
+        ([("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+        ([("pending.until", ASCENDING)], {"name": "pending_until"}),
+    ],
+}
+
+# Hot query shapes checked by /admin/index-report: (collection, filter, sort).
+HOT_QUERIES = [
+    ("users", {"email": "explain@example.com"}, None),
+    ("users", {"user_id": "user_explain"}, None),
+    ("user_sessions", {"session_token": "sess_explain"}, None),
+    ("session_revocations", {"key": "jti:explain"}, None),
+    ("analyses", {"user_id": "user_explain"}, [("created_at", DESCENDING), ("analysis_id", DESCENDING)]),
+    ("analyses", {"user_id": "user_explain", "favorited": True}, [("created_at", DESCENDING), ("analysis_id", DESCENDING)]),
+    ("analyses", {"analysis_id": "an_explain", "user_id": "user_explain"}, None),
+    ("analyses", {"user_id": "user_explain", "$text": {"$search": "explain"}}, None),
+    ("payment_transactions", {"session_id": "cs_explain"}, None),
+    ("payment_transactions", {"user_id": "user_explain"}, [("created_at", DESCENDING)]),
+    ("user_stats", {"user_id": "user_explain"}, None),
+    ("user_achievements", {"user_id": "user_explain"}, None),
+    ("social_connections", {"user_id": "user_explain"}, None),
+    ("growth_plans", {"user_id": "user_explain"}, None),
+    ("daily_quotas", {"user_id": "user_explain", "day": "1970-01-01"}, None),
+    ("analysis_jobs", {"status": "queued"}, [("created_at", ASCENDING)]),
+    ("analysis_jobs", {"job_id": "job_explain", "user_id": "user_explain"}, None),
+]
+
+def _index_matches(current: dict, keys: list, opts: dict) -> bool:
+    text_fields = [k for k, v in keys if v == TEXT]
+    if text_fields:
+        # Text indexes report their fields as _fts/_ftsx plus a weights map
+        # (prefix keys only, which is all INDEX_SPECS uses).
+        if current.get("weights") != {f: opts.get("weights", {}).get(f, 1) for f in text_fields}:
+            return False
+        keys = [(k, v) for k, v in keys if v != TEXT] + [("_fts", "text"), ("_ftsx", 1)]
+    if [tuple(k) for k in current.get("key", [])] != [tuple(k) for k in keys]:
+        return False
+    for opt in ("unique", "expireAfterSeconds", "partialFilterExpression"):
+        if current.get(opt) != opts.get(opt):
+            return False
+    return True
+
+async def ensure_indexes():
+    # Unique indexes back correctness (upserts, quota and counter races), so
+    # failing to build one aborts startup; other failures are only logged.
+    missing_unique = []
+    for coll_name, specs in INDEX_SPECS.items():
+        coll = db[coll_name]
+        try:
+            existing = await coll.index_information()
+        except Exception:
+            existing = {}
+        for keys, opts in specs:
+            current = existing.get(opts["name"])
+            try:
+                if current and _index_matches(current, keys, opts):
+                    continue
+                if current:
+                    logger.info(f"Rebuilding drifted index {coll_name}.{opts['name']}")
+                    await coll.drop_index(opts["name"])
+                await coll.create_index(keys, **opts)
+            except Exception as e:
+                logger.error(f"Index {coll_name}.{opts['name']} could not be created: {e}")
+                if opts.get("unique"):
+                    missing_unique.append(f"{coll_name}.{opts['name']}")
+    if missing_unique:
+        raise RuntimeError(f"Required unique indexes could not be created: {', '.join(missing_unique)}")
+
+def _plan_stages(plan) -> list:
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for v in plan.values():
+            stages.extend(_plan_stages(v))
+    elif isinstance(plan, list):
+        for v in plan:
+            stages.extend(_plan_stages(v))
+    return stages
+
+async def explain_hot_queries() -> list:
+    report = []
+    for coll_name, query, sort in HOT_QUERIES:
+        find_cmd = {"find": coll_name, "filter": query}
+        if sort:
+            find_cmd["sort"] = dict(sort)
+        entry = {"collection": coll_name, "filter": query, "sort": dict(sort) if sort else None}
+        try:
+            explained = await db.command({"explain": find_cmd, "verbosity": "queryPlanner"})
+            winning = explained.get("queryPlanner", {}).get("winningPlan", {})
+            stages = _plan_stages(winning)
+            entry.update({"stages": stages, "collection_scan": "COLLSCAN" in stages,
+                          "in_memory_sort": "SORT" in stages})
+        except Exception as e:
+            entry.update({"error": str(e), "collection_scan": None})
+        report.append(entry)
+    return report
+
+# ── Caches ──────────────────────────────────────────────
+def percentiles(samples, points=(50, 90, 99)) -> dict:
+    ordered = sorted(samples)
+    if not ordered:
+        return {f"p{p}": None for p in points}
+    return {f"p{p}": round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))], 2) for p in points}
+
+# Bounded in-process LRU cache whose entries also expire after a TTL. With
+# index=fn, entries are also grouped by fn(value) so invalidate_group() can
+# drop one group without scanning the cache.
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float, index=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.index = index
+        self._data: OrderedDict = OrderedDict()
+        self._groups: Dict[object, set] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _unlink(self, key, value):
+        if self.index is None:
+            return
+        group = self.index(value)
+        members = self._groups.get(group)
+        if members is not None:
+            members.discard(key)
+            if not members:
+                del self._groups[group]
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires = entry
+        if expires < time.monotonic():
+            del self._data[key]
+            self._unlink(key, value)
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key):
+        # Like get, but leaves recency and hit statistics alone.
+        entry = self._data.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        return entry[0]
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+        self.pop(key)
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        if self.index is not None:
+            self._groups.setdefault(self.index(value), set()).add(key)
+        while len(self._data) > self.maxsize:
+            old_key, (old_value, _) = self._data.popitem(last=False)
+            self._unlink(old_key, old_value)
+            self.evictions += 1
+
+    def pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return None
+        self._unlink(key, entry[0])
+        return entry[0]
+
+    def invalidate_group(self, group) -> int:
+        keys = self._groups.pop(group, ())
+        for k in keys:
+            self._data.pop(k, None)
+        return len(keys)
+
+    def clear(self):
+        self._data.clear()
+        self._groups.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
+
+# Resolved users keyed by session token; saves the two Mongo lookups in get_current_user.
+# The cache is per process: a hit is also checked against session_revocations,
+# so a logout or password change on another worker takes effect within
+# REVOCATION_SYNC_INTERVAL rather than SESSION_CACHE_TTL.
+session_cache = TTLCache(
+    maxsize=int(os.environ.get("SESSION_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("SESSION_CACHE_TTL", "60")),
+    index=lambda v: v["user"]["user_id"],
+)
+
+# One producer task whose items are replayed to every subscriber, including
+# ones that join after it has started. The task is not tied to any subscriber.
+class SharedStream:
+    def __init__(self, source):
+        self.items = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source):
+        try:
+            async for item in source:
+                self.items.append(item)
+                self._wake()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self):
+        i = 0
+        while True:
+            changed = self._changed
+            while i < len(self.items):
+                yield self.items[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+# Coalesces concurrent calls that share a key onto one task. The task is
+# shielded, so a caller that disconnects does not cancel it for the others.
+class SingleFlight:
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, SharedStream] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: str, fn):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._inflight.pop(key, None) if self._inflight.get(key) is t else None)
+            self.leaders += 1
+        else:
+            self.followers += 1
+        return await asyncio.shield(task)
+
+    def stream(self, key: str, source_fn):
+        # Streaming counterpart of do(): source_fn() is an async iterator
+        # started once per key; every caller receives all of its items.
+        shared = self._streams.get(key)
+        if shared is None:
+            shared = SharedStream(source_fn())
+            self._streams[key] = shared
+            shared.task.add_done_callback(lambda _: self._streams.pop(key, None) if self._streams.get(key) is shared else None)
+            self.leaders += 1
+        else:
+            self.followers += 1
+        return shared.subscribe()
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._inflight), "streams": len(self._streams),
+                "leaders": self.leaders, "followers": self.followers}
+
+inflight = SingleFlight()
+
+def invalidate_user_sessions(user_id: str):
+    session_cache.invalidate_group(user_id)
+
+# Assembled /dashboard/overview payloads (with their ETag) keyed by user_id.
+overview_cache = TTLCache(
+    maxsize=int(os.environ.get("OVERVIEW_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("OVERVIEW_CACHE_TTL", "5")),
+)
+
+def invalidate_overview(user_id: str):
+    overview_cache.pop(user_id)
+
+# ── Outbound HTTP ───────────────────────────────────────
+# One long-lived client per upstream host so keep-alive connections and
+# HTTP/2 (via h2, pinned in requirements.txt) are reused across requests.
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.environ.get("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+HTTP_MAX_KEEPALIVE_PER_HOST = int(os.environ.get("HTTP_MAX_KEEPALIVE_PER_HOST", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "10"))
+HTTP_POOL_TIMEOUT = float(os.environ.get("HTTP_POOL_TIMEOUT", "5"))
+# Hosts beyond this share a single fallback client instead of getting their own.
+HTTP_MAX_HOSTS = int(os.environ.get("HTTP_MAX_HOSTS", "32"))
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+    logger.warning("h2 is not installed; outbound requests will use HTTP/1.1 only")
+
+OAUTH_SESSION_URL = "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data"
+OUTBOUND_HOSTS = ["www.youtube.com", "www.tiktok.com", "api.instagram.com", "www.instagram.com",
+                  "demobackend.emergentagent.com"]
+
+class OutboundHTTP:
+    def __init__(self):
+        self._clients = {}
+        self._stats = {}
+
+    def _host_key(self, url: str) -> str:
+        host = (httpx.URL(url).host or "").lower()
+        if host in self._clients or len(self._clients) < HTTP_MAX_HOSTS:
+            return host
+        return "*"
+
+    def _client(self, host: str) -> httpx.AsyncClient:
+        hc = self._clients.get(host)
+        if hc is None:
+            limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS_PER_HOST,
+                                  max_keepalive_connections=HTTP_MAX_KEEPALIVE_PER_HOST,
+                                  keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
+            timeout = httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT)
+            hc = httpx.AsyncClient(http2=HTTP2_AVAILABLE, limits=limits, timeout=timeout)
+            self._clients[host] = hc
+            self._stats.setdefault(host, {"requests": 0, "errors": 0, "in_flight": 0, "latency_ms": deque(maxlen=500)})
+        return hc
+
+    def start(self, hosts=()):
+        for host in hosts:
+            self._client(host)
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        host = self._host_key(url)
+        hc = self._client(host)
+        st = self._stats[host]
+        st["requests"] += 1
+        st["in_flight"] += 1
+        started = time.monotonic()
+        status = "error"
+        try:
+            resp = await hc.request(method, url, **kwargs)
+            status = str(resp.status_code)
+            return resp
+        except Exception:
+            st["errors"] += 1
+            raise
+        finally:
+            st["in_flight"] -= 1
+            st["latency_ms"].append((time.monotonic() - started) * 1000)
+            outbound_http_seconds.observe(time.monotonic() - started, host=host, status=status)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs):
+        host = self._host_key(url)
+        hc = self._client(host)
+        st = self._stats[host]
+        st["requests"] += 1
+        st["in_flight"] += 1
+        started = time.monotonic()
+        status = "error"
+        try:
+            async with hc.stream(method, url, **kwargs) as resp:
+                status = str(resp.status_code)
+                yield resp
+        except Exception:
+            st["errors"] += 1
+            raise
+        finally:
+            st["in_flight"] -= 1
+            st["latency_ms"].append((time.monotonic() - started) * 1000)
+            outbound_http_seconds.observe(time.monotonic() - started, host=host, status=status)
+
+    async def aclose(self):
+        clients = list(self._clients.values())
+        self._clients.clear()
+        await asyncio.gather(*(hc.aclose() for hc in clients), return_exceptions=True)
+
+    def stats(self) -> dict:
+        hosts = {}
+        for host, st in self._stats.items():
+            hc = self._clients.get(host)
+            # httpx does not expose its pool publicly; read it defensively.
+            pool = getattr(getattr(hc, "_transport", None), "_pool", None)
+            conns = list(getattr(pool, "connections", None) or [])
+            idle = sum(1 for c in conns if c.is_idle())
+            hosts[host] = {"requests": st["requests"], "errors": st["errors"], "in_flight": st["in_flight"],
+                           "connections": len(conns), "idle_connections": idle,
+                           "utilization": round((len(conns) - idle) / HTTP_MAX_CONNECTIONS_PER_HOST, 3),
+                           "latency_ms": percentiles(st["latency_ms"])}
+        return {"http2": HTTP2_AVAILABLE, "max_connections_per_host": HTTP_MAX_CONNECTIONS_PER_HOST,
+                "max_keepalive_per_host": HTTP_MAX_KEEPALIVE_PER_HOST, "hosts": hosts}
+
+outbound_http = OutboundHTTP()
 
-def verify_password(password: str, hashed: str) -> bool:
+# ── Auth Helpers ────────────────────────────────────────
+# bcrypt runs on a dedicated, bounded thread pool so hashing never blocks the
+# event loop. Requests beyond BCRYPT_MAX_QUEUE waiting jobs are rejected.
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+BCRYPT_WORKERS = int(os.environ.get("BCRYPT_WORKERS", "4"))
+BCRYPT_MAX_QUEUE = int(os.environ.get("BCRYPT_MAX_QUEUE", "64"))
+bcrypt_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+bcrypt_stats = {"pending": 0, "max_pending": 0, "completed": 0, "rejected": 0, "rehashed": 0,
+                "wait_ms_total": 0.0, "run_ms_total": 0.0}
+_bcrypt_stats_lock = threading.Lock()
+
+def _timed_bcrypt(fn, submitted: float, *args):
+    started = time.monotonic()
+    try:
+        return fn(*args)
+    finally:
+        finished = time.monotonic()
+        with _bcrypt_stats_lock:
+            bcrypt_stats["wait_ms_total"] += (started - submitted) * 1000
+            bcrypt_stats["run_ms_total"] += (finished - started) * 1000
+
+async def run_bcrypt(fn, *args):
+    if bcrypt_stats["pending"] >= BCRYPT_WORKERS + BCRYPT_MAX_QUEUE:
+        bcrypt_stats["rejected"] += 1
+        raise HTTPException(status_code=503, detail="Authentication is busy, please retry shortly")
+    bcrypt_stats["pending"] += 1
+    bcrypt_stats["max_pending"] = max(bcrypt_stats["max_pending"], bcrypt_stats["pending"])
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(bcrypt_executor, _timed_bcrypt, fn, time.monotonic(), *args)
+    finally:
+        bcrypt_stats["pending"] -= 1
+        bcrypt_stats["completed"] += 1
+
+def bcrypt_pool_stats() -> dict:
+    with _bcrypt_stats_lock:
+        stats = dict(bcrypt_stats)
+    done = stats["completed"] or 1
+    return {**stats, "workers": BCRYPT_WORKERS, "rounds": BCRYPT_ROUNDS, "max_queue": BCRYPT_MAX_QUEUE,
+            "queue_depth": max(0, stats["pending"] - BCRYPT_WORKERS),
+            "avg_wait_ms": round(stats["wait_ms_total"] / done, 2), "avg_run_ms": round(stats["run_ms_total"] / done, 2)}
+
+def _hashpw(password: str) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
+
+def _checkpw(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode(), hashed.encode())
 
-async def create_session(user_id: str) -> str:
+async def hash_password(password: str) -> str:
+    return await run_bcrypt(_hashpw, password)
+
+async def verify_password(password: str, hashed: str) -> bool:
+    return await run_bcrypt(_checkpw, password, hashed)
+
+def bcrypt_cost(hashed: str) -> int:
+    # "$2b$12$..." -> 12
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError):
+        return 0
+
+# Sessions come in two kinds. Opaque "sess_" tokens are rows in user_sessions
+# (expired rows are reaped by the TTL index) and cost a lookup on a cache miss.
+# Signed "st1." tokens carry user_id, plan, issue and expiry times under an
+# HMAC and verify with no database reads; SESSION_MODE picks which kind new
+# logins get, and both kinds are accepted whenever they can be checked.
+SESSION_TTL = timedelta(days=7)
+SESSION_MODE = os.environ.get("SESSION_MODE", "opaque")
+# Comma-separated: the first key signs, every key verifies (for rotation).
+SESSION_SIGNING_KEYS = [k.strip().encode() for k in os.environ.get("SESSION_SIGNING_KEYS", "").split(",") if k.strip()]
+SIGNED_SESSION_PREFIX = "st1"
+if SESSION_MODE == "signed" and not SESSION_SIGNING_KEYS:
+    logger.warning("SESSION_MODE=signed without SESSION_SIGNING_KEYS; issuing opaque sessions")
+    SESSION_MODE = "opaque"
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _session_mac(key: bytes, body: str) -> bytes:
+    return hmac.new(key, body.encode(), hashlib.sha256).digest()
+
+def sign_session(user_id: str, plan: str) -> str:
+    now = time.time()
+    claims = {"uid": user_id, "plan": plan, "iat": int(now * 1000),
+              "exp": int(now + SESSION_TTL.total_seconds()), "jti": uuid.uuid4().hex}
+    body = f"{SIGNED_SESSION_PREFIX}.{_b64encode(json.dumps(claims, separators=(',', ':')).encode())}"
+    return f"{body}.{_b64encode(_session_mac(SESSION_SIGNING_KEYS[0], body))}"
+
+def verify_signed_session(token: str) -> dict:
+    try:
+        prefix, payload, sig = token.split(".")
+        sig = _b64decode(sig)
+    except ValueError:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    body = f"{prefix}.{payload}"
+    if not any(hmac.compare_digest(_session_mac(key, body), sig) for key in SESSION_SIGNING_KEYS):
+        raise HTTPException(status_code=401, detail="Invalid session")
+    claims = json.loads(_b64decode(payload))
+    if claims["exp"] < time.time():
+        raise HTTPException(status_code=401, detail="Session expired")
+    return claims
+
+def is_signed_session(token: str) -> bool:
+    return token.startswith(SIGNED_SESSION_PREFIX + ".")
+
+async def create_session(user_id: str, plan: str = "free") -> str:
+    if SESSION_MODE == "signed":
+        return sign_session(user_id, plan)
     session_token = f"sess_{uuid.uuid4().hex}"
     await db.user_sessions.insert_one({
         "user_id": user_id,
         "session_token": session_token,
-        "expires_at": datetime.now(timezone.utc) + timedelta(days=7),
+        "expires_at": datetime.now(timezone.utc) + SESSION_TTL,
         "created_at": datetime.now(timezone.utc),
     })
     return session_token
 
-async def get_current_user(request: Request) -> dict:
-    token = None
+# ── Session Revocation ──────────────────────────────────
+# Signed sessions cannot be deleted, and opaque ones may sit in another
+# worker's session_cache, so logout and password changes record a revocation
+# in session_revocations (TTL'd at the latest expiry it can affect) and every
+# process mirrors it in memory:
+#   - "user:<id>" entries hold a cutoff; sessions issued before it are revoked.
+#     There are few of these, so they are kept exactly.
+#   - "jti:<id>" (signed) and "sess:<sha256>" (opaque) entries revoke one
+#     session. They go into a bloom filter, so the usual "not revoked" answer
+#     costs no I/O; a hit is confirmed against Mongo.
+#   - "plan:<id>" entries hold the time of the user's last plan change. Signed
+#     sessions issued before it carry a stale plan, so their plan is re-read.
+# Other processes pick up revocations on the next incremental sync.
+REVOCATION_SYNC_INTERVAL = float(os.environ.get("REVOCATION_SYNC_INTERVAL", "10"))
+REVOCATION_FULL_SYNC_INTERVAL = float(os.environ.get("REVOCATION_FULL_SYNC_INTERVAL", "3600"))
+REVOCATION_BLOOM_CAPACITY = int(os.environ.get("REVOCATION_BLOOM_CAPACITY", "100000"))
+REVOCATION_BLOOM_ERROR_RATE = float(os.environ.get("REVOCATION_BLOOM_ERROR_RATE", "0.001"))
+# Incremental syncs re-read this much history to tolerate clock skew between writers.
+REVOCATION_SYNC_OVERLAP = timedelta(seconds=30)
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+def opaque_revocation_key(token: str) -> str:
+    return "sess:" + hashlib.sha256(token.encode()).hexdigest()
+
+class SessionRevocations:
+    def __init__(self):
+        self.bloom = BloomFilter(REVOCATION_BLOOM_CAPACITY, REVOCATION_BLOOM_ERROR_RATE)
+        self.user_cutoffs: Dict[str, int] = {}
+        self.plan_changes: Dict[str, int] = {}
+        self.synced_until: Optional[datetime] = None
+        self.full_synced_at = 0.0
+        self.task: Optional[asyncio.Task] = None
+        self.counters = {"checks": 0, "bloom_hits": 0, "false_positives": 0, "revoked": 0, "syncs": 0, "sync_errors": 0}
+
+    def _apply(self, doc: dict, bloom: BloomFilter, cutoffs: Dict[str, int], plans: Dict[str, int]):
+        if doc["kind"] == "user":
+            cutoffs[doc["user_id"]] = max(cutoffs.get(doc["user_id"], 0), doc["revoked_before_ms"])
+        elif doc["kind"] == "plan":
+            plans[doc["user_id"]] = max(plans.get(doc["user_id"], 0), doc["changed_ms"])
+        else:
+            bloom.add(doc["key"])
+
+    async def _revoke_key(self, key: str, user_id: str, expires_at: datetime):
+        doc = {"key": key, "kind": "token", "user_id": user_id, "revoked_at": datetime.now(timezone.utc),
+               "expires_at": expires_at}
+        await db.session_revocations.update_one({"key": key}, {"$setOnInsert": doc}, upsert=True)
+        self._apply(doc, self.bloom, self.user_cutoffs, self.plan_changes)
+
+    async def revoke_token(self, claims: dict):
+        await self._revoke_key(f"jti:{claims['jti']}", claims["uid"], datetime.fromtimestamp(claims["exp"], timezone.utc))
+
+    async def revoke_opaque(self, token: str, user_id: str, expires_at: datetime):
+        await self._revoke_key(opaque_revocation_key(token), user_id, expires_at)
+
+    async def revoke_user(self, user_id: str):
+        # Revokes every session issued to the user up to now.
+        now = datetime.now(timezone.utc)
+        cutoff = int(time.time() * 1000)
+        await db.session_revocations.update_one(
+            {"key": f"user:{user_id}"},
+            {"$set": {"kind": "user", "user_id": user_id, "revoked_at": now, "expires_at": now + SESSION_TTL},
+             "$max": {"revoked_before_ms": cutoff}},
+            upsert=True,
+        )
+        self._apply({"kind": "user", "user_id": user_id, "revoked_before_ms": cutoff}, self.bloom, self.user_cutoffs,
+                    self.plan_changes)
+
+    async def record_plan_change(self, user_id: str):
+        # Signed sessions issued before now carry the old plan.
+        now = datetime.now(timezone.utc)
+        changed = int(time.time() * 1000)
+        await db.session_revocations.update_one(
+            {"key": f"plan:{user_id}"},
+            {"$set": {"kind": "plan", "user_id": user_id, "revoked_at": now, "expires_at": now + SESSION_TTL},
+             "$max": {"changed_ms": changed}},
+            upsert=True,
+        )
+        self._apply({"kind": "plan", "user_id": user_id, "changed_ms": changed}, self.bloom, self.user_cutoffs,
+                    self.plan_changes)
+
+    def plan_changed_ms(self, user_id: str) -> int:
+        return self.plan_changes.get(user_id, 0)
+
+    async def is_revoked(self, claims: dict) -> bool:
+        return await self._check(f"jti:{claims['jti']}", claims["uid"], claims["iat"])
+
+    async def is_opaque_revoked(self, token: str, user_id: str, issued_ms: int) -> bool:
+        return await self._check(opaque_revocation_key(token), user_id, issued_ms)
+
+    async def _check(self, key: str, user_id: str, issued_ms: int) -> bool:
+        self.counters["checks"] += 1
+        if issued_ms < self.user_cutoffs.get(user_id, 0):
+            self.counters["revoked"] += 1
+            return True
+        if key not in self.bloom:
+            return False
+        self.counters["bloom_hits"] += 1
+        if await db.session_revocations.find_one({"key": key}, {"_id": 1}):
+            self.counters["revoked"] += 1
+            return True
+        self.counters["false_positives"] += 1
+        return False
+
+    async def sync(self, full: bool = False):
+        now = datetime.now(timezone.utc)
+        query = {"expires_at": {"$gt": now}}
+        if not full and self.synced_until is not None:
+            query["revoked_at"] = {"$gte": self.synced_until - REVOCATION_SYNC_OVERLAP}
+        if full:
+            # Rebuild from scratch so expired entries drop out of the filter.
+            count = await db.session_revocations.count_documents({"kind": "token", "expires_at": {"$gt": now}})
+            bloom = BloomFilter(max(REVOCATION_BLOOM_CAPACITY, count * 2), REVOCATION_BLOOM_ERROR_RATE)
+            cutoffs: Dict[str, int] = {}
+            plans: Dict[str, int] = {}
+        else:
+            bloom, cutoffs, plans = self.bloom, self.user_cutoffs, self.plan_changes
+        async for doc in db.session_revocations.find(query, {"_id": 0}):
+            self._apply(doc, bloom, cutoffs, plans)
+        if full:
+            # Anything written while this ran is re-read by the next
+            # incremental sync, which overlaps the window.
+            self.bloom, self.user_cutoffs, self.plan_changes = bloom, cutoffs, plans
+            self.full_synced_at = time.monotonic()
+        self.synced_until = now
+        self.counters["syncs"] += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(REVOCATION_SYNC_INTERVAL)
+            try:
+                await self.sync(full=time.monotonic() - self.full_synced_at >= REVOCATION_FULL_SYNC_INTERVAL)
+            except Exception as e:
+                self.counters["sync_errors"] += 1
+                logger.warning(f"Session revocation sync failed: {e}")
+
+    async def start(self):
+        await self.sync(full=True)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def stats(self) -> dict:
+        return {**self.counters, "mode": SESSION_MODE, "signing_keys": len(SESSION_SIGNING_KEYS),
+                "revoked_tokens": self.bloom.count, "bloom_bits": self.bloom.size, "bloom_hashes": self.bloom.hashes,
+                "user_cutoffs": len(self.user_cutoffs), "plan_changes": len(self.plan_changes),
+                "synced_until": self.synced_until.isoformat() if self.synced_until else None}
+
+session_revocations = SessionRevocations()
+
+# Current plans of users whose signed sessions predate a plan change, keyed by
+# user_id. An entry read before the latest known change is not used.
+plan_cache = TTLCache(
+    maxsize=int(os.environ.get("PLAN_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("SESSION_CACHE_TTL", "60")),
+)
+
+async def current_plan(user_id: str, changed_ms: int) -> str:
+    cached = plan_cache.get(user_id)
+    if cached is not None and cached["read_ms"] >= changed_ms:
+        return cached["plan"]
+    read_ms = int(time.time() * 1000)
+    user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "plan": 1})
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    plan_cache.set(user_id, {"plan": user.get("plan", "free"), "read_ms": read_ms})
+    return user.get("plan", "free")
+
+async def set_user_plan(user_id: str, plan: str):
+    # The one place plans change: every cached or signed copy is invalidated.
+    await db.users.update_one({"user_id": user_id},
+                              {"$set": {"plan": plan, "plan_updated_at": datetime.now(timezone.utc).isoformat()}})
+    await session_revocations.record_plan_change(user_id)
+    plan_cache.pop(user_id)
+    invalidate_user_sessions(user_id)
+    invalidate_overview(user_id)
+
+def _as_utc(value) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+def request_session_token(request: Request) -> Optional[str]:
     cookie_token = request.cookies.get("session_token")
     auth_header = request.headers.get("Authorization")
     if cookie_token:
-        token = cookie_token
-    elif auth_header and auth_header.startswith("Bearer "):
-        token = auth_header.split(" ")[1]
+        return cookie_token
+    if auth_header and auth_header.startswith("Bearer "):
+        return auth_header.split(" ")[1]
+    return None
+
+async def get_current_user(request: Request) -> dict:
+    token = request_session_token(request)
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
+    if is_signed_session(token):
+        # Only user_id and plan are carried; routes needing more load the user.
+        claims = verify_signed_session(token)
+        if await session_revocations.is_revoked(claims):
+            raise HTTPException(status_code=401, detail="Session revoked")
+        changed_ms = session_revocations.plan_changed_ms(claims["uid"])
+        if claims["iat"] < changed_ms:
+            # Issued before the plan changed; the claimed plan may be stale.
+            return {"user_id": claims["uid"], "plan": await current_plan(claims["uid"], changed_ms)}
+        return {"user_id": claims["uid"], "plan": claims["plan"]}
+    cached = session_cache.get(token)
+    if cached is not None:
+        uid = cached["user"]["user_id"]
+        if (cached["expires_at"] >= datetime.now(timezone.utc)
+                and cached["loaded_ms"] >= session_revocations.plan_changed_ms(uid)
+                and not await session_revocations.is_opaque_revoked(token, uid, cached["issued_ms"])):
+            return dict(cached["user"])
+        session_cache.pop(token)
     session = await db.user_sessions.find_one({"session_token": token}, {"_id": 0})
     if not session:
         raise HTTPException(status_code=401, detail="Invalid session")
-    expires_at = session["expires_at"]
-    if isinstance(expires_at, str):
-        expires_at = datetime.fromisoformat(expires_at)
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    expires_at = _as_utc(session["expires_at"])
     if expires_at < datetime.now(timezone.utc):
         raise HTTPException(status_code=401, detail="Session expired")
+    loaded_ms = int(time.time() * 1000)
     user = await db.users.find_one({"user_id": session["user_id"]}, {"_id": 0})
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
-    return user
+    issued_ms = int(_as_utc(session.get("created_at", expires_at - SESSION_TTL)).timestamp() * 1000)
+    session_cache.set(token, {"user": user, "expires_at": expires_at, "issued_ms": issued_ms, "loaded_ms": loaded_ms})
+    return dict(user)
 
 def set_session_cookie(response: Response, token: str):
     response.set_cookie(
@@ -205,60 +1180,431 @@ def get_level_info(xp: int) -> dict:
             "next_xp": nxt["xp"] if nxt else None, "next_name": nxt["name"] if nxt else None,
             "progress": round(progress, 1)}
 
-async def award_xp(user_id: str, amount: int, reason: str):
-    await db.user_stats.update_one(
-        {"user_id": user_id},
-        {"$inc": {"xp": amount}, "$setOnInsert": {"user_id": user_id}},
-        upsert=True,
-    )
-
 async def get_xp(user_id: str) -> int:
     s = await db.user_stats.find_one({"user_id": user_id}, {"_id": 0})
     return s.get("xp", 0) if s else 0
 
-async def check_and_award_achievements(user_id: str, analysis_count: int = 0, viral_score: int = 0):
-    earned = await db.user_achievements.find({"user_id": user_id}, {"_id": 0}).to_list(100)
-    earned_ids = {a["achievement_id"] for a in earned}
-    new = []
-    checks = [
-        ("first_analysis", analysis_count >= 1),
-        ("analysis_10", analysis_count >= 10),
-        ("analysis_25", analysis_count >= 25),
-        ("viral_80", viral_score >= 80),
-        ("viral_95", viral_score >= 95),
+# Analysis achievements are evaluated against counters kept in user_stats
+# (analysis_count, best_viral_score) plus the ids already granted ("badges"),
+# so the hot path is a single atomic update. Granting writes the achievement
+# row first, then adds the badge and its XP in one conditional update on
+# user_stats; "badges" is the record that XP was paid, so racing requests
+# report a badge once, and a grant interrupted between the two writes is
+# completed by the user's next analysis.
+def analysis_achievement_checks(stats: dict) -> list:
+    count = stats.get("analysis_count", 0)
+    best = stats.get("best_viral_score", 0)
+    return [
+        ("first_analysis", count >= 1),
+        ("analysis_10", count >= 10),
+        ("analysis_25", count >= 25),
+        ("viral_80", best >= 80),
+        ("viral_95", best >= 95),
+        ("streak_3", stats.get("streak_current", 0) >= 3),
+        ("streak_7", stats.get("streak_current", 0) >= 7),
     ]
-    for aid, cond in checks:
-        if cond and aid not in earned_ids:
-            new.append(aid)
-            await db.user_achievements.insert_one({
-                "user_id": user_id, "achievement_id": aid,
-                "earned_at": datetime.now(timezone.utc).isoformat(),
-            })
-            await award_xp(user_id, ACHIEVEMENTS_DEF[aid]["xp"], f"Achievement: {ACHIEVEMENTS_DEF[aid]['name']}")
-    return new
+
+def viral_score_of(analysis: dict) -> float:
+    try:
+        return float(analysis.get("viral_score", 0) or 0)
+    except (TypeError, ValueError):
+        return 0
+
+# Documents from before the counters existed are seeded once, and counters
+# only move on seeded documents, so the $set cannot overwrite live increments.
+# Analyses newer than counters_since are left to the requests that inserted
+# them, which increment after the seed; the margin covers the gap between a
+# record's created_at and its insert.
+COUNTER_SEED_MARGIN = timedelta(seconds=60)
+
+async def seed_user_counters(user_id: str) -> Optional[str]:
+    since = (datetime.now(timezone.utc) - COUNTER_SEED_MARGIN).isoformat()
+    count = await db.analyses.count_documents({"user_id": user_id, "created_at": {"$lt": since}})
+    best = await db.analyses.find({"user_id": user_id, "created_at": {"$lt": since}},
+                                  {"_id": 0, "result.viral_score": 1}).sort("result.viral_score", -1).to_list(1)
+    earned = await db.user_achievements.find({"user_id": user_id}, {"_id": 0, "achievement_id": 1}).to_list(100)
+    seeded = {"analysis_count": count, "best_viral_score": viral_score_of(best[0].get("result", {})) if best else 0,
+              "badges": [a["achievement_id"] for a in earned], "counters_seeded": True, "counters_since": since}
+    result = await db.user_stats.update_one({"user_id": user_id, "counters_seeded": {"$exists": False}},
+                                            {"$set": seeded})
+    if result.modified_count:
+        return since
+    # Someone else seeded (or created) the document first; use their boundary.
+    doc = await db.user_stats.find_one({"user_id": user_id}, {"_id": 0, "counters_since": 1})
+    return (doc or {}).get("counters_since")
+
+async def bump_user_counters(user_id: str, records: list, since: Optional[str] = None) -> dict:
+    counted = [r for r in records if since is None or r["created_at"] >= since]
+    best = max(viral_score_of(r["result"]) for r in records)
+    return await db.user_stats.find_one_and_update(
+        {"user_id": user_id, "counters_seeded": True},
+        {"$inc": {"xp": 10 * len(records), "analysis_count": len(counted)},
+         "$max": {"best_viral_score": best}, "$setOnInsert": {"user_id": user_id}},
+        projection={"_id": 0, "analysis_count": 1, "best_viral_score": 1, "badges": 1,
+                    "last_active_day": 1, "streak_current": 1, "streak_longest": 1},
+        upsert=True, return_document=ReturnDocument.AFTER,
+    )
+
+async def update_user_counters(user_id: str, records: list) -> dict:
+    try:
+        return await bump_user_counters(user_id, records)
+    except DuplicateKeyError:
+        # The document exists but is unseeded (or a concurrent first request
+        # just created it); seed, then count only what the seed left out.
+        return await bump_user_counters(user_id, records, await seed_user_counters(user_id))
+
+async def grant_achievements(user_id: str, achievement_ids: list) -> list:
+    now = datetime.now(timezone.utc).isoformat()
+    ops = [UpdateOne({"user_id": user_id, "achievement_id": aid},
+                     {"$setOnInsert": {"user_id": user_id, "achievement_id": aid, "earned_at": now}}, upsert=True)
+           for aid in achievement_ids]
+    try:
+        await db.user_achievements.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        # Duplicate keys mean a concurrent request wrote the row first.
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+    results = await asyncio.gather(*(
+        db.user_stats.update_one({"user_id": user_id, "badges": {"$ne": aid}},
+                                 {"$addToSet": {"badges": aid}, "$inc": {"xp": ACHIEVEMENTS_DEF[aid]["xp"]}})
+        for aid in achievement_ids
+    ))
+    granted = [aid for aid, r in zip(achievement_ids, results) if r.modified_count]
+    if granted:
+        invalidate_overview(user_id)
+    return granted
+
+# Streaks are tracked incrementally: the first analysis of a UTC day extends
+# the streak if the previous active day was yesterday, otherwise restarts it.
+# The update is conditional on the last_active_day it read, so concurrent
+# requests on the same day advance it once.
+async def advance_streak(user_id: str, stats: dict) -> dict:
+    today = _utc_day()
+    last = stats.get("last_active_day")
+    if last == today:
+        return stats
+    current = stats.get("streak_current", 0) + 1 if last == _utc_day(1) else 1
+    await db.user_stats.update_one(
+        {"user_id": user_id, "last_active_day": last},
+        {"$set": {"last_active_day": today, "streak_current": current}, "$max": {"streak_longest": current}},
+    )
+    return {**stats, "last_active_day": today, "streak_current": current,
+            "streak_longest": max(stats.get("streak_longest", 0), current)}
+
+def streak_view(stats: Optional[dict]) -> dict:
+    stats = stats or {}
+    last = stats.get("last_active_day")
+    alive = last is not None and last >= _utc_day(1)
+    return {"current": stats.get("streak_current", 0) if alive else 0,
+            "longest": stats.get("streak_longest", 0), "last_active_day": last}
+
+reward_tasks = set()
+
+def in_background(coro, label: str):
+    async def run():
+        try:
+            await coro
+        except Exception as e:
+            logger.error(f"{label} failed: {e}")
+    task = asyncio.create_task(run())
+    reward_tasks.add(task)
+    task.add_done_callback(reward_tasks.discard)
+
+async def award_analysis_rewards(user_id: str, records: list) -> list:
+    # records are the analyses documents just inserted for this user.
+    stats, _ = await asyncio.gather(
+        update_user_counters(user_id, records),
+        update_user_rollup(user_id, records),
+    )
+    stats = await advance_streak(user_id, stats)
+    invalidate_overview(user_id)
+    badges = set(stats.get("badges", []))
+    new = [aid for aid, cond in analysis_achievement_checks(stats) if cond and aid not in badges]
+    if not new:
+        return []
+    try:
+        return await grant_achievements(user_id, new)
+    except Exception as e:
+        # Nothing reported is lost: badges not yet in user_stats are granted
+        # again on the next analysis. The analysis itself is already stored.
+        logger.error(f"Achievement grant failed: {e}")
+        return []
+
+# Daily quota: one counter document per user per UTC day. "count" includes
+# in-flight reservations so concurrent requests cannot overshoot the limit;
+# "reserved" tracks how many of those are not yet committed, and "pending"
+# lists them. Settling removes the reservation's pending entry in the same
+# update, so it applies at most once. A reservation whose holder died without
+# settling is refunded by the reaper once its hold runs out; queued jobs hold
+# theirs (hold=None) until the job settles it.
+QUOTA_HOLD_SECONDS = float(os.environ.get("QUOTA_HOLD_SECONDS", "900"))
+QUOTA_REAP_INTERVAL = float(os.environ.get("QUOTA_REAP_INTERVAL", "60"))
+def _utc_day(days_ago: int = 0) -> str:
+    return (datetime.now(timezone.utc) - timedelta(days=days_ago)).strftime("%Y-%m-%d")
 
 async def check_daily_limit(user_id: str, plan: str) -> tuple:
     features = PLAN_FEATURES.get(plan, PLAN_FEATURES["free"])
     limit = features["daily_limit"]
     if limit == -1:
         return True, -1, 0
-    today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
-    count = await db.analyses.count_documents({"user_id": user_id, "created_at": {"$gte": today_start}})
+    doc = await db.daily_quotas.find_one({"user_id": user_id, "day": _utc_day()}, {"_id": 0, "count": 1})
+    count = doc.get("count", 0) if doc else 0
     return count < limit, limit, count
 
+async def reserve_daily_quota(user_id: str, plan: str, amount: int = 1,
+                              hold: Optional[float] = QUOTA_HOLD_SECONDS) -> dict:
+    limit = get_plan_features(plan)["daily_limit"]
+    if limit == -1:
+        return {"allowed": True, "limit": -1, "used": 0, "day": None, "amount": amount}
+    day = _utc_day()
+    if amount > limit:
+        return {"allowed": False, "limit": limit, "used": None, "day": day, "amount": amount}
+    expires_at = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc) + timedelta(days=2)
+    rid = uuid.uuid4().hex
+    pending = {"rid": rid, "amount": amount}
+    if hold is not None:
+        pending["until"] = datetime.now(timezone.utc) + timedelta(seconds=hold)
+    doc = None
+    # A duplicate key means the day's document already exists; the retry either
+    # matches it (quota left) or hits the duplicate again (quota exhausted).
+    for _ in range(2):
+        try:
+            doc = await db.daily_quotas.find_one_and_update(
+                {"user_id": user_id, "day": day, "count": {"$lte": limit - amount}},
+                {"$inc": {"count": amount, "reserved": amount}, "$push": {"pending": pending},
+                 "$setOnInsert": {"expires_at": expires_at}},
+                projection={"_id": 0}, upsert=True, return_document=ReturnDocument.AFTER,
+            )
+            break
+        except DuplicateKeyError:
+            continue
+    if doc is None:
+        return {"allowed": False, "limit": limit, "used": limit, "day": day, "amount": amount}
+    return {"allowed": True, "limit": limit, "used": doc["count"] - amount, "day": day, "user_id": user_id,
+            "amount": amount, "rid": rid}
+
+async def settle_daily_quota(reservation: dict, used: int) -> bool:
+    # Keeps `used` of the reserved analyses and hands the rest back. Returns
+    # False if the reservation was already settled (or reaped).
+    if not reservation.get("day"):
+        return False
+    amount = reservation.get("amount", 1)
+    flt = {"user_id": reservation["user_id"], "day": reservation["day"]}
+    update = {"$inc": {"count": used - amount, "reserved": -amount}}
+    if reservation.get("rid"):
+        # Reservations carried by jobs queued before pending existed have no rid.
+        flt["pending.rid"] = reservation["rid"]
+        update["$pull"] = {"pending": {"rid": reservation["rid"]}}
+    result = await db.daily_quotas.update_one(flt, update)
+    return bool(result.modified_count)
+
+async def commit_daily_quota(reservation: dict) -> bool:
+    return await settle_daily_quota(reservation, reservation.get("amount", 1))
+
+async def refund_daily_quota(reservation: dict) -> bool:
+    return await settle_daily_quota(reservation, 0)
+
+async def reap_stale_reservations() -> int:
+    now = datetime.now(timezone.utc)
+    reaped = 0
+    cursor = db.daily_quotas.find({"pending.until": {"$lt": now}}, {"_id": 0, "user_id": 1, "day": 1, "pending": 1})
+    async for doc in cursor:
+        for entry in doc["pending"]:
+            if entry.get("until") is not None and _as_utc(entry["until"]) < now:
+                reaped += await refund_daily_quota({"user_id": doc["user_id"], "day": doc["day"], **entry})
+    if reaped:
+        logger.warning(f"Refunded {reaped} daily quota reservations that were never settled")
+    return reaped
+
+quota_reaper_task: Optional[asyncio.Task] = None
+
+async def quota_reaper():
+    while True:
+        await asyncio.sleep(QUOTA_REAP_INTERVAL)
+        try:
+            await reap_stale_reservations()
+        except Exception as e:
+            logger.warning(f"Quota reservation reaper failed: {e}")
+
 def get_plan_features(plan: str) -> dict:
     return PLAN_FEATURES.get(plan, PLAN_FEATURES["free"])
 
-def detect_platform(url: str) -> Optional[str]:
-    u = url.lower().strip()
-    if "youtube.com" in u or "youtu.be" in u:
-        return "youtube"
-    if "tiktok.com" in u or "vm.tiktok.com" in u:
-        return "tiktok"
-    if "instagram.com" in u:
-        return "instagram"
+# Video URLs arrive in many shapes (youtu.be/X, m.youtube.com/shorts/X,
+# watch?v=X&si=..., vm.tiktok.com/...); canonicalize_video_url reduces them
+# to a platform, a video id and a stable key for caching and coalescing.
+PLATFORM_DOMAINS = {
+    "youtube": ("youtube.com", "youtu.be", "youtube-nocookie.com"),
+    "tiktok": ("tiktok.com",),
+    "instagram": ("instagram.com", "instagr.am"),
+}
+YOUTUBE_ID = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+def _host_platform(host: str) -> Optional[str]:
+    for platform, domains in PLATFORM_DOMAINS.items():
+        if any(host == d or host.endswith("." + d) for d in domains):
+            return platform
     return None
 
+def canonicalize_video_url(url: str) -> Optional[dict]:
+    raw = url.strip()
+    if "://" not in raw:
+        raw = "https://" + raw
+    try:
+        parts = urlsplit(raw)
+    except ValueError:
+        return None
+    host = (parts.hostname or "").lower()
+    platform = _host_platform(host)
+    if not platform:
+        return None
+    segs = [p for p in parts.path.split("/") if p]
+    video_id, canonical = None, None
+    if platform == "youtube":
+        if host.endswith("youtu.be") and segs:
+            video_id = segs[0]
+        elif segs[:1] == ["watch"]:
+            video_id = (parse_qs(parts.query).get("v") or [""])[0]
+        elif len(segs) >= 2 and segs[0] in ("shorts", "embed", "live", "v"):
+            video_id = segs[1]
+        if video_id and YOUTUBE_ID.match(video_id):
+            canonical = f"https://www.youtube.com/watch?v={video_id}"
+        else:
+            video_id = None
+    elif platform == "tiktok":
+        if len(segs) >= 3 and segs[0].startswith("@") and segs[1] == "video" and segs[2].isdigit():
+            video_id = segs[2]
+            canonical = f"https://www.tiktok.com/{segs[0]}/video/{video_id}"
+        elif len(segs) >= 2 and segs[0] == "v" and segs[1].split(".")[0].isdigit():
+            video_id = segs[1].split(".")[0]
+            canonical = f"https://{host}{parts.path}"
+        elif segs and (host.startswith(("vm.", "vt.")) or segs[0] == "t"):
+            # Short links only resolve by following the redirect; key on the code.
+            code = segs[0] if segs[0] != "t" else (segs[1] if len(segs) > 1 else "")
+            if code:
+                video_id = f"short:{code}"
+                canonical = f"https://{host}/{'/'.join(segs)}/"
+    elif platform == "instagram":
+        if len(segs) >= 2 and segs[0] in ("p", "reel", "reels", "tv"):
+            video_id = segs[1]
+            canonical = f"https://www.instagram.com/p/{video_id}/"
+    if video_id is None:
+        # Still a supported site, just not a recognised video path.
+        canonical = f"https://{host}{parts.path}" + (f"?{parts.query}" if parts.query else "")
+        return {"platform": platform, "video_id": None, "url": canonical, "key": f"{platform}:url:{canonical}"}
+    return {"platform": platform, "video_id": video_id, "url": canonical, "key": f"{platform}:{video_id}"}
+
+def detect_platform(url: str) -> Optional[str]:
+    video = canonicalize_video_url(url)
+    return video["platform"] if video else None
+
+# ── Analytics Rollups ───────────────────────────────────
+# One user_rollups document per user holds running totals over all of their
+# analyses (count, score sum/min/max, per-platform counts and a histogram of
+# viral scores in buckets of 10), so dashboards never aggregate over history.
+# Request paths only apply deltas, so for users with analyses from before
+# rollups existed, dashboards show partial totals until backfill_rollups.py
+# has run.
+def rollup_key(value: str) -> str:
+    return re.sub(r"[^a-z0-9_]", "_", (value or "general").lower())[:32] or "general"
+
+def score_bucket(score: float) -> str:
+    return str(max(0, min(90, int(score) // 10 * 10)))
+
+def empty_rollup(user_id: str) -> dict:
+    return {"user_id": user_id, "count": 0, "score_sum": 0, "score_min": None, "score_max": None,
+            "platforms": {}, "histogram": {}}
+
+def fold_into_rollup(rollup: dict, platform: str, score: float):
+    rollup["count"] += 1
+    rollup["score_sum"] += score
+    rollup["score_min"] = score if rollup["score_min"] is None else min(rollup["score_min"], score)
+    rollup["score_max"] = score if rollup["score_max"] is None else max(rollup["score_max"], score)
+    p = rollup["platforms"].setdefault(rollup_key(platform), {"count": 0, "score_sum": 0})
+    p["count"] += 1
+    p["score_sum"] += score
+    bucket = score_bucket(score)
+    rollup["histogram"][bucket] = rollup["histogram"].get(bucket, 0) + 1
+
+def rollup_delta_update(delta: dict) -> dict:
+    inc = {"count": delta["count"], "score_sum": delta["score_sum"]}
+    for p, v in delta["platforms"].items():
+        inc[f"platforms.{p}.count"] = v["count"]
+        inc[f"platforms.{p}.score_sum"] = v["score_sum"]
+    for bucket, n in delta["histogram"].items():
+        inc[f"histogram.{bucket}"] = n
+    update = {"$inc": inc, "$set": {"updated_at": datetime.now(timezone.utc)}}
+    # Unset bounds are left out: null sorts below numbers, so $min would keep it.
+    if delta["score_min"] is not None:
+        update["$min"] = {"score_min": delta["score_min"]}
+        update["$max"] = {"score_max": delta["score_max"]}
+    return update
+
+# Rebuilds happen only in backfill_rollups.py, against live traffic. It resets the
+# document with a "since" cutoff slightly in the future, waits until analyses
+# created before the cutoff are stored, then adds their totals with $inc.
+# Deltas for analyses created before "since" are skipped, since the rebuild
+# counts them; later ones land on the reset document and are kept.
+ROLLUP_REBUILD_LEAD = timedelta(seconds=float(os.environ.get("ROLLUP_REBUILD_LEAD", "2")))
+# Covers the gap between an analysis's created_at and its insert.
+ROLLUP_REBUILD_SETTLE = timedelta(seconds=float(os.environ.get("ROLLUP_REBUILD_SETTLE", "3")))
+
+async def update_user_rollup(user_id: str, records: list):
+    delta = empty_rollup(user_id)
+    for r in records:
+        fold_into_rollup(delta, r.get("platform"), viral_score_of(r.get("result", {})))
+    created = min(r["created_at"] for r in records)
+    flt = {"user_id": user_id, "$or": [{"since": {"$exists": False}}, {"since": {"$lte": created}}]}
+    # The first analyses of a user upsert the document; when two of them race
+    # the loser gets a duplicate key and its retry matches the winner's insert.
+    # A second duplicate means a rebuild cutoff newer than these records, and
+    # the rebuild has counted them.
+    for _ in range(2):
+        try:
+            await db.user_rollups.update_one(flt, rollup_delta_update(delta), upsert=True)
+            return
+        except DuplicateKeyError:
+            continue
+
+async def reset_user_rollup(user_id: str) -> datetime:
+    since = datetime.now(timezone.utc) + ROLLUP_REBUILD_LEAD
+    # Bounds are left unset so the first $min/$max sets them.
+    reset = {k: v for k, v in empty_rollup(user_id).items() if v is not None}
+    await db.user_rollups.replace_one(
+        {"user_id": user_id},
+        {**reset, "since": since.isoformat(), "updated_at": datetime.now(timezone.utc)},
+        upsert=True,
+    )
+    return since
+
+async def fill_user_rollup(user_id: str, since: datetime) -> dict:
+    base = empty_rollup(user_id)
+    cursor = db.analyses.find({"user_id": user_id, "created_at": {"$lt": since.isoformat()}},
+                              {"_id": 0, "platform": 1, "result.viral_score": 1})
+    async for a in cursor:
+        fold_into_rollup(base, a.get("platform"), viral_score_of(a.get("result", {})))
+    await db.user_rollups.update_one({"user_id": user_id}, rollup_delta_update(base))
+    return base
+
+async def wait_for_rollup_cutoff(since: datetime):
+    await asyncio.sleep(max(0.0, (since + ROLLUP_REBUILD_SETTLE - datetime.now(timezone.utc)).total_seconds()))
+
+async def get_user_rollup(user_id: str) -> dict:
+    rollup = await db.user_rollups.find_one({"user_id": user_id}, {"_id": 0})
+    return rollup if rollup is not None else empty_rollup(user_id)
+
+def rollup_summary(rollup: dict) -> dict:
+    count = rollup.get("count", 0)
+    return {
+        "total_analyses": count,
+        "avg_viral_score": round(rollup["score_sum"] / count, 1) if count else 0,
+        "min_viral_score": rollup.get("score_min"),
+        "max_viral_score": rollup.get("score_max"),
+        "platforms": {p: {"count": v["count"], "avg_viral_score": round(v["score_sum"] / v["count"], 1)}
+                      for p, v in rollup.get("platforms", {}).items() if v.get("count")},
+        "histogram": [{"bucket": f"{b}-{b + 9 if b < 90 else 100}", "count": rollup.get("histogram", {}).get(str(b), 0)}
+                      for b in range(0, 100, 10)],
+    }
+
 # ── Auth Routes ─────────────────────────────────────────
 @api_router.post("/auth/register")
 async def register(req: RegisterRequest, response: Response):
@@ -268,7 +1614,7 @@ async def register(req: RegisterRequest, response: Response):
     user_id = f"user_{uuid.uuid4().hex[:12]}"
     user = {
         "user_id": user_id, "email": req.email, "name": req.name,
-        "password_hash": hash_password(req.password),
+        "password_hash": await hash_password(req.password),
         "picture": "", "plan": "free",
         "created_at": datetime.now(timezone.utc).isoformat(),
     }
@@ -282,15 +1628,25 @@ async def login(req: LoginRequest, response: Response):
     user = await db.users.find_one({"email": req.email}, {"_id": 0})
     if not user or "password_hash" not in user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    if not verify_password(req.password, user["password_hash"]):
+    if not await verify_password(req.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    token = await create_session(user["user_id"])
+    if bcrypt_cost(user["password_hash"]) != BCRYPT_ROUNDS:
+        await db.users.update_one(
+            {"user_id": user["user_id"], "password_hash": user["password_hash"]},
+            {"$set": {"password_hash": await hash_password(req.password)}},
+        )
+        bcrypt_stats["rehashed"] += 1
+    token = await create_session(user["user_id"], user.get("plan", "free"))
     set_session_cookie(response, token)
     return {"user_id": user["user_id"], "email": user["email"], "name": user["name"], "picture": user.get("picture", ""), "plan": user.get("plan", "free")}
 
 @api_router.get("/auth/me")
 async def auth_me(request: Request):
     user = await get_current_user(request)
+    if "email" not in user:
+        user = await db.users.find_one({"user_id": user["user_id"]}, {"_id": 0, "password_hash": 0})
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
     plan = user.get("plan", "free")
     xp = await get_xp(user["user_id"])
     level = get_level_info(xp)
@@ -307,19 +1663,18 @@ async def auth_session(request: Request, response: Response):
     session_id = body.get("session_id")
     if not session_id:
         raise HTTPException(status_code=400, detail="Missing session_id")
-    async with httpx.AsyncClient() as hc:
-        resp = await hc.get(
-            "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-            headers={"X-Session-ID": session_id},
-        )
-        if resp.status_code != 200:
-            raise HTTPException(status_code=401, detail="Invalid Google session")
-        data = resp.json()
+    resp = await outbound_http.get(OAUTH_SESSION_URL, headers={"X-Session-ID": session_id})
+    if resp.status_code != 200:
+        raise HTTPException(status_code=401, detail="Invalid Google session")
+    data = resp.json()
     email = data["email"]
     existing = await db.users.find_one({"email": email}, {"_id": 0})
+    plan = "free"
     if existing:
         user_id = existing["user_id"]
+        plan = existing.get("plan", "free")
         await db.users.update_one({"email": email}, {"$set": {"name": data.get("name", existing["name"]), "picture": data.get("picture", "")}})
+        invalidate_user_sessions(user_id)
     else:
         user_id = f"user_{uuid.uuid4().hex[:12]}"
         await db.users.insert_one({
@@ -327,16 +1682,25 @@ async def auth_session(request: Request, response: Response):
             "picture": data.get("picture", ""), "plan": "free",
             "created_at": datetime.now(timezone.utc).isoformat(),
         })
-    token = await create_session(user_id)
+    token = await create_session(user_id, plan)
     set_session_cookie(response, token)
     user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
     return {"user_id": user["user_id"], "email": user["email"], "name": user["name"], "picture": user.get("picture", ""), "plan": user.get("plan", "free")}
 
 @api_router.post("/auth/logout")
 async def logout(request: Request, response: Response):
-    token = request.cookies.get("session_token")
-    if token:
-        await db.user_sessions.delete_many({"session_token": token})
+    token = request_session_token(request)
+    if token and is_signed_session(token):
+        try:
+            await session_revocations.revoke_token(verify_signed_session(token))
+        except HTTPException:
+            pass
+    elif token:
+        session = await db.user_sessions.find_one_and_delete({"session_token": token})
+        session_cache.pop(token)
+        if session:
+            # Other workers may still hold it in their session_cache.
+            await session_revocations.revoke_opaque(token, session["user_id"], _as_utc(session["expires_at"]))
     response.delete_cookie("session_token", path="/", secure=True, samesite="none")
     return {"message": "Logged out"}
 
@@ -351,14 +1715,420 @@ async def reset_password(request: Request):
         return {"message": "If this email exists, a reset link has been sent."}
     return {"message": "If this email exists, a reset link has been sent."}
 
+# ── LLM Gateway ───────────────────────────────────────
+# Every LLM call goes through llm_complete(): a global and a per-plan
+# concurrency cap, one deadline covering queueing and retries, jittered
+# retries on transient provider errors, and a circuit breaker that fails
+# fast (so callers serve their canned fallback) while the provider is down.
+LLM_PROVIDER = os.environ.get("LLM_PROVIDER", "openai")
+LLM_MODEL = os.environ.get("LLM_MODEL", "gpt-5.2")
+LLM_STREAM_METHOD = os.environ.get("LLM_STREAM_METHOD", "stream_message")
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "45"))
+LLM_RETRIES = int(os.environ.get("LLM_RETRIES", "2"))
+LLM_RETRY_BASE = float(os.environ.get("LLM_RETRY_BASE", "0.5"))
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "32"))
+LLM_PLAN_CONCURRENCY = {
+    "free": int(os.environ.get("LLM_CONCURRENCY_FREE", "8")),
+    "pro": int(os.environ.get("LLM_CONCURRENCY_PRO", "16")),
+    "premium": int(os.environ.get("LLM_CONCURRENCY_PREMIUM", "16")),
+}
+TRANSIENT_LLM_ERRORS = ("timeout", "timed out", "rate limit", "ratelimit", "429", "500", "502", "503", "504",
+                        "overloaded", "unavailable", "connection", "temporarily")
+
+class LLMUnavailable(Exception):
+    pass
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probe = 0  # ticket of the caller holding the half-open probe, 0 if none
+        self._tickets = 0
+
+    def admit(self) -> Optional[int]:
+        # None means fail fast. Otherwise a ticket: non-zero when this caller
+        # holds the single half-open probe, 0 for an ordinary closed-state call.
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return None
+            self.state = "half_open"
+            self._probe = 0
+        if self.state == "half_open":
+            if self._probe:
+                return None
+            self._tickets += 1
+            self._probe = self._tickets
+            return self._probe
+        return 0
+
+    def can_retry(self, ticket: int) -> bool:
+        return self.state == "closed" or (self.state == "half_open" and ticket != 0 and ticket == self._probe)
+
+    def release(self, ticket: int):
+        # Lets another caller probe if this one held the probe and ended without
+        # recording an outcome; other callers' tickets leave the probe alone.
+        if ticket and ticket == self._probe:
+            self._probe = 0
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probe = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opens += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self._probe = 0
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures, "opens": self.opens}
+
+llm_breaker = CircuitBreaker(
+    failure_threshold=int(os.environ.get("LLM_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.environ.get("LLM_BREAKER_RESET", "30")),
+)
+
+# Admits LLM work by plan tier once the global LLM_MAX_CONCURRENCY slots are
+# busy. Tiers are served by stride scheduling in proportion to their weight,
+# except that any waiter past its tier's queue-wait SLO goes first (the most
+# overdue first), which keeps free users from starving behind paid traffic.
+LLM_TIER_WEIGHTS = {
+    "free": float(os.environ.get("LLM_WEIGHT_FREE", "1")),
+    "pro": float(os.environ.get("LLM_WEIGHT_PRO", "3")),
+    "premium": float(os.environ.get("LLM_WEIGHT_PREMIUM", "6")),
+}
+LLM_TIER_SLO_MS = {
+    "free": float(os.environ.get("LLM_SLO_MS_FREE", "20000")),
+    "pro": float(os.environ.get("LLM_SLO_MS_PRO", "5000")),
+    "premium": float(os.environ.get("LLM_SLO_MS_PREMIUM", "1500")),
+}
+
+class PriorityScheduler:
+    def __init__(self, capacity: int, weights: dict, slo_ms: dict, clock=time.monotonic):
+        self.capacity = capacity
+        self.clock = clock
+        self.weights = weights
+        self.slo_ms = slo_ms
+        self.in_use = 0
+        self._waiters = {tier: deque() for tier in weights}
+        self._pass = {tier: 0.0 for tier in weights}
+        self._vtime = 0.0  # pass value of the most recent queued admission
+        self._waits = {tier: deque(maxlen=1000) for tier in weights}
+        self._counts = {tier: {"admitted": 0, "timed_out": 0, "slo_violations": 0} for tier in weights}
+
+    def tier_of(self, plan: str) -> str:
+        return plan if plan in self.weights else "free"
+
+    async def acquire(self, plan: str, timeout: float):
+        tier = self.tier_of(plan)
+        if self.in_use < self.capacity and not any(self._waiters.values()):
+            self.in_use += 1
+            self._admitted(tier, 0.0)
+            return
+        fut = asyncio.get_running_loop().create_future()
+        entry = (fut, self.clock())
+        if not self._waiters[tier]:
+            # A tier that was idle rejoins at the current virtual time, so it
+            # cannot bank credit while it had nobody waiting.
+            self._pass[tier] = max(self._pass[tier], self._vtime)
+        self._waiters[tier].append(entry)
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except BaseException:
+            if fut.done() and not fut.cancelled():
+                # Granted just as we gave up; hand the slot on.
+                self.release()
+            else:
+                fut.cancel()
+                try:
+                    self._waiters[tier].remove(entry)
+                except ValueError:
+                    pass
+                self._counts[tier]["timed_out"] += 1
+            raise
+
+    def release(self):
+        self.in_use -= 1
+        self._dispatch()
+
+    def _admitted(self, tier: str, waited_ms: float):
+        self._waits[tier].append(waited_ms)
+        self._counts[tier]["admitted"] += 1
+        if waited_ms > self.slo_ms[tier]:
+            self._counts[tier]["slo_violations"] += 1
+
+    def _pick(self) -> Optional[str]:
+        now = self.clock()
+        overdue, most_overdue = None, 0.0
+        for tier, q in self._waiters.items():
+            if q:
+                over = (now - q[0][1]) * 1000 - self.slo_ms[tier]
+                if over > most_overdue:
+                    overdue, most_overdue = tier, over
+        if overdue:
+            return overdue
+        ready = [tier for tier, q in self._waiters.items() if q]
+        if not ready:
+            return None
+        return min(ready, key=lambda t: self._pass[t])
+
+    def _dispatch(self):
+        while self.in_use < self.capacity:
+            tier = self._pick()
+            if tier is None:
+                return
+            fut, enqueued = self._waiters[tier].popleft()
+            if fut.done():
+                continue
+            self._vtime = self._pass[tier]
+            self._pass[tier] += 1.0 / self.weights[tier]
+            self.in_use += 1
+            self._admitted(tier, (self.clock() - enqueued) * 1000)
+            fut.set_result(True)
+
+    def stats(self) -> dict:
+        return {"capacity": self.capacity, "in_use": self.in_use, "tiers": {
+            tier: {"queued": len(self._waiters[tier]), "weight": self.weights[tier], "slo_ms": self.slo_ms[tier],
+                   **self._counts[tier], "wait_ms": percentiles(self._waits[tier])}
+            for tier in self.weights}}
+
+llm_scheduler = PriorityScheduler(LLM_MAX_CONCURRENCY, LLM_TIER_WEIGHTS, LLM_TIER_SLO_MS)
+llm_plan_semaphores = {plan: asyncio.Semaphore(n) for plan, n in LLM_PLAN_CONCURRENCY.items()}
+llm_stats = {"calls": 0, "succeeded": 0, "failed": 0, "retries": 0, "timeouts": 0,
+             "short_circuited": 0, "fallbacks": 0, "in_flight": 0}
+
+def is_transient_llm_error(e: Exception) -> bool:
+    if isinstance(e, (asyncio.TimeoutError, httpx.TransportError, ConnectionError)):
+        return True
+    text = f"{type(e).__name__} {e}".lower()
+    return any(marker in text for marker in TRANSIENT_LLM_ERRORS)
+
+def parse_llm_json(text: str):
+    cleaned = text.strip()
+    if cleaned.startswith("```"):
+        cleaned = cleaned.split("\n", 1)[1] if "\n" in cleaned else cleaned[3:]
+        if cleaned.endswith("```"):
+            cleaned = cleaned[:-3]
+    return json.loads(cleaned.strip())
+
+def note_llm_fallback(context: str, e: Exception):
+    llm_stats["fallbacks"] += 1
+    llm_fallbacks_total.inc(context=context)
+    logger.error(f"{context}: {e}")
+
+async def _send_llm(system_message: str, prompt: str, session_prefix: str) -> str:
+    from emergentintegrations.llm.chat import LlmChat, UserMessage
+    chat = LlmChat(
+        api_key=os.environ.get("EMERGENT_LLM_KEY"),
+        session_id=f"{session_prefix}-{uuid.uuid4().hex[:8]}",
+        system_message=system_message,
+    ).with_model(LLM_PROVIDER, LLM_MODEL)
+    return await chat.send_message(UserMessage(text=prompt))
+
+async def _send_llm_stream(system_message: str, prompt: str, session_prefix: str):
+    # Yields text chunks. Falls back to a single chunk when the installed
+    # client has no streaming method.
+    from emergentintegrations.llm.chat import LlmChat, UserMessage
+    chat = LlmChat(
+        api_key=os.environ.get("EMERGENT_LLM_KEY"),
+        session_id=f"{session_prefix}-{uuid.uuid4().hex[:8]}",
+        system_message=system_message,
+    ).with_model(LLM_PROVIDER, LLM_MODEL)
+    stream = getattr(chat, LLM_STREAM_METHOD, None)
+    if stream is None:
+        yield await chat.send_message(UserMessage(text=prompt))
+        return
+    async for chunk in stream(UserMessage(text=prompt)):
+        if chunk:
+            yield chunk if isinstance(chunk, str) else getattr(chunk, "text", str(chunk))
+
+async def _acquire_before(sem: asyncio.Semaphore, deadline: float):
+    remaining = deadline - asyncio.get_running_loop().time()
+    if remaining <= 0:
+        raise asyncio.TimeoutError()
+    await asyncio.wait_for(sem.acquire(), remaining)
+
+@asynccontextmanager
+async def llm_capacity(plan: str, deadline: float):
+    plan_sem = llm_plan_semaphores.get(plan, llm_plan_semaphores["free"])
+    try:
+        await _acquire_before(plan_sem, deadline)
+    except asyncio.TimeoutError:
+        llm_stats["timeouts"] += 1
+        raise LLMUnavailable("Timed out waiting for LLM capacity")
+    try:
+        remaining = deadline - asyncio.get_running_loop().time()
+        try:
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            await llm_scheduler.acquire(plan, remaining)
+        except asyncio.TimeoutError:
+            llm_stats["timeouts"] += 1
+            raise LLMUnavailable("Timed out waiting for LLM capacity")
+        llm_stats["in_flight"] += 1
+        try:
+            yield
+        finally:
+            llm_stats["in_flight"] -= 1
+            llm_scheduler.release()
+    finally:
+        plan_sem.release()
+
+async def llm_complete(system_message: str, prompt: str, plan: str = "free", session_prefix: str = "llm") -> str:
+    ticket = llm_breaker.admit()
+    if ticket is None:
+        llm_stats["short_circuited"] += 1
+        raise LLMUnavailable("LLM circuit breaker is open")
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + LLM_TIMEOUT
+    try:
+        async with llm_capacity(plan, deadline):
+            attempt = 0
+            while True:
+                llm_stats["calls"] += 1
+                started = time.monotonic()
+                try:
+                    result = await asyncio.wait_for(_send_llm(system_message, prompt, session_prefix),
+                                                    max(deadline - loop.time(), 0.001))
+                    llm_breaker.record_success()
+                    llm_stats["succeeded"] += 1
+                    llm_call_seconds.observe(time.monotonic() - started, mode="complete", outcome="success")
+                    return result
+                except asyncio.TimeoutError:
+                    llm_breaker.record_failure()
+                    llm_stats["timeouts"] += 1
+                    llm_stats["failed"] += 1
+                    llm_call_seconds.observe(time.monotonic() - started, mode="complete", outcome="timeout")
+                    raise LLMUnavailable("LLM call exceeded its deadline")
+                except Exception as e:
+                    llm_breaker.record_failure()
+                    llm_stats["failed"] += 1
+                    llm_call_seconds.observe(time.monotonic() - started, mode="complete", outcome="error")
+                    delay = random.uniform(0, LLM_RETRY_BASE * (2 ** attempt))
+                    if (attempt >= LLM_RETRIES or not is_transient_llm_error(e)
+                            or loop.time() + delay >= deadline or not llm_breaker.can_retry(ticket)):
+                        raise
+                    attempt += 1
+                    llm_stats["retries"] += 1
+                    await asyncio.sleep(delay)
+    finally:
+        llm_breaker.release(ticket)
+
+async def llm_stream(system_message: str, prompt: str, plan: str = "free", session_prefix: str = "llm"):
+    # Streaming counterpart of llm_complete(). Retries are not attempted once
+    # output has started; the deadline bounds the whole stream.
+    ticket = llm_breaker.admit()
+    if ticket is None:
+        llm_stats["short_circuited"] += 1
+        raise LLMUnavailable("LLM circuit breaker is open")
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + LLM_TIMEOUT
+    try:
+        async with llm_capacity(plan, deadline):
+            llm_stats["calls"] += 1
+            started = time.monotonic()
+            chunks = _send_llm_stream(system_message, prompt, session_prefix)
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), max(deadline - loop.time(), 0.001))
+                    except StopAsyncIteration:
+                        break
+                    yield chunk
+            except asyncio.TimeoutError:
+                llm_breaker.record_failure()
+                llm_stats["timeouts"] += 1
+                llm_stats["failed"] += 1
+                llm_call_seconds.observe(time.monotonic() - started, mode="stream", outcome="timeout")
+                raise LLMUnavailable("LLM stream exceeded its deadline")
+            except Exception:
+                llm_breaker.record_failure()
+                llm_stats["failed"] += 1
+                llm_call_seconds.observe(time.monotonic() - started, mode="stream", outcome="error")
+                raise
+            finally:
+                await chunks.aclose()
+            llm_breaker.record_success()
+            llm_stats["succeeded"] += 1
+            llm_call_seconds.observe(time.monotonic() - started, mode="stream", outcome="success")
+    finally:
+        llm_breaker.release(ticket)
+
+def llm_gateway_stats() -> dict:
+    return {**llm_stats, "breaker": llm_breaker.stats(), "max_concurrency": LLM_MAX_CONCURRENCY,
+            "plan_concurrency": LLM_PLAN_CONCURRENCY, "scheduler": llm_scheduler.stats()}
+
+# ── Analysis Cache ──────────────────────────────────────
+# LLM results for /analyze/content keyed by normalized content, platform and
+# plan tier (the prompt asks for different fields per tier). An in-process LRU
+# fronts the analysis_cache collection, which expires entries via a TTL index
+# and is trimmed back to ANALYSIS_CACHE_MAX_DOCS by least recent hit.
+ANALYSIS_CACHE_TTL = int(os.environ.get("ANALYSIS_CACHE_TTL", str(7 * 24 * 3600)))
+ANALYSIS_CACHE_MAX_DOCS = int(os.environ.get("ANALYSIS_CACHE_MAX_DOCS", "100000"))
+ANALYSIS_CACHE_TRIM_EVERY = 500
+analysis_cache_local = TTLCache(
+    maxsize=int(os.environ.get("ANALYSIS_CACHE_LOCAL_SIZE", "2000")),
+    ttl=min(ANALYSIS_CACHE_TTL, 3600),
+)
+analysis_cache_stats = {"mongo_hits": 0, "misses": 0, "stored": 0, "trimmed": 0}
+analysis_cache_trimming = False
+
+def plan_tier(plan: str) -> str:
+    features = get_plan_features(plan)
+    if features["deep"]:
+        return "deep"
+    if features["advanced"]:
+        return "advanced"
+    return "free"
+
+def normalize_content(content: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", content).split())
+
+def analysis_cache_key(content: str, platform: str, plan: str) -> str:
+    raw = f"{plan_tier(plan)}\x00{platform.strip().lower()}\x00{normalize_content(content)}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+async def store_analysis_cache(key: str, platform: str, plan: str, analysis: dict):
+    now = datetime.now(timezone.utc)
+    try:
+        await db.analysis_cache.update_one(
+            {"key": key},
+            {"$set": {"result": analysis, "platform": platform, "tier": plan_tier(plan), "created_at": now,
+                      "last_hit_at": now, "expires_at": now + timedelta(seconds=ANALYSIS_CACHE_TTL)},
+             "$setOnInsert": {"hits": 0}},
+            upsert=True,
+        )
+    except Exception as e:
+        logger.error(f"Analysis cache write error: {e}")
+        return
+    analysis_cache_stats["stored"] += 1
+    # Trimming sorts the collection, so it runs off the request path, one at a time.
+    if analysis_cache_stats["stored"] % ANALYSIS_CACHE_TRIM_EVERY == 0 and not analysis_cache_trimming:
+        in_background(trim_analysis_cache(), "Analysis cache trim")
+
+async def trim_analysis_cache():
+    global analysis_cache_trimming
+    analysis_cache_trimming = True
+    try:
+        excess = await db.analysis_cache.estimated_document_count() - ANALYSIS_CACHE_MAX_DOCS
+        if excess <= 0:
+            return
+        oldest = await db.analysis_cache.find({}, {"_id": 1}).sort("last_hit_at", 1).to_list(excess)
+        result = await db.analysis_cache.delete_many({"_id": {"$in": [d["_id"] for d in oldest]}})
+        analysis_cache_stats["trimmed"] += result.deleted_count
+    finally:
+        analysis_cache_trimming = False
+
 # ── Content Analysis ────────────────────────────────────
-@api_router.post("/analyze/content")
-async def analyze_content(req: AnalyzeContentRequest, request: Request):
-    user = await get_current_user(request)
-    plan = user.get("plan", "free")
-    allowed, limit, used = await check_daily_limit(user["user_id"], plan)
-    if not allowed:
-        raise HTTPException(status_code=429, detail=f"Daily analysis limit reached ({limit}). Upgrade to Pro for unlimited analyses.")
+def content_analysis_prompt(content: str, platform: str, plan: str) -> tuple:
     features = get_plan_features(plan)
     # Build AI prompt based on plan level
     base_fields = '"viral_score": <0-100>, "strengths": [3-4 strings], "weaknesses": [3-4 strings], "suggestions": [4-5 strings], "summary": "2 sentences"'
@@ -370,94 +2140,278 @@ async def analyze_content(req: AnalyzeContentRequest, request: Request):
     system_msg = f"""You are an expert social media content analyst. Analyze the given content and return a JSON object with exactly these fields:
 {{{base_fields}{extra}}}
 Return ONLY valid JSON, no markdown, no extra text."""
+    prompt = f"Platform: {platform}\n\nContent to analyze:\n{content}"
+    return system_msg, prompt
+
+def content_fallback_analysis(ai_response: Optional[str] = None) -> dict:
+    # ai_response is the unparseable model output, or None when the call failed.
+    if ai_response is not None:
+        return {"viral_score": 65, "strengths": ["Content has engaging elements", "Good topic selection"],
+                "weaknesses": ["Could improve hook", "Pacing could be better"],
+                "suggestions": ["Add a stronger opening hook", "Include a call-to-action"], "summary": ai_response[:200]}
+    return {"viral_score": 72, "strengths": ["Relevant topic", "Good content length", "Clear messaging"],
+            "weaknesses": ["Could benefit from stronger hook", "Missing trending hashtags"],
+            "suggestions": ["Start with an attention-grabbing hook", "Add relevant trending hashtags", "Include a clear call-to-action"],
+            "summary": "Your content shows potential. Focus on improving the hook and adding strategic CTAs."}
+
+async def generate_content_analysis(content: str, platform: str, plan: str) -> tuple:
+    system_msg, prompt = content_analysis_prompt(content, platform, plan)
     try:
-        from emergentintegrations.llm.chat import LlmChat, UserMessage
-        chat = LlmChat(
-            api_key=os.environ.get("EMERGENT_LLM_KEY"),
-            session_id=f"analysis-{uuid.uuid4().hex[:8]}",
-            system_message=system_msg,
-        ).with_model("openai", "gpt-5.2")
-        prompt = f"Platform: {req.platform}\n\nContent to analyze:\n{req.content}"
-        ai_response = await chat.send_message(UserMessage(text=prompt))
+        ai_response = await llm_complete(system_msg, prompt, plan, "analysis")
         try:
-            cleaned = ai_response.strip()
-            if cleaned.startswith("```"):
-                cleaned = cleaned.split("\n", 1)[1] if "\n" in cleaned else cleaned[3:]
-                if cleaned.endswith("```"):
-                    cleaned = cleaned[:-3]
-            analysis = json.loads(cleaned.strip())
+            return parse_llm_json(ai_response), True
         except json.JSONDecodeError:
-            analysis = {"viral_score": 65, "strengths": ["Content has engaging elements", "Good topic selection"],
-                        "weaknesses": ["Could improve hook", "Pacing could be better"],
-                        "suggestions": ["Add a stronger opening hook", "Include a call-to-action"], "summary": ai_response[:200]}
+            analysis = content_fallback_analysis(ai_response)
     except Exception as e:
-        logger.error(f"AI analysis error: {e}")
-        analysis = {"viral_score": 72, "strengths": ["Relevant topic", "Good content length", "Clear messaging"],
-                    "weaknesses": ["Could benefit from stronger hook", "Missing trending hashtags"],
-                    "suggestions": ["Start with an attention-grabbing hook", "Add relevant trending hashtags", "Include a clear call-to-action"],
-                    "summary": "Your content shows potential. Focus on improving the hook and adding strategic CTAs."}
-    analysis_record = {
-        "analysis_id": f"an_{uuid.uuid4().hex[:12]}",
-        "user_id": user["user_id"],
-        "content": req.content[:500],
-        "platform": req.platform,
-        "result": analysis,
-        "favorited": False,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-    }
-    await db.analyses.insert_one(analysis_record)
+        note_llm_fallback("AI analysis error", e)
+        analysis = content_fallback_analysis()
+    return analysis, False
+
+async def lookup_analysis_cache(key: str) -> tuple:
+    analysis = analysis_cache_local.get(key)
+    if analysis is not None:
+        return dict(analysis), "memory"
+    now = datetime.now(timezone.utc)
+    doc = await db.analysis_cache.find_one_and_update(
+        {"key": key, "expires_at": {"$gt": now}},
+        {"$set": {"last_hit_at": now}, "$inc": {"hits": 1}},
+        projection={"_id": 0, "result": 1},
+    )
+    if doc:
+        analysis_cache_stats["mongo_hits"] += 1
+        analysis_cache_local.set(key, doc["result"])
+        return dict(doc["result"]), "mongo"
+    analysis_cache_stats["misses"] += 1
+    return None, "miss"
+
+async def cached_content_analysis(content: str, platform: str, plan: str) -> tuple:
+    key = analysis_cache_key(content, platform, plan)
+    analysis, outcome = await lookup_analysis_cache(key)
+    if analysis is not None:
+        return analysis, outcome
+
+    async def fill():
+        analysis, cacheable = await generate_content_analysis(content, platform, plan)
+        if cacheable:
+            analysis_cache_local.set(key, analysis)
+            await store_analysis_cache(key, platform, plan, analysis)
+        return analysis
+
+    analysis = await inflight.do(f"content:{key}", fill)
+    return dict(analysis), "miss"
+
+async def perform_content_analysis(user_id: str, plan: str, content: str, platform: str, quota: dict,
+                                   analysis_id: Optional[str] = None) -> dict:
+    try:
+        analysis, cache_outcome = await cached_content_analysis(content, platform, plan)
+        analysis_record = {
+            "analysis_id": analysis_id or f"an_{uuid.uuid4().hex[:12]}",
+            "user_id": user_id,
+            "content": content[:500],
+            "platform": platform,
+            "result": analysis,
+            "favorited": False,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        await db.analyses.insert_one(analysis_record)
+    except BaseException:
+        # Shielded: a cancelled caller must not cancel the refund as well.
+        await asyncio.shield(refund_daily_quota(quota))
+        raise
+    await commit_daily_quota(quota)
     # Gamification
-    await award_xp(user["user_id"], 10, "Content analysis")
-    count = await db.analyses.count_documents({"user_id": user["user_id"]})
-    new_achievements = await check_and_award_achievements(user["user_id"], analysis_count=count, viral_score=analysis.get("viral_score", 0))
-    remaining = limit - used - 1 if limit > 0 else -1
+    new_achievements = await award_analysis_rewards(user_id, [analysis_record])
+    remaining = quota["limit"] - quota["used"] - 1 if quota["limit"] > 0 else -1
     return {"analysis_id": analysis_record["analysis_id"], "remaining_today": remaining,
-            "new_achievements": new_achievements, "xp_earned": 10, **analysis}
+            "new_achievements": new_achievements, "xp_earned": 10, "cache": cache_outcome, **analysis}
 
-@api_router.post("/analyze/video-link")
-async def analyze_video_link(req: VideoLinkRequest, request: Request):
+@api_router.post("/analyze/content")
+async def analyze_content(req: AnalyzeContentRequest, request: Request):
     user = await get_current_user(request)
     plan = user.get("plan", "free")
-    allowed, limit, used = await check_daily_limit(user["user_id"], plan)
-    if not allowed:
-        raise HTTPException(status_code=429, detail=f"Daily limit reached ({limit}). Upgrade for unlimited.")
-    platform = detect_platform(req.url)
-    if not platform:
-        raise HTTPException(status_code=400, detail="Unsupported URL. Please paste a TikTok, Instagram, or YouTube link.")
-    # Extract video metadata via oEmbed + meta tags
-    video_data = {"url": req.url, "platform": platform, "title": "", "author": "", "thumbnail": "", "description": "", "hashtags": []}
+    quota = await reserve_daily_quota(user["user_id"], plan)
+    if not quota["allowed"]:
+        raise HTTPException(status_code=429, detail=f"Daily analysis limit reached ({quota['limit']}). Upgrade to Pro for unlimited analyses.")
+    return await perform_content_analysis(user["user_id"], plan, req.content, req.platform, quota)
+
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "50"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+
+@api_router.post("/analyze/content/batch")
+async def analyze_content_batch(req: BatchAnalyzeContentRequest, request: Request):
+    user = await get_current_user(request)
+    plan = user.get("plan", "free")
+    if not req.items:
+        raise HTTPException(status_code=400, detail="No items to analyze")
+    if len(req.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch can contain at most {BATCH_MAX_ITEMS} items")
+    quota = await reserve_daily_quota(user["user_id"], plan, len(req.items))
+    if not quota["allowed"]:
+        raise HTTPException(status_code=429, detail=f"Not enough daily analyses left for {len(req.items)} items (limit {quota['limit']}). Upgrade to Pro for unlimited analyses.")
+    # Items fan out through the same cache and single-flight path as
+    # /analyze/content, so duplicates within a batch cost one LLM call.
+    sem = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def analyze_item(item: AnalyzeContentRequest):
+        async with sem:
+            return await cached_content_analysis(item.content, item.platform, plan)
+
+    records, results = [], []
+    try:
+        outcomes = await asyncio.gather(*(analyze_item(item) for item in req.items), return_exceptions=True)
+        now = datetime.now(timezone.utc).isoformat()
+        for i, (item, outcome) in enumerate(zip(req.items, outcomes)):
+            if isinstance(outcome, BaseException):
+                logger.error(f"Batch item {i} failed: {outcome}")
+                results.append({"index": i, "ok": False, "error": "Analysis failed"})
+                continue
+            analysis, cache_outcome = outcome
+            record = {
+                "analysis_id": f"an_{uuid.uuid4().hex[:12]}",
+                "user_id": user["user_id"],
+                "content": item.content[:500],
+                "platform": item.platform,
+                "result": analysis,
+                "favorited": False,
+                "created_at": now,
+            }
+            records.append(record)
+            results.append({"index": i, "ok": True, "analysis_id": record["analysis_id"], "cache": cache_outcome, **analysis})
+        if records:
+            await db.analyses.insert_many([dict(r) for r in records])
+    except BaseException:
+        # Shielded: a cancelled caller must not cancel the refund as well.
+        await asyncio.shield(refund_daily_quota(quota))
+        raise
+    await settle_daily_quota(quota, len(records))
+    new_achievements = []
+    if records:
+        new_achievements = await award_analysis_rewards(user["user_id"], records)
+    remaining = quota["limit"] - quota["used"] - len(records) if quota["limit"] > 0 else -1
+    return {"results": results, "succeeded": len(records), "failed": len(results) - len(records),
+            "remaining_today": remaining, "new_achievements": new_achievements, "xp_earned": 10 * len(records)}
+
+VIDEO_META_DEADLINE = float(os.environ.get("VIDEO_META_DEADLINE", "8"))
+# Once oEmbed has produced a title, the page fetch gets at most this much
+# longer before the LLM call starts without it.
+VIDEO_META_GRACE = float(os.environ.get("VIDEO_META_GRACE", "1.5"))
+
+async def fetch_oembed(url: str, platform: str, timeout: float) -> dict:
     oembed_map = {
-        "youtube": f"https://www.youtube.com/oembed?url={req.url}&format=json",
-        "tiktok": f"https://www.tiktok.com/oembed?url={req.url}",
-        "instagram": f"https://api.instagram.com/oembed/?url={req.url}",
+        "youtube": f"https://www.youtube.com/oembed?url={url}&format=json",
+        "tiktok": f"https://www.tiktok.com/oembed?url={url}",
+        "instagram": f"https://api.instagram.com/oembed/?url={url}",
     }
-    async with httpx.AsyncClient(timeout=12, follow_redirects=True) as hc:
-        try:
-            oembed_resp = await hc.get(oembed_map[platform])
-            if oembed_resp.status_code == 200:
-                od = oembed_resp.json()
-                video_data["title"] = od.get("title", "")
-                video_data["author"] = od.get("author_name", "")
-                video_data["thumbnail"] = od.get("thumbnail_url", "")
-        except Exception:
-            pass
+    resp = await outbound_http.get(oembed_map[platform], timeout=timeout, follow_redirects=True)
+    if resp.status_code != 200:
+        return {}
+    od = resp.json()
+    return {"title": od.get("title", ""), "author": od.get("author_name", ""), "thumbnail": od.get("thumbnail_url", "")}
+
+# Only the <head> is needed for Open Graph tags, and TikTok/Instagram pages
+# carry 1-2 MB of body after it, so the page is read incrementally and
+# parsing stops at </head> (or <body>) or after PAGE_META_MAX_BYTES.
+PAGE_META_MAX_BYTES = int(os.environ.get("PAGE_META_MAX_BYTES", str(512 * 1024)))
+PAGE_META_CHUNK = 16 * 1024
+OG_FIELDS = {"og:title": "title", "og:description": "description", "og:image": "thumbnail"}
+
+class HeadMetaParser(HTMLParser):
+    def __init__(self, encoding: str = "utf-8", max_bytes: int = PAGE_META_MAX_BYTES):
+        super().__init__(convert_charrefs=True)
         try:
-            page_resp = await hc.get(req.url, headers={"User-Agent": "Mozilla/5.0"})
-            html = page_resp.text
-            og_desc = re.search(r'<meta[^>]*property=["\']og:description["\'][^>]*content=["\']([^"\']*)["\']', html)
-            og_title = re.search(r'<meta[^>]*property=["\']og:title["\'][^>]*content=["\']([^"\']*)["\']', html)
-            og_img = re.search(r'<meta[^>]*property=["\']og:image["\'][^>]*content=["\']([^"\']*)["\']', html)
-            if og_desc:
-                video_data["description"] = og_desc.group(1)[:500]
-            if og_title and not video_data["title"]:
-                video_data["title"] = og_title.group(1)
-            if og_img and not video_data["thumbnail"]:
-                video_data["thumbnail"] = og_img.group(1)
-            all_text = video_data["description"] + " " + video_data["title"]
-            video_data["hashtags"] = list(set(re.findall(r'#\w+', all_text)))[:15]
-        except Exception:
-            pass
-    # Now analyze with AI
+            self.decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        except LookupError:
+            self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self.meta = {}
+        self.done = False
+
+    def feed_bytes(self, chunk: bytes) -> bool:
+        # Returns True once nothing more needs to be read.
+        self.bytes_read += len(chunk)
+        self.feed(self.decoder.decode(chunk))
+        return self.done or self.bytes_read >= self.max_bytes
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "meta":
+            attrs = dict(attrs)
+            field = OG_FIELDS.get((attrs.get("property") or "").lower())
+            if field and field not in self.meta and attrs.get("content") is not None:
+                self.meta[field] = attrs["content"][:500] if field == "description" else attrs["content"]
+        elif tag == "body":
+            self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == "head":
+            self.done = True
+
+async def fetch_page_meta(url: str, timeout: float) -> dict:
+    async with outbound_http.stream("GET", url, headers={"User-Agent": "Mozilla/5.0"}, timeout=timeout,
+                                    follow_redirects=True) as resp:
+        parser = HeadMetaParser(resp.encoding or "utf-8")
+        async for chunk in resp.aiter_bytes(PAGE_META_CHUNK):
+            if parser.feed_bytes(chunk):
+                break
+    return {**parser.meta, "page_bytes": parser.bytes_read}
+
+def _stage_result(task: asyncio.Task) -> dict:
+    if not task.done() or task.cancelled() or task.exception() is not None:
+        return {}
+    return task.result()
+
+async def extract_video_metadata(url: str, platform: str) -> dict:
+    # oEmbed and the page's meta tags are fetched concurrently under one
+    # deadline; whichever stage is still running when we move on is dropped.
+    video_data = {"url": url, "platform": platform, "title": "", "author": "", "thumbnail": "", "description": "", "hashtags": []}
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + VIDEO_META_DEADLINE
+    timings = {}
+
+    async def timed(stage: str, coro):
+        t0 = loop.time()
+        result = await coro
+        timings[f"{stage}_ms"] = round((loop.time() - t0) * 1000, 1)
+        return result
+
+    oembed = asyncio.create_task(timed("oembed", fetch_oembed(url, platform, VIDEO_META_DEADLINE)))
+    page = asyncio.create_task(timed("page", fetch_page_meta(url, VIDEO_META_DEADLINE)))
+    stages = {oembed: "oembed", page: "page"}
+    pending = set(stages)
+    oembed_done_at = None
+    try:
+        while pending:
+            until = deadline
+            if oembed_done_at is not None and _stage_result(oembed).get("title"):
+                until = min(until, oembed_done_at + VIDEO_META_GRACE)
+            timeout = until - loop.time()
+            if timeout <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if oembed in done:
+                oembed_done_at = loop.time()
+    finally:
+        for task in pending:
+            task.cancel()
+    timings["skipped"] = sorted(stages[t] for t in pending)
+    timings["metadata_ms"] = round((loop.time() - started) * 1000, 1)
+
+    od, page_meta = _stage_result(oembed), _stage_result(page)
+    if "page_bytes" in page_meta:
+        timings["page_bytes"] = page_meta["page_bytes"]
+    video_data.update(od)
+    video_data["description"] = page_meta.get("description", "")
+    for field in ("title", "thumbnail"):
+        if not video_data[field]:
+            video_data[field] = page_meta.get(field, "")
+    all_text = video_data["description"] + " " + video_data["title"]
+    video_data["hashtags"] = list(set(re.findall(r'#\w+', all_text)))[:15]
+    video_data["timings"] = timings
+    return video_data
+
+def video_analysis_prompt(video_data: dict, plan: str) -> tuple:
+    platform = video_data["platform"]
     features = get_plan_features(plan)
     base_fields = '"viral_score": <0-100>, "strengths": [3-4], "weaknesses": [3-4], "suggestions": [4-5], "summary": "2 sentences"'
     extra = ""
@@ -466,63 +2420,601 @@ async def analyze_video_link(req: VideoLinkRequest, request: Request):
     if features["deep"]:
         extra += ', "script_suggestion": "3-4 sentence script", "style_analysis": "sentence", "trend_connections": [2-3]'
     system_msg = f"You are an expert social media analyst. Return ONLY valid JSON: {{{base_fields}{extra}}}"
+    prompt = f"Platform: {platform}\nTitle: {video_data['title']}\nAuthor: {video_data['author']}\nDescription: {video_data['description']}\nHashtags: {', '.join(video_data['hashtags'])}\nURL: {video_data['url']}"
+    return system_msg, prompt
+
+def video_fallback_analysis(ai_response: Optional[str] = None) -> dict:
+    # ai_response is the unparseable model output, or None when the call failed.
+    if ai_response is not None:
+        return {"viral_score": 68, "strengths": ["Active on platform", "Content detected"],
+                "weaknesses": ["Limited metadata extracted"], "suggestions": ["Optimize your caption", "Add trending hashtags"],
+                "summary": ai_response[:200] if ai_response else "Analysis completed with limited data."}
+    return {"viral_score": 70, "strengths": ["Content is on a major platform"],
+            "weaknesses": ["Unable to fully analyze"], "suggestions": ["Try pasting your caption text directly for deeper analysis"],
+            "summary": "Basic analysis completed. For better results, paste your caption/script text."}
+
+async def generate_video_analysis(video_data: dict, plan: str) -> dict:
+    system_msg, prompt = video_analysis_prompt(video_data, plan)
     try:
-        from emergentintegrations.llm.chat import LlmChat, UserMessage
-        chat = LlmChat(api_key=os.environ.get("EMERGENT_LLM_KEY"), session_id=f"vl-{uuid.uuid4().hex[:8]}",
-                       system_message=system_msg).with_model("openai", "gpt-5.2")
-        prompt = f"Platform: {platform}\nTitle: {video_data['title']}\nAuthor: {video_data['author']}\nDescription: {video_data['description']}\nHashtags: {', '.join(video_data['hashtags'])}\nURL: {req.url}"
-        ai_resp = await chat.send_message(UserMessage(text=prompt))
+        ai_resp = await llm_complete(system_msg, prompt, plan, "vl")
         try:
-            cleaned = ai_resp.strip()
-            if cleaned.startswith("```"):
-                cleaned = cleaned.split("\n", 1)[1] if "\n" in cleaned else cleaned[3:]
-                if cleaned.endswith("```"):
-                    cleaned = cleaned[:-3]
-            analysis = json.loads(cleaned.strip())
+            analysis = parse_llm_json(ai_resp)
         except json.JSONDecodeError:
-            analysis = {"viral_score": 68, "strengths": ["Active on platform", "Content detected"],
-                        "weaknesses": ["Limited metadata extracted"], "suggestions": ["Optimize your caption", "Add trending hashtags"],
-                        "summary": ai_resp[:200] if ai_resp else "Analysis completed with limited data."}
+            analysis = video_fallback_analysis(ai_resp)
     except Exception as e:
-        logger.error(f"Video link AI error: {e}")
-        analysis = {"viral_score": 70, "strengths": ["Content is on a major platform"],
-                    "weaknesses": ["Unable to fully analyze"], "suggestions": ["Try pasting your caption text directly for deeper analysis"],
-                    "summary": "Basic analysis completed. For better results, paste your caption/script text."}
-    record = {
-        "analysis_id": f"an_{uuid.uuid4().hex[:12]}", "user_id": user["user_id"],
-        "content": req.url, "platform": platform, "video_data": video_data,
-        "result": analysis, "favorited": False,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-    }
-    await db.analyses.insert_one(record)
-    await award_xp(user["user_id"], 10, "Video link analysis")
-    count = await db.analyses.count_documents({"user_id": user["user_id"]})
-    new_ach = await check_and_award_achievements(user["user_id"], analysis_count=count, viral_score=analysis.get("viral_score", 0))
-    remaining = limit - used - 1 if limit > 0 else -1
+        note_llm_fallback("Video link AI error", e)
+        analysis = video_fallback_analysis()
+    return analysis
+
+# Scraped metadata keyed on the canonical video key. Scrapes that found
+# nothing are cached briefly too, so a dead link is not re-fetched per user.
+VIDEO_META_TTL = float(os.environ.get("VIDEO_META_TTL", str(6 * 3600)))
+VIDEO_META_NEGATIVE_TTL = float(os.environ.get("VIDEO_META_NEGATIVE_TTL", "300"))
+video_meta_cache = TTLCache(maxsize=int(os.environ.get("VIDEO_META_CACHE_SIZE", "5000")), ttl=VIDEO_META_TTL)
+
+async def cached_video_metadata(url: str) -> dict:
+    video = canonicalize_video_url(url)
+    if not video:
+        raise ValueError(f"Unsupported video URL: {url}")
+    cached = video_meta_cache.get(video["key"])
+    if cached is not None:
+        return {**cached, "timings": {"metadata_ms": 0.0, "cache": "hit"}}
+
+    async def fill():
+        video_data = await extract_video_metadata(video["url"], video["platform"])
+        video_data["video_id"] = video["video_id"]
+        found = video_data["title"] or video_data["description"]
+        video_meta_cache.set(video["key"], video_data, ttl=None if found else VIDEO_META_NEGATIVE_TTL)
+        return video_data
+
+    video_data = await inflight.do(f"meta:{video['key']}", fill)
+    return {**video_data, "timings": {**video_data.get("timings", {}), "cache": "miss"}}
+
+def with_llm_timing(video_data: dict, started: float) -> dict:
+    # Metadata is shared between requests, so the LLM stage goes on a copy.
+    timings = {**video_data.get("timings", {}), "llm_ms": round((time.monotonic() - started) * 1000, 1)}
+    return {**video_data, "timings": timings}
+
+async def coalesced_video_analysis(url: str, platform: str, plan: str) -> tuple:
+    # Metadata is shared by every request for the video; the LLM call is shared
+    # per plan tier because the prompt differs between tiers.
+    video_key = canonicalize_video_url(url)["key"]
+
+    async def run():
+        video_data = await cached_video_metadata(url)
+        started = time.monotonic()
+        analysis = await generate_video_analysis(video_data, plan)
+        return with_llm_timing(video_data, started), analysis
+
+    video_data, analysis = await inflight.do(f"video:{plan_tier(plan)}:{video_key}", run)
+    return dict(video_data), dict(analysis)
+
+async def perform_video_analysis(user_id: str, plan: str, url: str, platform: str, quota: dict,
+                                 analysis_id: Optional[str] = None) -> dict:
+    try:
+        video_data, analysis = await coalesced_video_analysis(url, platform, plan)
+        record = {
+            "analysis_id": analysis_id or f"an_{uuid.uuid4().hex[:12]}", "user_id": user_id,
+            "content": url, "platform": platform, "video_data": video_data,
+            "result": analysis, "favorited": False,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        await db.analyses.insert_one(record)
+    except BaseException:
+        # Shielded: a cancelled caller must not cancel the refund as well.
+        await asyncio.shield(refund_daily_quota(quota))
+        raise
+    await commit_daily_quota(quota)
+    new_ach = await award_analysis_rewards(user_id, [record])
+    remaining = quota["limit"] - quota["used"] - 1 if quota["limit"] > 0 else -1
     return {"analysis_id": record["analysis_id"], "video_data": video_data, "remaining_today": remaining,
             "new_achievements": new_ach, "xp_earned": 10, **analysis}
 
-# ── Dashboard ───────────────────────────────────────────
-@api_router.get("/dashboard/overview")
-async def dashboard_overview(request: Request):
+@api_router.post("/analyze/video-link")
+async def analyze_video_link(req: VideoLinkRequest, request: Request):
     user = await get_current_user(request)
-    uid = user["user_id"]
     plan = user.get("plan", "free")
-    analysis_count = await db.analyses.count_documents({"user_id": uid})
-    xp = await get_xp(uid)
-    level = get_level_info(xp)
-    achievements = await db.user_achievements.find({"user_id": uid}, {"_id": 0}).to_list(100)
-    allowed, limit, used = await check_daily_limit(uid, plan)
-    # Compute avg viral score
-    pipeline = [{"$match": {"user_id": uid}}, {"$group": {"_id": None, "avg_score": {"$avg": "$result.viral_score"}}}]
-    avg_result = await db.analyses.aggregate(pipeline).to_list(1)
-    avg_score = round(avg_result[0]["avg_score"], 1) if avg_result and avg_result[0].get("avg_score") else 0
+    platform = detect_platform(req.url)
+    if not platform:
+        raise HTTPException(status_code=400, detail="Unsupported URL. Please paste a TikTok, Instagram, or YouTube link.")
+    quota = await reserve_daily_quota(user["user_id"], plan)
+    if not quota["allowed"]:
+        raise HTTPException(status_code=429, detail=f"Daily limit reached ({quota['limit']}). Upgrade for unlimited.")
+    return await perform_video_analysis(user["user_id"], plan, req.url, platform, quota)
+
+# ── Streaming Analysis ──────────────────────────────────
+# SSE variants of the analyze endpoints. Each top-level field of the model's
+# JSON answer is sent as a "field" event as soon as its value is complete;
+# the final "done" event carries the same payload as the non-streaming route.
+class JsonFieldStream:
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0
+        self.started = False
+        self.done = False
+
+    def feed(self, chunk: str) -> list:
+        self.buf += chunk
+        fields = []
+        while not self.done:
+            field = self._next_field()
+            if field is None:
+                break
+            fields.append(field)
+        return fields
+
+    def _skip(self, i: int, chars: str = " \t\r\n") -> int:
+        while i < len(self.buf) and self.buf[i] in chars:
+            i += 1
+        return i
+
+    def _scan_string(self, i: int) -> Optional[int]:
+        j = i + 1
+        while j < len(self.buf):
+            c = self.buf[j]
+            if c == "\\":
+                j += 2
+                continue
+            if c == '"':
+                return j + 1
+            j += 1
+        return None
+
+    def _scan_value(self, i: int) -> Optional[int]:
+        buf = self.buf
+        if buf[i] == '"':
+            return self._scan_string(i)
+        if buf[i] in "{[":
+            depth = 0
+            j = i
+            while j < len(buf):
+                c = buf[j]
+                if c == '"':
+                    end = self._scan_string(j)
+                    if end is None:
+                        return None
+                    j = end
+                    continue
+                if c in "{[":
+                    depth += 1
+                elif c in "}]":
+                    depth -= 1
+                    if depth == 0:
+                        return j + 1
+                j += 1
+            return None
+        j = i
+        while j < len(buf) and buf[j] not in ",}] \t\r\n":
+            j += 1
+        # A scalar is only complete once its terminator has arrived ("7" may become "72").
+        return j if j < len(buf) else None
+
+    def _next_field(self) -> Optional[tuple]:
+        buf = self.buf
+        i = self.pos
+        if not self.started:
+            j = buf.find("{", i)
+            if j < 0:
+                return None
+            self.started = True
+            i = self.pos = j + 1
+        i = self._skip(i, " \t\r\n,")
+        if i >= len(buf):
+            return None
+        if buf[i] != '"':
+            self.done = True
+            return None
+        key_start = i
+        key_end = self._scan_string(i)
+        if key_end is None:
+            return None
+        i = self._skip(key_end)
+        if i >= len(buf):
+            return None
+        if buf[i] != ":":
+            self.done = True
+            return None
+        i = self._skip(i + 1)
+        if i >= len(buf):
+            return None
+        end = self._scan_value(i)
+        if end is None:
+            return None
+        try:
+            key, value = json.loads(buf[key_start:key_end]), json.loads(buf[i:end])
+        except json.JSONDecodeError:
+            self.done = True
+            return None
+        self.pos = end
+        return key, value
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def stream_analysis_fields(system_msg: str, prompt: str, plan: str, session_prefix: str, fallback, outcome: dict):
+    # Yields (field, value) pairs; the complete analysis and whether it may be
+    # cached are left in `outcome` once the generator is exhausted.
+    parser = JsonFieldStream()
+    text = ""
+    sent = {}
+    try:
+        async for chunk in llm_stream(system_msg, prompt, plan, session_prefix):
+            text += chunk
+            for key, value in parser.feed(chunk):
+                sent[key] = value
+                yield key, value
+        try:
+            analysis, cacheable = parse_llm_json(text), True
+        except json.JSONDecodeError:
+            analysis, cacheable = fallback(text), False
+    except Exception as e:
+        note_llm_fallback(f"{session_prefix} stream error", e)
+        analysis, cacheable = fallback(), False
+    for key, value in analysis.items():
+        if key not in sent or sent[key] != value:
+            yield key, value
+    outcome.update(analysis=analysis, cacheable=cacheable)
+
+async def coalesced_analysis_fields(flight_key: str, system_msg: str, prompt: str, plan: str, session_prefix: str,
+                                    fallback, outcome: dict, on_complete=None):
+    # stream_analysis_fields() shared between identical concurrent streams:
+    # one LLM stream per flight_key, fanned out to every caller. on_complete
+    # runs once, in the producer, with the finished outcome.
+    async def produce():
+        result = {}
+        async for field, value in stream_analysis_fields(system_msg, prompt, plan, session_prefix, fallback, result):
+            yield "field", field, value
+        if on_complete is not None:
+            await on_complete(result)
+        yield "outcome", result["analysis"], result["cacheable"]
+
+    async for kind, a, b in inflight.stream(flight_key, produce):
+        if kind == "field":
+            yield a, b
+        else:
+            outcome.update(analysis=dict(a), cacheable=b)
+
+def sse_response(events) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@api_router.post("/analyze/content/stream")
+async def analyze_content_stream(req: AnalyzeContentRequest, request: Request):
+    user = await get_current_user(request)
+    plan = user.get("plan", "free")
+    quota = await reserve_daily_quota(user["user_id"], plan)
+    if not quota["allowed"]:
+        raise HTTPException(status_code=429, detail=f"Daily analysis limit reached ({quota['limit']}). Upgrade to Pro for unlimited analyses.")
+
+    async def events():
+        try:
+            key = analysis_cache_key(req.content, req.platform, plan)
+            analysis, cache_outcome = await lookup_analysis_cache(key)
+            yield sse_event("meta", {"cache": cache_outcome})
+            if analysis is not None:
+                for field, value in analysis.items():
+                    yield sse_event("field", {"field": field, "value": value})
+            else:
+                outcome = {}
+                system_msg, prompt = content_analysis_prompt(req.content, req.platform, plan)
+
+                async def store(result):
+                    if result["cacheable"]:
+                        analysis_cache_local.set(key, result["analysis"])
+                        await store_analysis_cache(key, req.platform, plan, result["analysis"])
+
+                async for field, value in coalesced_analysis_fields(f"content:{key}", system_msg, prompt, plan, "analysis",
+                                                                    content_fallback_analysis, outcome, store):
+                    yield sse_event("field", {"field": field, "value": value})
+                analysis = outcome["analysis"]
+            analysis_record = {
+                "analysis_id": f"an_{uuid.uuid4().hex[:12]}",
+                "user_id": user["user_id"],
+                "content": req.content[:500],
+                "platform": req.platform,
+                "result": analysis,
+                "favorited": False,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            }
+            await db.analyses.insert_one(analysis_record)
+        except Exception as e:
+            await refund_daily_quota(quota)
+            logger.error(f"Streaming analysis error: {e}")
+            yield sse_event("error", {"detail": "Analysis failed"})
+            return
+        except BaseException:
+            # The generator is being closed or cancelled; shielded so the
+            # refund itself is not cancelled with it.
+            await asyncio.shield(refund_daily_quota(quota))
+            raise
+        await asyncio.shield(commit_daily_quota(quota))
+        new_achievements = await award_analysis_rewards(user["user_id"], [analysis_record])
+        remaining = quota["limit"] - quota["used"] - 1 if quota["limit"] > 0 else -1
+        yield sse_event("done", {"analysis_id": analysis_record["analysis_id"], "remaining_today": remaining,
+                                 "new_achievements": new_achievements, "xp_earned": 10, "cache": cache_outcome, **analysis})
+
+    return sse_response(events())
+
+@api_router.post("/analyze/video-link/stream")
+async def analyze_video_link_stream(req: VideoLinkRequest, request: Request):
+    user = await get_current_user(request)
+    plan = user.get("plan", "free")
+    platform = detect_platform(req.url)
+    if not platform:
+        raise HTTPException(status_code=400, detail="Unsupported URL. Please paste a TikTok, Instagram, or YouTube link.")
+    quota = await reserve_daily_quota(user["user_id"], plan)
+    if not quota["allowed"]:
+        raise HTTPException(status_code=429, detail=f"Daily limit reached ({quota['limit']}). Upgrade for unlimited.")
+
+    async def events():
+        try:
+            video_data = await cached_video_metadata(req.url)
+            yield sse_event("video_data", video_data)
+            outcome = {}
+            started = time.monotonic()
+            system_msg, prompt = video_analysis_prompt(video_data, plan)
+            flight_key = f"video:{plan_tier(plan)}:{canonicalize_video_url(req.url)['key']}"
+            async for field, value in coalesced_analysis_fields(flight_key, system_msg, prompt, plan, "vl",
+                                                                video_fallback_analysis, outcome):
+                yield sse_event("field", {"field": field, "value": value})
+            analysis = outcome["analysis"]
+            video_data = with_llm_timing(video_data, started)
+            record = {
+                "analysis_id": f"an_{uuid.uuid4().hex[:12]}", "user_id": user["user_id"],
+                "content": req.url, "platform": platform, "video_data": video_data,
+                "result": analysis, "favorited": False,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            }
+            await db.analyses.insert_one(record)
+        except Exception as e:
+            await refund_daily_quota(quota)
+            logger.error(f"Streaming video analysis error: {e}")
+            yield sse_event("error", {"detail": "Analysis failed"})
+            return
+        except BaseException:
+            # The generator is being closed or cancelled; shielded so the
+            # refund itself is not cancelled with it.
+            await asyncio.shield(refund_daily_quota(quota))
+            raise
+        await asyncio.shield(commit_daily_quota(quota))
+        new_ach = await award_analysis_rewards(user["user_id"], [record])
+        remaining = quota["limit"] - quota["used"] - 1 if quota["limit"] > 0 else -1
+        yield sse_event("done", {"analysis_id": record["analysis_id"], "video_data": video_data, "remaining_today": remaining,
+                                 "new_achievements": new_ach, "xp_earned": 10, **analysis})
+
+    return sse_response(events())
+
+# ── Analysis Jobs ───────────────────────────────────────
+# Queued analyses: submitting returns a job id at once and a pool of asyncio
+# workers drains the Mongo-backed analysis_jobs queue. Jobs are claimed with a
+# lease, so jobs left "running" by a crashed process are picked up again once
+# their lease expires. Quota is reserved at submit time and carried in the job.
+# The analysis_id is allocated at submit time too, so an attempt interrupted
+# after storing its analysis is finished from that record, not run again.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_LEASE = int(os.environ.get("JOB_LEASE", str(int(LLM_TIMEOUT * 2 + 60))))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "1.0"))
+JOB_RESULT_TTL = int(os.environ.get("JOB_RESULT_TTL", str(24 * 3600)))
+job_wakeup = asyncio.Event()
+job_worker_tasks: List[asyncio.Task] = []
+job_stats = {"submitted": 0, "completed": 0, "failed": 0, "requeued": 0, "busy_workers": 0,
+             "wait_ms": deque(maxlen=1000), "service_ms": deque(maxlen=1000)}
+
+async def submit_analysis_job(user_id: str, plan: str, kind: str, payload: dict, quota: dict) -> dict:
+    now = datetime.now(timezone.utc)
+    job = {
+        "job_id": f"job_{uuid.uuid4().hex[:12]}", "user_id": user_id, "plan": plan,
+        "kind": kind, "payload": payload, "quota": quota, "analysis_id": f"an_{uuid.uuid4().hex[:12]}",
+        "status": "queued", "attempts": 0, "created_at": now,
+    }
+    try:
+        await db.analysis_jobs.insert_one(job)
+    except BaseException:
+        # Shielded: a cancelled caller must not cancel the refund as well.
+        await asyncio.shield(refund_daily_quota(quota))
+        raise
+    job_stats["submitted"] += 1
+    job_wakeup.set()
+    return {"job_id": job["job_id"], "status": "queued", "created_at": now.isoformat()}
+
+async def claim_job(worker_id: str) -> Optional[dict]:
+    now = datetime.now(timezone.utc)
+    return await db.analysis_jobs.find_one_and_update(
+        {"$or": [{"status": "queued"}, {"status": "running", "lease_until": {"$lt": now}}]},
+        {"$set": {"status": "running", "worker_id": worker_id, "started_at": now,
+                  "lease_until": now + timedelta(seconds=JOB_LEASE)},
+         "$inc": {"attempts": 1}},
+        sort=[("created_at", ASCENDING)], projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+
+async def finish_job(job: dict, status: str, **fields):
+    now = datetime.now(timezone.utc)
+    await db.analysis_jobs.update_one(
+        {"job_id": job["job_id"]},
+        {"$set": {"status": status, "finished_at": now, "expires_at": now + timedelta(seconds=JOB_RESULT_TTL), **fields},
+         "$unset": {"lease_until": "", "quota": ""}},
+    )
+
+async def stored_job_result(job: dict) -> Optional[dict]:
+    # The result of an earlier attempt that got as far as storing its analysis.
+    if not job.get("analysis_id"):
+        return None
+    record = await db.analyses.find_one({"analysis_id": job["analysis_id"], "user_id": job["user_id"]}, {"_id": 0})
+    if record is None:
+        return None
+    result = {"analysis_id": record["analysis_id"], "new_achievements": [], "xp_earned": 10, **record["result"]}
+    if "video_data" in record:
+        result["video_data"] = record["video_data"]
+    return result
+
+async def finish_stored_job(job: dict, result: dict):
+    if job.get("quota"):
+        # No-op if the interrupted attempt already committed it.
+        await commit_daily_quota(job["quota"])
+    await finish_job(job, "done", result=result)
+    job_stats["completed"] += 1
+
+async def requeue_job(job: dict, worker_id: str):
+    # Before the analysis is stored, perform_* has refunded the reservation and
+    # the next attempt reserves again; after, the reservation stays with the job.
+    stored = await stored_job_result(job)
+    await db.analysis_jobs.update_one(
+        {"job_id": job["job_id"], "worker_id": worker_id},
+        {"$set": {"status": "queued", "quota": job.get("quota") if stored else None}, "$unset": {"lease_until": ""}},
+    )
+    job_stats["requeued"] += 1
+
+async def process_job(job: dict, worker_id: str):
+    uid = job["user_id"]
+    stored = await stored_job_result(job)
+    if stored is not None:
+        await finish_stored_job(job, stored)
+        return
+    if job["attempts"] > JOB_MAX_ATTEMPTS:
+        if job.get("quota"):
+            await refund_daily_quota(job["quota"])
+        await finish_job(job, "failed", error="Job exceeded its retry limit")
+        job_stats["failed"] += 1
+        return
+    quota = job.get("quota")
+    if not quota:
+        # The job was interrupted earlier and its reservation refunded.
+        quota = await reserve_daily_quota(uid, job["plan"], hold=None)
+        if not quota["allowed"]:
+            await finish_job(job, "failed", error="Daily analysis limit reached")
+            job_stats["failed"] += 1
+            return
+    payload = job["payload"]
+    service_start = time.monotonic()
+    try:
+        if job["kind"] == "video":
+            result = await perform_video_analysis(uid, job["plan"], payload["url"], payload["platform"], quota,
+                                                  job.get("analysis_id"))
+        else:
+            result = await perform_content_analysis(uid, job["plan"], payload["content"], payload["platform"], quota,
+                                                    job.get("analysis_id"))
+    except asyncio.CancelledError:
+        await asyncio.shield(requeue_job({**job, "quota": quota}, worker_id))
+        raise
+    except DuplicateKeyError:
+        # Another worker took over this job after its lease ran out and stored
+        # the analysis first.
+        stored = await stored_job_result(job)
+        if stored is not None:
+            await finish_stored_job({**job, "quota": None}, stored)
+            return
+        raise
+    except Exception as e:
+        logger.error(f"Analysis job {job['job_id']} failed: {e}")
+        await finish_job(job, "failed", error="Analysis failed")
+        job_stats["failed"] += 1
+        return
+    job_stats["service_ms"].append((time.monotonic() - service_start) * 1000)
+    await finish_job(job, "done", result=result)
+    job_stats["completed"] += 1
+
+async def job_worker(worker_id: str):
+    while True:
+        try:
+            job = await claim_job(worker_id)
+        except Exception as e:
+            logger.error(f"Job claim error: {e}")
+            job = None
+        if job is None:
+            job_wakeup.clear()
+            try:
+                await asyncio.wait_for(job_wakeup.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        created_at = _as_utc(job["created_at"])
+        job_stats["wait_ms"].append((datetime.now(timezone.utc) - created_at).total_seconds() * 1000)
+        job_stats["busy_workers"] += 1
+        try:
+            await process_job(job, worker_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job worker {worker_id} error: {e}")
+        finally:
+            job_stats["busy_workers"] -= 1
+
+def start_job_workers():
+    for i in range(JOB_WORKERS):
+        job_worker_tasks.append(asyncio.create_task(job_worker(f"{os.getpid()}-{i}")))
+
+async def stop_job_workers():
+    for task in job_worker_tasks:
+        task.cancel()
+    await asyncio.gather(*job_worker_tasks, return_exceptions=True)
+    job_worker_tasks.clear()
+
+async def job_queue_stats() -> dict:
+    queued = await db.analysis_jobs.count_documents({"status": "queued"})
+    running = await db.analysis_jobs.count_documents({"status": "running"})
+    return {
+        "queue_depth": queued, "running": running, "workers": JOB_WORKERS,
+        "busy_workers": job_stats["busy_workers"],
+        **{k: job_stats[k] for k in ("submitted", "completed", "failed", "requeued")},
+        "wait_ms": percentiles(job_stats["wait_ms"]), "service_ms": percentiles(job_stats["service_ms"]),
+    }
+
+@api_router.post("/jobs/analyze/content", status_code=202)
+async def submit_content_job(req: AnalyzeContentRequest, request: Request):
+    user = await get_current_user(request)
+    plan = user.get("plan", "free")
+    quota = await reserve_daily_quota(user["user_id"], plan, hold=None)
+    if not quota["allowed"]:
+        raise HTTPException(status_code=429, detail=f"Daily analysis limit reached ({quota['limit']}). Upgrade to Pro for unlimited analyses.")
+    return await submit_analysis_job(user["user_id"], plan, "content", {"content": req.content, "platform": req.platform}, quota)
+
+@api_router.post("/jobs/analyze/video-link", status_code=202)
+async def submit_video_job(req: VideoLinkRequest, request: Request):
+    user = await get_current_user(request)
+    plan = user.get("plan", "free")
+    platform = detect_platform(req.url)
+    if not platform:
+        raise HTTPException(status_code=400, detail="Unsupported URL. Please paste a TikTok, Instagram, or YouTube link.")
+    quota = await reserve_daily_quota(user["user_id"], plan, hold=None)
+    if not quota["allowed"]:
+        raise HTTPException(status_code=429, detail=f"Daily limit reached ({quota['limit']}). Upgrade for unlimited.")
+    return await submit_analysis_job(user["user_id"], plan, "video", {"url": req.url, "platform": platform}, quota)
+
+@api_router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str, request: Request):
+    user = await get_current_user(request)
+    job = await db.analysis_jobs.find_one(
+        {"job_id": job_id, "user_id": user["user_id"]},
+        {"_id": 0, "job_id": 1, "kind": 1, "status": 1, "created_at": 1, "started_at": 1,
+         "finished_at": 1, "result": 1, "error": 1},
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    for field in ("created_at", "started_at", "finished_at"):
+        if isinstance(job.get(field), datetime):
+            job[field] = job[field].isoformat()
+    return job
+
+# ── Dashboard ───────────────────────────────────────────
+async def build_dashboard_overview(uid: str, plan: str) -> dict:
+    rollup, stats, achievements, (allowed, limit, used) = await asyncio.gather(
+        get_user_rollup(uid),
+        db.user_stats.find_one({"user_id": uid}, {"_id": 0}),
+        db.user_achievements.find({"user_id": uid}, {"_id": 0}).to_list(100),
+        check_daily_limit(uid, plan),
+    )
+    level = get_level_info(stats.get("xp", 0) if stats else 0)
+    analytics = rollup_summary(rollup)
     return {
         "metrics": {
             "reach_score": 78, "growth_rate": 12.5, "engagement_score": 85,
-            "total_analyses": analysis_count, "avg_viral_score": avg_score,
+            "total_analyses": analytics["total_analyses"], "avg_viral_score": analytics["avg_viral_score"],
         },
+        "analytics": analytics,
         "level": level,
+        "streak": streak_view(stats),
         "achievements": [{"achievement_id": a["achievement_id"], "earned_at": a["earned_at"],
                           **ACHIEVEMENTS_DEF.get(a["achievement_id"], {})} for a in achievements],
         "all_achievements": [{**v, "id": k} for k, v in ACHIEVEMENTS_DEF.items()],
@@ -535,16 +3027,86 @@ async def dashboard_overview(request: Request):
         ],
     }
 
+@api_router.get("/dashboard/overview")
+async def dashboard_overview(request: Request, response: Response):
+    user = await get_current_user(request)
+    uid = user["user_id"]
+    plan = user.get("plan", "free")
+    cached = overview_cache.get(uid)
+    if cached is None or cached[0]["plan"] != plan:
+        payload = await build_dashboard_overview(uid, plan)
+        etag = '"' + hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest() + '"'
+        cached = (payload, etag)
+        overview_cache.set(uid, cached)
+    payload, etag = cached
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return payload
+
+# History lists page by keyset on (created_at, analysis_id), newest first, and
+# return a summary projection unless the caller asks for specific fields.
+ANALYSIS_SUMMARY_FIELDS = ["analysis_id", "content", "platform", "created_at", "favorited",
+                           "result.viral_score", "result.summary", "video_data.title", "video_data.thumbnail"]
+ANALYSIS_FIELD_RE = re.compile(r"^(analysis_id|content|platform|created_at|favorited|result|video_data)(\.[a-z_]+)?$")
+HISTORY_PAGE_MAX = 100
+
+def analysis_projection(fields: Optional[str], default: Optional[list]) -> dict:
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        bad = [f for f in requested if not ANALYSIS_FIELD_RE.match(f)]
+        if bad:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(bad)}")
+    elif default is None:
+        return {"_id": 0}
+    else:
+        requested = default
+    requested = set(requested) | {"analysis_id", "created_at"}
+    # A parent path and one of its children cannot both be projected.
+    return {"_id": 0, **{f: 1 for f in requested if f.split(".")[0] == f or f.split(".")[0] not in requested}}
+
+def encode_cursor(doc: dict) -> str:
+    raw = json.dumps([doc["created_at"], doc["analysis_id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, analysis_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(created_at), str(analysis_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def after_key(created_at: str, analysis_id: str) -> dict:
+    return {"$or": [{"created_at": {"$lt": created_at}},
+                    {"created_at": created_at, "analysis_id": {"$lt": analysis_id}}]}
+
+async def history_page(base: dict, limit: int, cursor: Optional[str], fields: Optional[str],
+                       history_limit: int = -1) -> dict:
+    limit = max(1, min(limit, HISTORY_PAGE_MAX))
+    clauses = [base]
+    sort = [("created_at", DESCENDING), ("analysis_id", DESCENDING)]
+    if history_limit > 0:
+        # Plans with a history cap only see their newest history_limit analyses.
+        edge = await db.analyses.find(base, {"_id": 0, "created_at": 1, "analysis_id": 1}) \
+            .sort(sort).skip(history_limit - 1).limit(1).to_list(1)
+        if edge:
+            clauses.append({"$or": [{"created_at": {"$gt": edge[0]["created_at"]}},
+                                    {"created_at": edge[0]["created_at"], "analysis_id": {"$gte": edge[0]["analysis_id"]}}]})
+    if cursor:
+        clauses.append(after_key(*decode_cursor(cursor)))
+    query = clauses[0] if len(clauses) == 1 else {"$and": clauses}
+    docs = await db.analyses.find(query, analysis_projection(fields, ANALYSIS_SUMMARY_FIELDS)) \
+        .sort(sort).limit(limit + 1).to_list(limit + 1)
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return {"items": docs[:limit], "next_cursor": next_cursor}
+
 @api_router.get("/dashboard/analyses")
-async def dashboard_analyses(request: Request):
+async def dashboard_analyses(request: Request, limit: int = 20, cursor: Optional[str] = None, fields: Optional[str] = None):
     user = await get_current_user(request)
     plan = user.get("plan", "free")
     features = get_plan_features(plan)
-    limit = features["history_limit"] if features["history_limit"] > 0 else 100
-    analyses = await db.analyses.find(
-        {"user_id": user["user_id"]}, {"_id": 0}
-    ).sort("created_at", -1).to_list(limit)
-    return analyses
+    return await history_page({"user_id": user["user_id"]}, limit, cursor, fields, features["history_limit"])
 
 # ── Favorites ───────────────────────────────────────────
 @api_router.post("/analyses/favorite")
@@ -561,27 +3123,160 @@ async def toggle_favorite(req: FavoriteRequest, request: Request):
     return {"favorited": new_state}
 
 @api_router.get("/analyses/favorites")
-async def get_favorites(request: Request):
+async def get_favorites(request: Request, limit: int = 20, cursor: Optional[str] = None, fields: Optional[str] = None):
     user = await get_current_user(request)
-    favs = await db.analyses.find(
-        {"user_id": user["user_id"], "favorited": True}, {"_id": 0}
-    ).sort("created_at", -1).to_list(50)
-    return favs
+    return await history_page({"user_id": user["user_id"], "favorited": True}, limit, cursor, fields)
+
+SEARCH_MAX_OFFSET = 1000
+
+def parse_date_bound(value: Optional[str], end: bool = False) -> Optional[str]:
+    # Accepts a date or datetime; a bare end date covers that whole day.
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip())
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    if end and len(value.strip()) == 10:
+        parsed += timedelta(days=1)
+    return parsed.isoformat()
+
+def analysis_filters(user_id: str, platform: Optional[str] = None, min_score: Optional[float] = None,
+                     max_score: Optional[float] = None, date_from: Optional[str] = None,
+                     date_to: Optional[str] = None) -> dict:
+    query = {"user_id": user_id}
+    if platform:
+        query["platform"] = platform
+    score = {}
+    if min_score is not None:
+        score["$gte"] = min_score
+    if max_score is not None:
+        score["$lte"] = max_score
+    if score:
+        query["result.viral_score"] = score
+    created = {}
+    if date_from:
+        created["$gte"] = parse_date_bound(date_from)
+    if date_to:
+        bound = parse_date_bound(date_to, end=True)
+        created["$lt" if len(date_to.strip()) == 10 else "$lte"] = bound
+    if created:
+        query["created_at"] = created
+    return query
+
+@api_router.get("/analyses/search")
+async def search_analyses(request: Request, q: str, platform: Optional[str] = None,
+                          min_score: Optional[float] = None, max_score: Optional[float] = None,
+                          date_from: Optional[str] = None, date_to: Optional[str] = None,
+                          limit: int = 20, offset: int = 0, fields: Optional[str] = None):
+    user = await get_current_user(request)
+    if get_plan_features(user.get("plan", "free"))["history_limit"] != -1:
+        raise HTTPException(status_code=403, detail="History search requires Pro plan or higher")
+    q = q.strip()[:200]
+    if not q:
+        raise HTTPException(status_code=400, detail="Search query is required")
+    limit = max(1, min(limit, HISTORY_PAGE_MAX))
+    offset = max(0, min(offset, SEARCH_MAX_OFFSET))
+    query = analysis_filters(user["user_id"], platform, min_score, max_score, date_from, date_to)
+    query["$text"] = {"$search": q}
+    projection = {**analysis_projection(fields, ANALYSIS_SUMMARY_FIELDS), "score": {"$meta": "textScore"}}
+    docs = await db.analyses.find(query, projection) \
+        .sort([("score", {"$meta": "textScore"}), ("created_at", DESCENDING)]) \
+        .skip(offset).limit(limit + 1).to_list(limit + 1)
+    more = len(docs) > limit and offset + limit <= SEARCH_MAX_OFFSET
+    return {"items": docs[:limit], "next_offset": offset + limit if more else None}
+
+# Exports stream straight from a Mongo cursor in bounded batches, so memory
+# stays flat however long the history is.
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "500"))
+EXPORT_FLUSH_BYTES = 64 * 1024
+EXPORT_RESULT_FIELDS = ["viral_score", "summary", "strengths", "weaknesses", "suggestions",
+                        "hashtag_recommendations", "best_posting_times", "engagement_prediction",
+                        "script_suggestion", "style_analysis", "trend_connections"]
+EXPORT_COLUMNS = ["analysis_id", "created_at", "platform", "favorited", "content", *EXPORT_RESULT_FIELDS,
+                  "video_url", "video_title", "video_author"]
+
+def flatten_analysis(doc: dict) -> dict:
+    result = doc.get("result") or {}
+    video = doc.get("video_data") or {}
+    row = {k: doc.get(k) for k in ("analysis_id", "created_at", "platform", "favorited", "content")}
+    for field in EXPORT_RESULT_FIELDS:
+        value = result.get(field)
+        row[field] = " | ".join(map(str, value)) if isinstance(value, list) else value
+    row.update({"video_url": video.get("url"), "video_title": video.get("title"), "video_author": video.get("author")})
+    return row
+
+# Spreadsheet apps evaluate cells starting with these as formulas, and the
+# exported text is user- and model-controlled; a leading quote neutralises it.
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+def csv_safe_row(row: dict) -> dict:
+    return {k: "'" + v if isinstance(v, str) and v.startswith(CSV_FORMULA_PREFIXES) else v for k, v in row.items()}
+
+async def export_rows(query: dict, fmt: str):
+    cursor = db.analyses.find(query, {"_id": 0, "user_id": 0}).sort("created_at", DESCENDING).batch_size(EXPORT_BATCH_SIZE)
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=EXPORT_COLUMNS) if fmt == "csv" else None
+    if writer:
+        writer.writeheader()
+    try:
+        async for doc in cursor:
+            row = flatten_analysis(doc)
+            if writer:
+                writer.writerow(csv_safe_row(row))
+            else:
+                buf.write(json.dumps(row, default=str) + "\n")
+            if buf.tell() >= EXPORT_FLUSH_BYTES:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+    finally:
+        await cursor.close()
+
+@api_router.get("/analyses/export")
+async def export_analyses(request: Request, format: str = "csv", platform: Optional[str] = None,
+                          date_from: Optional[str] = None, date_to: Optional[str] = None):
+    user = await get_current_user(request)
+    if not get_plan_features(user.get("plan", "free"))["export"]:
+        raise HTTPException(status_code=403, detail="Export Reports require Pro plan or higher")
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    query = analysis_filters(user["user_id"], platform, date_from=date_from, date_to=date_to)
+    filename = f"myalgorithm-analyses-{datetime.now(timezone.utc).strftime('%Y%m%d')}.{format}"
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(export_rows(query, format), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@api_router.get("/analyses/{analysis_id}")
+async def get_analysis(analysis_id: str, request: Request, fields: Optional[str] = None):
+    user = await get_current_user(request)
+    analysis = await db.analyses.find_one({"analysis_id": analysis_id, "user_id": user["user_id"]},
+                                          analysis_projection(fields, None))
+    if not analysis:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    return analysis
 
 # ── User Stats & Achievements ──────────────────────────
 @api_router.get("/user/stats")
 async def get_user_stats(request: Request):
     user = await get_current_user(request)
-    xp = await get_xp(user["user_id"])
-    level = get_level_info(xp)
-    count = await db.analyses.count_documents({"user_id": user["user_id"]})
+    stats, rollup = await asyncio.gather(
+        db.user_stats.find_one({"user_id": user["user_id"]}, {"_id": 0}),
+        get_user_rollup(user["user_id"]),
+    )
+    level = get_level_info(stats.get("xp", 0) if stats else 0)
+    count = rollup["count"]
     achievements = await db.user_achievements.find({"user_id": user["user_id"]}, {"_id": 0}).to_list(100)
     earned_ids = {a["achievement_id"] for a in achievements}
     all_ach = []
     for k, v in ACHIEVEMENTS_DEF.items():
         all_ach.append({"id": k, **v, "earned": k in earned_ids,
                         "earned_at": next((a["earned_at"] for a in achievements if a["achievement_id"] == k), None)})
-    return {"level": level, "total_analyses": count, "achievements": all_ach}
+    return {"level": level, "total_analyses": count, "streak": streak_view(stats), "achievements": all_ach}
 
 # ── Growth Plan ─────────────────────────────────────────
 DEFAULT_WEEKLY = {
@@ -644,30 +3339,22 @@ async def update_schedule(req: GrowthPlanUpdateRequest, request: Request):
 async def generate_ideas(req: GenerateIdeasRequest, request: Request):
     user = await get_current_user(request)
     try:
-        from emergentintegrations.llm.chat import LlmChat, UserMessage
-        chat = LlmChat(
-            api_key=os.environ.get("EMERGENT_LLM_KEY"),
-            session_id=f"ideas-{uuid.uuid4().hex[:8]}",
-            system_message='Generate viral content ideas. Return a JSON array of strings, each a short content idea. Return ONLY the JSON array, no markdown.',
-        ).with_model("openai", "gpt-5.2")
         prompt = f"Generate {req.count} viral content ideas"
         if req.topic:
             prompt += f" about '{req.topic}'"
         prompt += f" for {req.platform}. Short, catchy, specific."
-        ai_resp = await chat.send_message(UserMessage(text=prompt))
+        ai_resp = await llm_complete(
+            'Generate viral content ideas. Return a JSON array of strings, each a short content idea. Return ONLY the JSON array, no markdown.',
+            prompt, user.get("plan", "free"), "ideas",
+        )
         try:
-            cleaned = ai_resp.strip()
-            if cleaned.startswith("```"):
-                cleaned = cleaned.split("\n", 1)[1] if "\n" in cleaned else cleaned[3:]
-                if cleaned.endswith("```"):
-                    cleaned = cleaned[:-3]
-            ideas = json.loads(cleaned.strip())
+            ideas = parse_llm_json(ai_resp)
             if not isinstance(ideas, list):
                 ideas = [str(ideas)]
         except json.JSONDecodeError:
             ideas = [line.strip().lstrip("0123456789.-) ") for line in ai_resp.split("\n") if line.strip() and len(line.strip()) > 5][:req.count]
     except Exception as e:
-        logger.error(f"Idea generation error: {e}")
+        note_llm_fallback("Idea generation error", e)
         ideas = ["Quick tutorial on a trending tool", "Behind the scenes of your workflow",
                  "Myth vs reality in your niche", "3 things I wish I knew earlier",
                  "This changed my content game", "The secret to consistency"]
@@ -833,7 +3520,7 @@ async def create_checkout(req: CheckoutRequest, request: Request):
         raise HTTPException(status_code=500, detail="Payment service unavailable")
 
 @api_router.get("/billing/status/{session_id}")
-async def check_payment_status(session_id: str, request: Request):
+async def check_payment_status(session_id: str, request: Request, response: Response):
     user = await get_current_user(request)
     try:
         from emergentintegrations.payments.stripe.checkout import StripeCheckout
@@ -849,10 +3536,10 @@ async def check_payment_status(session_id: str, request: Request):
             update_data = {"payment_status": status.payment_status, "status": status.status}
             if status.payment_status == "paid":
                 update_data["paid_at"] = datetime.now(timezone.utc).isoformat()
-                await db.users.update_one(
-                    {"user_id": user["user_id"]},
-                    {"$set": {"plan": txn.get("plan_id", "starter")}}
-                )
+                await set_user_plan(user["user_id"], txn.get("plan_id", "starter"))
+                if is_signed_session(request_session_token(request) or ""):
+                    # Signed sessions carry the plan; hand out one with the new plan.
+                    set_session_cookie(response, sign_session(user["user_id"], txn.get("plan_id", "starter")))
             await db.payment_transactions.update_one(
                 {"session_id": session_id}, {"$set": update_data}
             )
@@ -903,23 +3590,291 @@ async def update_profile(req: UpdateProfileRequest, request: Request):
         update["email"] = req.email
     if update:
         await db.users.update_one({"user_id": user["user_id"]}, {"$set": update})
+        invalidate_user_sessions(user["user_id"])
     updated = await db.users.find_one({"user_id": user["user_id"]}, {"_id": 0})
     return {"user_id": updated["user_id"], "email": updated["email"], "name": updated["name"], "picture": updated.get("picture", ""), "plan": updated.get("plan", "free")}
 
 @api_router.put("/account/password")
-async def change_password(req: ChangePasswordRequest, request: Request):
+async def change_password(req: ChangePasswordRequest, request: Request, response: Response):
     user = await get_current_user(request)
     full_user = await db.users.find_one({"user_id": user["user_id"]}, {"_id": 0})
     if "password_hash" not in full_user:
         raise HTTPException(status_code=400, detail="Cannot change password for Google-authenticated accounts")
-    if not verify_password(req.current_password, full_user["password_hash"]):
+    if not await verify_password(req.current_password, full_user["password_hash"]):
         raise HTTPException(status_code=401, detail="Current password is incorrect")
     await db.users.update_one(
         {"user_id": user["user_id"]},
-        {"$set": {"password_hash": hash_password(req.new_password)}}
+        {"$set": {"password_hash": await hash_password(req.new_password)}}
     )
+    # Sign out every other session, then give this client a fresh one.
+    await session_revocations.revoke_user(user["user_id"])
+    await db.user_sessions.delete_many({"user_id": user["user_id"]})
+    invalidate_user_sessions(user["user_id"])
+    set_session_cookie(response, await create_session(user["user_id"], full_user.get("plan", "free")))
     return {"message": "Password updated successfully"}
 
+# ── Admin ───────────────────────────────────────────────
+def require_admin(request: Request):
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    if not admin_token or request.headers.get("X-Admin-Token") != admin_token:
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+@api_router.get("/admin/cache-stats")
+async def cache_stats(request: Request):
+    require_admin(request)
+    return {"session_cache": session_cache.stats(), "plan_cache": plan_cache.stats(),
+            "overview_cache": overview_cache.stats(),
+            "analysis_cache": {"memory": analysis_cache_local.stats(), **analysis_cache_stats},
+            "video_metadata": video_meta_cache.stats(), "single_flight": inflight.stats(),
+            "session_revocations": session_revocations.stats()}
+
+@api_router.get("/admin/pool-stats")
+async def pool_stats(request: Request):
+    require_admin(request)
+    return {"bcrypt": bcrypt_pool_stats(), "llm": llm_gateway_stats(), "http": outbound_http.stats(),
+            "rate_limit": rate_limit_report()}
+
+@api_router.get("/admin/job-stats")
+async def job_stats_report(request: Request):
+    require_admin(request)
+    return await job_queue_stats()
+
+@api_router.get("/admin/index-report")
+async def index_report(request: Request):
+    require_admin(request)
+    queries = await explain_hot_queries()
+    return {"collection_scans": sum(1 for q in queries if q.get("collection_scan")), "queries": queries}
+
+# ── Rate Limiting & Load Shedding ───────────────────────
+# RateLimitMiddleware runs before routing, so a rejected request never reaches
+# Mongo, bcrypt or the LLM. Each route group has token buckets per client IP
+# and per session, given as (requests, per_seconds): the bucket holds up to
+# `requests` tokens and refills at requests/per_seconds. When event-loop lag
+# passes LOAD_SHED_LAG_MS, a growing share of requests is shed with 503.
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "100000"))
+# X-Forwarded-For entries appended by our own proxies. The default, 0, keys on
+# the socket peer; set it behind a proxy, or clients can pick their own IP.
+FORWARDED_PROXY_HOPS = int(os.environ.get("FORWARDED_PROXY_HOPS", "0"))
+LOAD_SHED_LAG_MS = float(os.environ.get("LOAD_SHED_LAG_MS", "250"))
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", "0.5"))
+
+# First match wins: (group, methods or None for any, path pattern).
+RATE_LIMIT_GROUPS = [
+    ("exempt", None, re.compile(r"^/api/(admin/|webhook/)")),
+    ("auth", {"POST"}, re.compile(r"^/api/auth/(login|register|session|reset-password)$")),
+    ("llm", {"POST"}, re.compile(r"^/api/(analyze/|jobs/analyze/|competitors/analyze$|growth-plan/generate-ideas$)")),
+    ("bulk", {"GET"}, re.compile(r"^/api/analyses/(search|export)$")),
+    ("api", None, re.compile(r"^/api/")),
+]
+RATE_LIMITS = {
+    "auth": {"ip": (10, 60)},
+    "llm": {"ip": (60, 60), "user": (20, 60)},
+    "bulk": {"ip": (60, 60), "user": (20, 60)},
+    "api": {"ip": (600, 60), "user": (300, 60)},
+}
+
+def route_group(method: str, path: str) -> Optional[str]:
+    for group, methods, pattern in RATE_LIMIT_GROUPS:
+        if (methods is None or method in methods) and pattern.match(path):
+            return group
+    return None
+
+class TokenBuckets:
+    def __init__(self, max_keys: int, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    def _level(self, key: str, capacity: int, rate: float, now: float) -> list:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [float(capacity), now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                # The least recently used bucket has had the longest to refill.
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        return bucket
+
+    def take(self, limits: list) -> float:
+        """limits: [(key, capacity, rate)]. Takes one token from every bucket,
+        or none if any is empty; returns 0 or the seconds until a retry can pass."""
+        now = self.clock()
+        buckets = [(self._level(key, capacity, rate, now), rate) for key, capacity, rate in limits]
+        wait = max((((1 - b[0]) / rate) for b, rate in buckets if b[0] < 1), default=0.0)
+        if wait:
+            return wait
+        for bucket, _ in buckets:
+            bucket[0] -= 1
+        return 0.0
+
+    def __len__(self):
+        return len(self._buckets)
+
+class LoopLagMonitor:
+    def __init__(self, interval: float, threshold_ms: float = LOAD_SHED_LAG_MS, clock=time.monotonic):
+        self.interval = interval
+        self.threshold_ms = threshold_ms
+        self.clock = clock
+        self.lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+    def observe(self, lag: float):
+        # Rise immediately, decay gradually, so one quiet tick doesn't end shedding.
+        self.lag_ms = lag if lag > self.lag_ms else self.lag_ms * 0.7 + lag * 0.3
+        self.max_lag_ms = max(self.max_lag_ms, lag)
+        loop_lag_seconds.observe(lag / 1000)
+
+    async def _run(self):
+        while True:
+            started = self.clock()
+            await asyncio.sleep(self.interval)
+            self.observe(max(0.0, (self.clock() - started - self.interval) * 1000))
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def shed_probability(self) -> float:
+        # 0 at the threshold, rising to 1 at twice the threshold.
+        return min(1.0, max(0.0, (self.lag_ms - self.threshold_ms) / self.threshold_ms))
+
+loop_lag = LoopLagMonitor(LOOP_LAG_INTERVAL)
+rate_buckets = TokenBuckets(RATE_LIMIT_MAX_KEYS)
+rate_limit_stats = {group: {"allowed": 0, "limited": 0, "shed": 0} for group in RATE_LIMITS}
+
+def client_ip(scope) -> str:
+    if FORWARDED_PROXY_HOPS:
+        for name, value in scope.get("headers", []):
+            if name == b"x-forwarded-for":
+                hops = [h.strip() for h in value.decode("latin-1").split(",") if h.strip()]
+                if hops:
+                    return hops[-min(FORWARDED_PROXY_HOPS, len(hops))]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+def session_rate_key(request: Request) -> Optional[str]:
+    # Keyed by user without touching Mongo, so logging in again does not get a
+    # fresh bucket. An opaque token not yet in session_cache has no user bucket
+    # (only the IP one applies); its first authenticated request caches it.
+    token = request_session_token(request)
+    if not token:
+        return None
+    if is_signed_session(token):
+        try:
+            return "user:" + verify_signed_session(token)["uid"]
+        except HTTPException:
+            return None
+    cached = session_cache.peek(token)
+    return "user:" + cached["user"]["user_id"] if cached else None
+
+def limit_response(status: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse({"detail": detail}, status_code=status, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+class RateLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not RATE_LIMIT_ENABLED:
+            return await self.app(scope, receive, send)
+        group = route_group(scope["method"], scope["path"])
+        if group is None or group == "exempt":
+            return await self.app(scope, receive, send)
+        stats = rate_limit_stats[group]
+        shed = loop_lag.shed_probability()
+        if shed and random.random() < shed:
+            stats["shed"] += 1
+            return await limit_response(503, "Server is busy, please retry shortly", 1)(scope, receive, send)
+        rules = RATE_LIMITS[group]
+        limits = []
+        if "ip" in rules:
+            capacity, per = rules["ip"]
+            limits.append((f"{group}:ip:{client_ip(scope)}", capacity, capacity / per))
+        if "user" in rules:
+            key = session_rate_key(Request(scope))
+            if key:
+                capacity, per = rules["user"]
+                limits.append((f"{group}:{key}", capacity, capacity / per))
+        wait = rate_buckets.take(limits)
+        if wait:
+            stats["limited"] += 1
+            return await limit_response(429, "Too many requests, please slow down", wait)(scope, receive, send)
+        stats["allowed"] += 1
+        return await self.app(scope, receive, send)
+
+def rate_limit_report() -> dict:
+    return {"enabled": RATE_LIMIT_ENABLED, "buckets": len(rate_buckets), "groups": rate_limit_stats,
+            "loop_lag_ms": round(loop_lag.lag_ms, 1), "max_loop_lag_ms": round(loop_lag.max_lag_ms, 1),
+            "shed_threshold_ms": loop_lag.threshold_ms, "shed_probability": round(loop_lag.shed_probability(), 3)}
+
+# ── Metrics Endpoint ────────────────────────────────────
+# Request metrics come from MetricsMiddleware, the outermost layer, so
+# rate-limited and shed requests are counted too. Stats the app already keeps
+# are read at scrape time. Scrapers send "Authorization: Bearer <token>" with
+# METRICS_TOKEN (or ADMIN_TOKEN when that is unset); with neither set the
+# endpoint is closed. METRICS_PUBLIC=1 opts in to unauthenticated scrapes.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+METRICS_PUBLIC = os.environ.get("METRICS_PUBLIC", "0") == "1"
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        group = route_group(scope["method"], scope["path"]) or "other"
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_in_flight.inc(group=group)
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_in_flight.dec(group=group)
+            # The route template, not the raw path, keeps label cardinality bounded.
+            route = getattr(scope.get("route"), "path", "unrouted")
+            http_request_seconds.observe(time.monotonic() - started, method=scope["method"], route=route, status=status)
+
+metrics.add(Counter("llm_events_total", "LLM gateway events (calls, retries, timeouts, ...).", ("event",),
+                    fn=lambda: {k: v for k, v in llm_stats.items() if k != "in_flight"}))
+metrics.add(Gauge("llm_in_flight", "LLM calls holding a capacity slot.", fn=lambda: {(): llm_stats["in_flight"]}))
+metrics.add(Gauge("llm_queue_depth", "Requests waiting for LLM capacity by plan tier.", ("tier",),
+                  fn=lambda: {t: v["queued"] for t, v in llm_scheduler.stats()["tiers"].items()}))
+metrics.add(Gauge("llm_circuit_state", "1 for the LLM circuit breaker's current state.", ("state",),
+                  fn=lambda: {st: int(llm_breaker.state == st) for st in ("closed", "open", "half_open")}))
+metrics.add(Gauge("outbound_http_in_flight", "Outbound HTTP requests in flight by host.", ("host",),
+                  fn=lambda: {h: v["in_flight"] for h, v in outbound_http.stats()["hosts"].items()}))
+metrics.add(Gauge("event_loop_lag_smoothed_seconds", "Smoothed event-loop lag used for load shedding.",
+                  fn=lambda: {(): loop_lag.lag_ms / 1000}))
+metrics.add(Counter("rate_limit_decisions_total", "Rate limiter decisions by route group.", ("group", "decision"),
+                    fn=lambda: {(g, d): n for g, st in rate_limit_stats.items() for d, n in st.items()}))
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint(request: Request):
+    if not METRICS_PUBLIC:
+        token = METRICS_TOKEN or os.environ.get("ADMIN_TOKEN")
+        if not token or not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+            raise HTTPException(status_code=403, detail="Metrics token required")
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # ── Root ────────────────────────────────────────────────
 @api_router.get("/")
 async def root():
@@ -927,6 +3882,8 @@ async def root():
 
 app.include_router(api_router)
 
+# Added before CORS so rejections still carry CORS headers.
+app.add_middleware(RateLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -934,7 +3891,41 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+
+@app.on_event("startup")
+async def startup_indexes():
+    await ensure_indexes()
+
+@app.on_event("startup")
+async def startup_job_workers():
+    start_job_workers()
+
+@app.on_event("startup")
+async def startup_outbound_http():
+    outbound_http.start(OUTBOUND_HOSTS)
+
+@app.on_event("startup")
+async def startup_loop_lag_monitor():
+    loop_lag.start()
+
+@app.on_event("startup")
+async def startup_session_revocations():
+    await session_revocations.start()
+
+@app.on_event("startup")
+async def startup_quota_reaper():
+    global quota_reaper_task
+    quota_reaper_task = asyncio.create_task(quota_reaper())
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if quota_reaper_task:
+        quota_reaper_task.cancel()
+        await asyncio.gather(quota_reaper_task, return_exceptions=True)
+    await stop_job_workers()
+    await outbound_http.aclose()
+    await session_revocations.stop()
+    await loop_lag.stop()
     client.close()
+    bcrypt_executor.shutdown(wait=False)
@@ -174,6 +174,16 @@ class MyAlgorithmAPITester:
             200,
             use_session=True
         )
+        
+        # The logged-out token must no longer authenticate
+        self.session.cookies.clear()
+        self.run_test(
+            "Rejects logged-out session",
+            "GET",
+            "/auth/me",
+            401,
+            use_session=True
+        )
 
     def test_dashboard_endpoints(self):
         """Test dashboard endpoints with gamification"""
@@ -202,14 +212,34 @@ class MyAlgorithmAPITester:
                 usage = response['daily_usage']
                 print(f"   ⚡ Daily usage: {usage.get('used', 0)}/{usage.get('limit', 0)} analyses")
         
-        # Test dashboard analyses
-        self.run_test(
+        # Test dashboard analyses (keyset-paginated)
+        list_success, list_response = self.run_test(
             "Dashboard analyses list",
             "GET", 
-            "/dashboard/analyses",
+            "/dashboard/analyses?limit=5",
             200,
             use_session=True
         )
+        
+        if list_success and isinstance(list_response, dict):
+            items = list_response.get('items', [])
+            print(f"   📄 Page size: {len(items)}, more: {bool(list_response.get('next_cursor'))}")
+            if items:
+                self.run_test(
+                    "Analysis detail",
+                    "GET",
+                    f"/analyses/{items[0]['analysis_id']}",
+                    200,
+                    use_session=True
+                )
+        
+        self.run_test(
+            "Dashboard analyses with unknown field",
+            "GET",
+            "/dashboard/analyses?fields=password_hash",
+            400,
+            use_session=True
+        )
 
     def test_content_analysis(self):
         """Test AI content analysis and XP system"""
@@ -274,6 +304,94 @@ class MyAlgorithmAPITester:
                 print(f"   📈 Viral Score: {response['viral_score']}")
             if 'xp_earned' in response:
                 print(f"   ⭐ XP Earned: {response['xp_earned']}")
+
+    def test_streaming_analysis(self):
+        """Test SSE streaming content analysis"""
+        print(f"\n📡 Testing Streaming Content Analysis")
+        print("=" * 40)
+        
+        success, response = self.run_test(
+            "Streaming Content Analysis",
+            "POST",
+            "/analyze/content/stream",
+            200,
+            data={"content": "Streaming test caption for my next reel #growth", "platform": "instagram"},
+            use_session=True
+        )
+        
+        if success and isinstance(response, str):
+            events = [line[7:] for line in response.splitlines() if line.startswith("event: ")]
+            print(f"   📨 Events received: {len(events)}")
+            if events and events[-1] == "done":
+                print(f"   ✅ Stream completed with done event")
+            else:
+                print(f"   ❌ Stream did not end with a done event: {events[-3:]}")
+                return False
+        
+        return success
+
+    def test_batch_analysis(self):
+        """Test batch content analysis validation"""
+        print(f"\n📦 Testing Batch Content Analysis")
+        print("=" * 40)
+        
+        empty_success, _ = self.run_test(
+            "Empty batch rejected",
+            "POST",
+            "/analyze/content/batch",
+            400,
+            data={"items": []},
+            use_session=True
+        )
+        
+        oversized_success, _ = self.run_test(
+            "Oversized batch rejected",
+            "POST",
+            "/analyze/content/batch",
+            400,
+            data={"items": [{"content": f"Draft caption {i}", "platform": "instagram"} for i in range(51)]},
+            use_session=True
+        )
+        
+        return empty_success and oversized_success
+
+    def test_analysis_jobs(self):
+        """Test queued analysis jobs and status polling"""
+        print(f"\n⏳ Testing Analysis Job Queue")
+        print("=" * 40)
+        
+        success, response = self.run_test(
+            "Submit content analysis job",
+            "POST",
+            "/jobs/analyze/content",
+            202,
+            data={"content": "Queued analysis test caption #jobs", "platform": "tiktok"},
+            use_session=True
+        )
+        
+        if not (success and isinstance(response, dict) and 'job_id' in response):
+            return False
+        
+        job_id = response['job_id']
+        status = response.get('status')
+        for _ in range(30):
+            success, response = self.run_test(
+                "Poll job status",
+                "GET",
+                f"/jobs/{job_id}",
+                200,
+                use_session=True
+            )
+            status = response.get('status') if isinstance(response, dict) else None
+            if status in ("done", "failed"):
+                break
+            time.sleep(2)
+        
+        print(f"   🏁 Final job status: {status}")
+        if status == "done":
+            print(f"   📈 Viral Score: {response.get('result', {}).get('viral_score')}")
+        return status == "done"
+
     def test_favorites_with_plan_gating(self):
         """Test favorites feature with plan gating"""
         print(f"\n⭐ Testing Favorites with Plan Gating")
@@ -366,12 +484,80 @@ class MyAlgorithmAPITester:
                 earned = sum(1 for ach in response['achievements'] if ach.get('earned', False))
                 total = len(response['achievements'])
                 print(f"   🏆 Achievements: {earned}/{total} earned")
+            if 'streak' in response:
+                streak = response['streak']
+                print(f"   🔥 Streak: {streak.get('current', 0)} days (longest {streak.get('longest', 0)})")
+            else:
+                print(f"   ❌ Missing streak in user stats")
+                return False
         
         return success
 
         
         return success
         
+    def test_history_search(self):
+        """Test full-text search over analysis history"""
+        print(f"\n🔎 Testing History Search")
+        print("=" * 40)
+        
+        auth_success, auth_response = self.run_test(
+            "Check user plan for search",
+            "GET",
+            "/auth/me",
+            200,
+            use_session=True
+        )
+        if not (auth_success and isinstance(auth_response, dict)):
+            return False
+        
+        unlimited = auth_response.get('features', {}).get('history_limit', 10) == -1
+        success, response = self.run_test(
+            "Search analyses" if unlimited else "Search analyses requires Pro",
+            "GET",
+            "/analyses/search?q=viral&limit=5",
+            200 if unlimited else 403,
+            use_session=True
+        )
+        
+        if success and unlimited and isinstance(response, dict):
+            print(f"   🔎 Results: {len(response.get('items', []))}")
+        
+        return success
+
+    def test_history_export(self):
+        """Test streaming CSV export of analysis history"""
+        print(f"\n📤 Testing History Export")
+        print("=" * 40)
+        
+        auth_success, auth_response = self.run_test(
+            "Check user plan for export",
+            "GET",
+            "/auth/me",
+            200,
+            use_session=True
+        )
+        if not (auth_success and isinstance(auth_response, dict)):
+            return False
+        
+        can_export = auth_response.get('features', {}).get('export', False)
+        success, response = self.run_test(
+            "Export analyses as CSV" if can_export else "Export requires Pro",
+            "GET",
+            "/analyses/export?format=csv",
+            200 if can_export else 403,
+            use_session=True
+        )
+        
+        if success and can_export and isinstance(response, str):
+            header = response.splitlines()[0] if response else ""
+            print(f"   📄 CSV header: {header[:80]}")
+            if not header.startswith("analysis_id"):
+                print(f"   ❌ Unexpected CSV header")
+                return False
+        
+        return success
+
     def test_daily_limit_for_free_users(self):
         """Test daily limit enforcement for free users"""
         print(f"\n⏰ Testing Daily Limit for Free Users")
@@ -533,7 +719,7 @@ class MyAlgorithmAPITester:
                 "new_password": "NewPassword123!"
             }
             
-            self.run_test(
+            success, _ = self.run_test(
                 "Change password",
                 "PUT", 
                 "/account/password",
@@ -541,6 +727,9 @@ class MyAlgorithmAPITester:
                 data=password_change,
                 use_session=True
             )
+            # Changing the password signs out other sessions and reissues ours
+            if success:
+                self.session_token = self.session.cookies.get('session_token') or self.session_token
 
     def test_billing_endpoints(self):
         """Test billing with new plan structure (Free/Pro/Premium)"""
@@ -636,10 +825,15 @@ class MyAlgorithmAPITester:
             self.test_dashboard_endpoints() 
             self.test_content_analysis()
             self.test_video_link_analysis()
+            self.test_streaming_analysis()
+            self.test_batch_analysis()
+            self.test_analysis_jobs()
             self.test_daily_limit_for_free_users()
             self.test_growth_plan()
             self.test_competitors()
             self.test_favorites_with_plan_gating()
+            self.test_history_search()
+            self.test_history_export()
             self.test_user_stats_and_achievements()
             self.test_account_management()
             self.test_billing_endpoints()
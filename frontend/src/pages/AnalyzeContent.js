@@ -32,22 +32,61 @@ export default function AnalyzeContent() {
     return null;
   };
 
+  // Streams SSE events from the analyze endpoints so fields render as soon as they arrive.
+  const streamAnalysis = async (path, body, failMessage) => {
+    const res = await fetch(`${API}${path}`, {
+      method: "POST", credentials: "include",
+      headers: { "Content-Type": "application/json" }, body: JSON.stringify(body),
+    });
+    if (!res.ok) {
+      const data = await res.json().catch(() => ({}));
+      toast.error(res.status === 429 && data.detail ? data.detail : failMessage);
+      return;
+    }
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    const handleEvent = (event, data) => {
+      if (event === "video_data") setVideoData(data);
+      else if (event === "field") setResult(prev => ({ ...(prev || {}), [data.field]: data.value }));
+      else if (event === "error") toast.error(failMessage);
+      else if (event === "done") {
+        setResult(prev => ({ ...data, _favorited: prev?._favorited }));
+        if (data.video_data) setVideoData(data.video_data);
+        setRemaining(data.remaining_today);
+        if (data.xp_earned) toast.success(`+${data.xp_earned} XP earned!`);
+        if (data.new_achievements?.length) {
+          data.new_achievements.forEach(a => toast.success(`Achievement unlocked: ${a}`));
+        }
+      }
+    };
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let idx;
+      while ((idx = buffer.indexOf("\n\n")) >= 0) {
+        const raw = buffer.slice(0, idx);
+        buffer = buffer.slice(idx + 2);
+        let event = "message", data = "";
+        raw.split("\n").forEach(line => {
+          if (line.startsWith("event: ")) event = line.slice(7);
+          else if (line.startsWith("data: ")) data += line.slice(6);
+        });
+        handleEvent(event, data ? JSON.parse(data) : null);
+      }
+    }
+  };
+
   const handleAnalyzeLink = async () => {
     if (!url.trim()) { toast.error("Paste a video URL"); return; }
     const detected = detectPlatform(url);
     if (!detected) { toast.error("Paste a TikTok, Instagram, or YouTube link"); return; }
     setLoading(true); setResult(null); setVideoData(null);
     try {
-      const res = await axios.post(`${API}/analyze/video-link`, { url }, { withCredentials: true });
-      setResult(res.data); setVideoData(res.data.video_data);
-      setRemaining(res.data.remaining_today);
-      if (res.data.xp_earned) toast.success(`+${res.data.xp_earned} XP earned!`);
-      if (res.data.new_achievements?.length) {
-        res.data.new_achievements.forEach(a => toast.success(`Achievement unlocked: ${a}`));
-      }
-    } catch (err) {
-      if (err.response?.status === 429) toast.error(err.response.data.detail);
-      else toast.error("Analysis failed. Try again.");
+      await streamAnalysis("/analyze/video-link/stream", { url }, "Analysis failed. Try again.");
+    } catch {
+      toast.error("Analysis failed. Try again.");
     } finally { setLoading(false); }
   };
 
@@ -55,16 +94,9 @@ export default function AnalyzeContent() {
     if (!content.trim()) { toast.error("Enter content to analyze"); return; }
     setLoading(true); setResult(null); setVideoData(null);
     try {
-      const res = await axios.post(`${API}/analyze/content`, { content, platform }, { withCredentials: true });
-      setResult(res.data);
-      setRemaining(res.data.remaining_today);
-      if (res.data.xp_earned) toast.success(`+${res.data.xp_earned} XP earned!`);
-      if (res.data.new_achievements?.length) {
-        res.data.new_achievements.forEach(a => toast.success(`Achievement unlocked: ${a}`));
-      }
-    } catch (err) {
-      if (err.response?.status === 429) toast.error(err.response.data.detail);
-      else toast.error("Analysis failed");
+      await streamAnalysis("/analyze/content/stream", { content, platform }, "Analysis failed");
+    } catch {
+      toast.error("Analysis failed");
     } finally { setLoading(false); }
   };
 
@@ -184,7 +216,7 @@ export default function AnalyzeContent() {
             </div>
           )}
 
-          {loading && <AnalysisSkeleton />}
+          {loading && !result && <AnalysisSkeleton />}
 
           {result && (
             <div className="space-y-6 animate-[fade-up_0.5s_ease-out]">
@@ -219,12 +251,12 @@ export default function AnalyzeContent() {
                     </button>
                   )}
                 </div>
-                <div className={`text-6xl font-bold font-['Outfit'] ${scoreColor(result.viral_score)} mb-2 transition-all`}>
-                  {result.viral_score}
+                <div className={`text-6xl font-bold font-['Outfit'] ${scoreColor(result.viral_score ?? 0)} mb-2 transition-all`}>
+                  {result.viral_score ?? "…"}
                 </div>
                 <div className="w-full h-2 bg-slate-800 rounded-full overflow-hidden">
-                  <div className={`h-full rounded-full transition-all duration-1000 ease-out ${scoreBarColor(result.viral_score)}`}
-                    style={{ width: `${result.viral_score}%` }} />
+                  <div className={`h-full rounded-full transition-all duration-1000 ease-out ${scoreBarColor(result.viral_score ?? 0)}`}
+                    style={{ width: `${result.viral_score ?? 0}%` }} />
                 </div>
               </div>
 
@@ -19,10 +19,10 @@ export default function DashboardOverview() {
       try {
         const [ov, an] = await Promise.all([
           axios.get(`${API}/dashboard/overview`, { withCredentials: true }),
-          axios.get(`${API}/dashboard/analyses`, { withCredentials: true }),
+          axios.get(`${API}/dashboard/analyses`, { params: { limit: 5 }, withCredentials: true }),
         ]);
         setOverview(ov.data);
-        setAnalyses(an.data);
+        setAnalyses(an.data.items);
       } catch (err) {
         console.error("Dashboard fetch error:", err);
       } finally {
@@ -0,0 +1,30 @@
+import asyncio
+
+import server
+
+
+def test_store_schedules_trim_without_awaiting_it(monkeypatch):
+    calls = []
+
+    class Coll:
+        async def update_one(self, *a, **k):
+            return None
+
+    class DB:
+        analysis_cache = Coll()
+
+    async def slow_trim():
+        calls.append("start")
+        await asyncio.sleep(0.05)
+        calls.append("done")
+
+    async def run():
+        monkeypatch.setattr(server, "db", DB())
+        monkeypatch.setattr(server, "trim_analysis_cache", slow_trim)
+        monkeypatch.setitem(server.analysis_cache_stats, "stored", server.ANALYSIS_CACHE_TRIM_EVERY - 1)
+        await server.store_analysis_cache("k", "tiktok", "free", {"viral_score": 1})
+        assert calls == []  # the request path returned before the trim ran
+        await asyncio.sleep(0.1)
+        assert calls == ["start", "done"]
+
+    asyncio.run(run())
@@ -0,0 +1,75 @@
+import asyncio
+from types import SimpleNamespace
+
+import server
+
+
+class Coll:
+    def __init__(self):
+        self.docs = []
+        self.updates = []
+
+    async def find_one(self, flt, projection=None):
+        return next((dict(d) for d in self.docs if all(d.get(k) == v for k, v in flt.items())), None)
+
+    async def update_one(self, flt, update):
+        self.updates.append((flt, update))
+
+
+def job(quota):
+    return {"job_id": "job_1", "user_id": "u1", "plan": "free", "kind": "content", "attempts": 1,
+            "payload": {"content": "hello", "platform": "tiktok"}, "quota": quota, "analysis_id": "an_fixed"}
+
+
+def install(monkeypatch, store_before_cancel):
+    db = SimpleNamespace(analyses=Coll(), analysis_jobs=Coll())
+    calls = {"perform": 0, "reserve": 0, "commit": []}
+    monkeypatch.setattr(server, "db", db)
+
+    async def perform(uid, plan, content, platform, quota, analysis_id=None):
+        calls["perform"] += 1
+        if store_before_cancel:
+            db.analyses.docs.append({"analysis_id": analysis_id, "user_id": uid, "result": {"viral_score": 70}})
+        await asyncio.sleep(10)
+
+    async def reserve(*a, **k):
+        calls["reserve"] += 1
+        return {"allowed": True, "rid": "new"}
+
+    async def commit(quota):
+        calls["commit"].append(quota["rid"])
+        return True
+
+    monkeypatch.setattr(server, "perform_content_analysis", perform)
+    monkeypatch.setattr(server, "reserve_daily_quota", reserve)
+    monkeypatch.setattr(server, "commit_daily_quota", commit)
+    return db, calls
+
+
+async def cancel_midway(j):
+    task = asyncio.create_task(server.process_job(j, "w1"))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+def test_cancelled_before_storing_requeues_without_quota(monkeypatch):
+    db, calls = install(monkeypatch, store_before_cancel=False)
+    asyncio.run(cancel_midway(job({"rid": "r1"})))
+    [(flt, update)] = db.analysis_jobs.updates
+    assert update["$set"] == {"status": "queued", "quota": None}
+
+
+def test_cancelled_after_storing_finishes_without_rerunning(monkeypatch):
+    db, calls = install(monkeypatch, store_before_cancel=True)
+    j = job({"rid": "r1"})
+    asyncio.run(cancel_midway(j))
+    [(flt, update)] = db.analysis_jobs.updates
+    assert update["$set"] == {"status": "queued", "quota": {"rid": "r1"}}
+
+    # The next attempt picks the job up with its reservation still attached.
+    asyncio.run(server.process_job({**j, "attempts": 2}, "w2"))
+    assert calls["perform"] == 1 and calls["reserve"] == 0
+    assert calls["commit"] == ["r1"]
+    done = db.analysis_jobs.updates[-1][1]["$set"]
+    assert done["status"] == "done" and done["result"]["analysis_id"] == "an_fixed"
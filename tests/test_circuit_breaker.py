@@ -0,0 +1,50 @@
+import server
+from server import CircuitBreaker
+
+
+def opened_breaker(monkeypatch, now):
+    clock = {"t": now}
+    monkeypatch.setattr(server.time, "monotonic", lambda: clock["t"])
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    assert breaker.state == "open"
+    return breaker, clock
+
+
+def test_open_breaker_fails_fast_until_reset(monkeypatch):
+    breaker, clock = opened_breaker(monkeypatch, 100.0)
+    assert breaker.admit() is None
+    clock["t"] += 10
+    assert breaker.admit()  # the half-open probe
+
+
+def test_only_one_probe_while_half_open(monkeypatch):
+    breaker, clock = opened_breaker(monkeypatch, 100.0)
+    clock["t"] += 10
+    probe = breaker.admit()
+    assert probe and breaker.admit() is None
+
+
+def test_release_by_non_probe_caller_keeps_probe(monkeypatch):
+    breaker, clock = opened_breaker(monkeypatch, 100.0)
+    clock["t"] += 10
+    probe = breaker.admit()
+    rejected = breaker.admit()
+    breaker.release(rejected)  # finally-block of a caller that never held the probe
+    breaker.release(0)         # and of one admitted while closed
+    assert breaker.admit() is None
+    breaker.release(probe)
+    assert breaker.admit()
+
+
+def test_probe_outcome_closes_or_reopens(monkeypatch):
+    breaker, clock = opened_breaker(monkeypatch, 100.0)
+    clock["t"] += 10
+    probe = breaker.admit()
+    assert breaker.can_retry(probe)
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.can_retry(probe)
+    clock["t"] += 10
+    breaker.admit()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.admit() == 0
@@ -0,0 +1,113 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import server
+
+
+class Quotas:
+    """One user's daily_quotas documents, with the pending-list updates."""
+
+    def __init__(self):
+        self.docs = {}
+
+    async def find_one_and_update(self, flt, update, projection=None, upsert=False, return_document=None):
+        key = (flt["user_id"], flt["day"])
+        doc = self.docs.setdefault(key, {"user_id": flt["user_id"], "day": flt["day"], "count": 0, "reserved": 0,
+                                         "pending": []})
+        if doc["count"] > flt["count"]["$lte"]:
+            return None
+        for k, v in update["$inc"].items():
+            doc[k] += v
+        doc["pending"].append(update["$push"]["pending"])
+        return dict(doc)
+
+    async def update_one(self, flt, update):
+        doc = self.docs.get((flt["user_id"], flt["day"]))
+        rid = flt.get("pending.rid")
+        if doc is None or (rid and not any(p["rid"] == rid for p in doc["pending"])):
+            return SimpleNamespace(modified_count=0)
+        for k, v in update["$inc"].items():
+            doc[k] += v
+        doc["pending"] = [p for p in doc["pending"] if p["rid"] != rid]
+        return SimpleNamespace(modified_count=1)
+
+    def find(self, flt, projection=None):
+        cutoff = flt["pending.until"]["$lt"]
+
+        async def gen():
+            for doc in list(self.docs.values()):
+                if any(p.get("until") and p["until"] < cutoff for p in doc["pending"]):
+                    yield {**doc, "pending": list(doc["pending"])}
+        return gen()
+
+
+def install(monkeypatch):
+    quotas = Quotas()
+    monkeypatch.setattr(server, "db", SimpleNamespace(daily_quotas=quotas))
+    return quotas
+
+
+def only_doc(quotas):
+    [doc] = quotas.docs.values()
+    return doc
+
+
+def test_settling_twice_applies_once(monkeypatch):
+    quotas = install(monkeypatch)
+
+    async def run():
+        r = await server.reserve_daily_quota("u1", "free")
+        assert await server.commit_daily_quota(r)
+        assert not await server.refund_daily_quota(r)
+
+    asyncio.run(run())
+    doc = only_doc(quotas)
+    assert (doc["count"], doc["reserved"], doc["pending"]) == (1, 0, [])
+
+
+def test_reaper_refunds_only_expired_reservations(monkeypatch):
+    quotas = install(monkeypatch)
+
+    async def run():
+        stale = await server.reserve_daily_quota("u1", "free", hold=0)
+        await server.reserve_daily_quota("u1", "free")
+        await server.reserve_daily_quota("u1", "free", hold=None)  # held by a queued job
+        await asyncio.sleep(0.01)
+        assert await server.reap_stale_reservations() == 1
+        assert not await server.commit_daily_quota(stale)  # its holder settles too late
+        assert await server.reap_stale_reservations() == 0
+
+    asyncio.run(run())
+    doc = only_doc(quotas)
+    assert (doc["count"], doc["reserved"], len(doc["pending"])) == (2, 2, 2)
+
+
+def test_refund_survives_a_second_cancellation(monkeypatch):
+    quotas = install(monkeypatch)
+    refunded = []
+    settle = server.settle_daily_quota
+
+    async def slow_settle(reservation, used):
+        await asyncio.sleep(0.02)
+        refunded.append(await settle(reservation, used))
+
+    async def hang(*a):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(server, "settle_daily_quota", slow_settle)
+    monkeypatch.setattr(server, "cached_content_analysis", hang)
+
+    async def run():
+        quota = await server.reserve_daily_quota("u1", "free")
+        task = asyncio.create_task(server.perform_content_analysis("u1", "free", "x", "tiktok", quota))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.sleep(0.005)  # now inside the refund
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert refunded == [True]
+    assert only_doc(quotas)["count"] == 0
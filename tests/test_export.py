@@ -0,0 +1,68 @@
+import asyncio
+import csv
+import io
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import server
+
+DOC = {"analysis_id": "a1", "created_at": "2026-01-01T00:00:00+00:00", "platform": "tiktok",
+       "content": "=HYPERLINK(\"http://evil\",\"x\")",
+       "result": {"viral_score": 80, "summary": "+1 great hook", "strengths": ["@team", "-5% churn"],
+                  "weaknesses": ["\tindent"], "suggestions": ["\rcr"], "script_suggestion": "plain text"}}
+
+
+class Cursor:
+    def sort(self, *a):
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def __aiter__(self):
+        async def gen():
+            yield dict(DOC)
+        return gen()
+
+    async def close(self):
+        pass
+
+
+def export(monkeypatch, fmt):
+    monkeypatch.setattr(server, "db", SimpleNamespace(analyses=SimpleNamespace(find=lambda *a, **k: Cursor())))
+
+    async def run():
+        return "".join([chunk async for chunk in server.export_rows({}, fmt)])
+
+    return asyncio.run(run())
+
+
+def test_csv_cells_cannot_start_a_formula(monkeypatch):
+    [row] = list(csv.DictReader(io.StringIO(export(monkeypatch, "csv"))))
+    assert row["content"] == "'" + DOC["content"]
+    assert row["summary"] == "'+1 great hook"
+    assert row["strengths"] == "'@team | -5% churn"
+    assert row["weaknesses"] == "'\tindent"
+    assert row["suggestions"] == "'\rcr"
+    assert row["script_suggestion"] == "plain text"
+    assert row["viral_score"] == "80"
+
+
+def test_ndjson_export_is_not_escaped(monkeypatch):
+    row = json.loads(export(monkeypatch, "ndjson"))
+    assert row["content"] == DOC["content"]
+
+
+def test_unknown_format_is_rejected(monkeypatch):
+    async def pro_user(request):
+        return {"user_id": "u1", "plan": "pro"}
+
+    monkeypatch.setattr(server, "get_current_user", pro_user)
+    request = Request({"type": "http", "headers": []})
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(server.export_analyses(request, format="jsonl"))
+    assert e.value.status_code == 400
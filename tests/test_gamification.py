@@ -0,0 +1,192 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+import server
+
+
+class Stats:
+    """Just enough of user_stats for the counter and badge updates."""
+
+    def __init__(self, docs=()):
+        self.docs = {d["user_id"]: dict(d) for d in docs}
+
+    async def find_one(self, flt, projection=None):
+        doc = self.docs.get(flt["user_id"])
+        return dict(doc) if doc else None
+
+    async def find_one_and_update(self, flt, update, projection=None, upsert=False, return_document=None):
+        await asyncio.sleep(0)
+        doc = self.docs.get(flt["user_id"])
+        if doc is None or doc.get("counters_seeded") is not True:
+            if doc is not None or not upsert:
+                raise DuplicateKeyError("user_id_unique")
+            doc = self.docs[flt["user_id"]] = {"user_id": flt["user_id"], "counters_seeded": True}
+        for k, v in update.get("$inc", {}).items():
+            doc[k] = doc.get(k, 0) + v
+        for k, v in update.get("$max", {}).items():
+            doc[k] = max(doc.get(k, v), v)
+        return dict(doc)
+
+    async def update_one(self, flt, update):
+        await asyncio.sleep(0)
+        doc = self.docs.get(flt["user_id"])
+        matched = doc is not None
+        if matched and "counters_seeded" in flt:
+            matched = "counters_seeded" not in doc
+        if matched and "badges" in flt:
+            matched = flt["badges"]["$ne"] not in doc.get("badges", [])
+        if not matched:
+            return SimpleNamespace(matched_count=0, modified_count=0)
+        doc.update(update.get("$set", {}))
+        for k, v in update.get("$inc", {}).items():
+            doc[k] = doc.get(k, 0) + v
+        for k, v in update.get("$addToSet", {}).items():
+            doc.setdefault(k, [])
+            if v not in doc[k]:
+                doc[k].append(v)
+        return SimpleNamespace(matched_count=1, modified_count=1)
+
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, *a):
+        self.docs = sorted(self.docs, key=lambda d: -d["result"]["viral_score"])
+        return self
+
+    async def to_list(self, n):
+        return self.docs[:n]
+
+
+class Analyses:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def _match(self, flt):
+        cutoff = flt.get("created_at", {}).get("$lt")
+        return [d for d in self.docs if d["user_id"] == flt["user_id"] and (cutoff is None or d["created_at"] < cutoff)]
+
+    async def count_documents(self, flt):
+        return len(self._match(flt))
+
+    def find(self, flt, projection=None):
+        return Cursor(self._match(flt))
+
+
+class Achievements:
+    def __init__(self, fail=False):
+        self.rows = set()
+        self.fail = fail
+
+    def find(self, flt, projection=None):
+        return Cursor([])
+
+    async def bulk_write(self, ops, ordered=True):
+        await asyncio.sleep(0)
+        if self.fail:
+            raise BulkWriteError({"writeErrors": [{"index": 0, "code": 91}]})
+        dupes = []
+        for i, op in enumerate(ops):
+            key = (op._filter["user_id"], op._filter["achievement_id"])
+            if key in self.rows:
+                dupes.append({"index": i, "code": 11000})
+            self.rows.add(key)
+        if dupes:
+            raise BulkWriteError({"writeErrors": dupes})
+
+
+def record(score, age=timedelta(0)):
+    return {"user_id": "u1", "result": {"viral_score": score},
+            "created_at": (datetime.now(timezone.utc) - age).isoformat()}
+
+
+def install(monkeypatch, stats, analyses=(), achievements=None):
+    db = SimpleNamespace(user_stats=stats, analyses=Analyses(list(analyses)),
+                         user_achievements=achievements or Achievements())
+    monkeypatch.setattr(server, "db", db)
+    return db
+
+
+BADGE_XP = server.ACHIEVEMENTS_DEF["first_analysis"]["xp"] + server.ACHIEVEMENTS_DEF["viral_80"]["xp"]
+
+
+def test_concurrent_requests_report_and_pay_a_badge_once(monkeypatch):
+    stats = Stats([{"user_id": "u1", "counters_seeded": True, "badges": [], "xp": 0}])
+    db = install(monkeypatch, stats)
+
+    async def run():
+        return await asyncio.gather(*(server.grant_achievements("u1", ["first_analysis", "viral_80"])
+                                      for _ in range(5)))
+
+    granted = asyncio.run(run())
+    assert sorted(aid for g in granted for aid in g) == ["first_analysis", "viral_80"]
+    assert stats.docs["u1"]["badges"] == ["first_analysis", "viral_80"]
+    assert stats.docs["u1"]["xp"] == BADGE_XP
+    assert db.user_achievements.rows == {("u1", "first_analysis"), ("u1", "viral_80")}
+
+
+def test_grant_interrupted_after_the_row_is_completed_later(monkeypatch):
+    # The row was written but the process died before user_stats was updated.
+    stats = Stats([{"user_id": "u1", "counters_seeded": True, "badges": [], "xp": 0}])
+    achievements = Achievements()
+    achievements.rows.add(("u1", "first_analysis"))
+    install(monkeypatch, stats, achievements=achievements)
+    assert asyncio.run(server.grant_achievements("u1", ["first_analysis"])) == ["first_analysis"]
+    assert stats.docs["u1"]["xp"] == server.ACHIEVEMENTS_DEF["first_analysis"]["xp"]
+
+
+def test_failed_grant_is_not_reported_and_is_retried(monkeypatch):
+    stats = Stats([{"user_id": "u1", "counters_seeded": True, "badges": [], "xp": 0}])
+    db = install(monkeypatch, stats, achievements=Achievements(fail=True))
+
+    async def advance(user_id, s):
+        return s
+
+    monkeypatch.setattr(server, "advance_streak", advance)
+
+    async def rollup(*a):
+        pass
+
+    monkeypatch.setattr(server, "update_user_rollup", rollup)
+    rec = record(50)
+    assert asyncio.run(server.award_analysis_rewards("u1", [rec])) == []
+    assert stats.docs["u1"]["badges"] == []
+    db.user_achievements.fail = False
+    assert asyncio.run(server.award_analysis_rewards("u1", [rec])) == ["first_analysis"]
+    assert stats.docs["u1"]["badges"] == ["first_analysis"]
+
+
+def test_legacy_document_is_seeded_without_double_counting(monkeypatch):
+    old = [record(40, timedelta(days=3)), record(70, timedelta(days=2))]
+    fresh = [record(90), record(10)]
+    stats = Stats([{"user_id": "u1", "xp": 100}])
+    install(monkeypatch, stats, old + fresh)
+
+    async def run():
+        # Two requests, each with one of the freshly inserted analyses.
+        await asyncio.gather(*(server.update_user_counters("u1", [r]) for r in fresh))
+
+    asyncio.run(run())
+    doc = stats.docs["u1"]
+    assert doc["counters_seeded"] is True
+    assert doc["analysis_count"] == 4
+    assert doc["best_viral_score"] == 90
+    assert doc["xp"] == 120
+
+
+def test_seeding_cannot_overwrite_live_counters(monkeypatch):
+    stats = Stats([{"user_id": "u1", "counters_seeded": True, "analysis_count": 7}])
+    install(monkeypatch, stats, [record(50, timedelta(days=1))])
+    asyncio.run(server.seed_user_counters("u1"))
+    assert stats.docs["u1"]["analysis_count"] == 7
+
+
+def test_new_user_counts_every_record(monkeypatch):
+    stats = Stats()
+    install(monkeypatch, stats)
+    out = asyncio.run(server.update_user_counters("u1", [record(30), record(60)]))
+    assert out["analysis_count"] == 2 and out["best_viral_score"] == 60 and out["xp"] == 20
@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+import server
+
+
+class FakeCollection:
+    def __init__(self, fail_names):
+        self.fail_names = fail_names
+
+    async def index_information(self):
+        return {}
+
+    async def create_index(self, keys, **opts):
+        if opts["name"] in self.fail_names:
+            raise RuntimeError("E11000 duplicate key error")
+
+
+class FakeDB:
+    def __init__(self, failures):
+        self.failures = failures
+
+    def __getitem__(self, name):
+        return FakeCollection(self.failures.get(name, ()))
+
+
+def test_unique_index_failure_aborts_startup(monkeypatch):
+    monkeypatch.setattr(server, "db", FakeDB({"users": {"email_unique"}}))
+    with pytest.raises(RuntimeError, match="users.email_unique"):
+        asyncio.run(server.ensure_indexes())
+
+
+def test_non_unique_index_failure_is_only_logged(monkeypatch):
+    monkeypatch.setattr(server, "db", FakeDB({"analyses": {"user_created"}}))
+    asyncio.run(server.ensure_indexes())
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from server import JsonFieldStream
+
+PAYLOAD = json.dumps({
+    "viral_score": 87,
+    "summary": 'He said "go" \\ then left\nnew line é中\U0001F680',
+    "strengths": ["a, b", "{not: an object}", "]"],
+    "nested": {"k": [1, {"x": "}"}], "t": True, "n": None},
+    "ratio": -1.5e3,
+    "empty": "",
+}, ensure_ascii=False)
+ESCAPED = json.dumps(json.loads(PAYLOAD))  # same document with \\uXXXX escapes and surrogate pairs
+
+
+def feed_all(chunks):
+    parser = JsonFieldStream()
+    fields = []
+    for chunk in chunks:
+        fields.extend(parser.feed(chunk))
+    return fields
+
+
+def expected():
+    return list(json.loads(PAYLOAD).items())
+
+
+@pytest.mark.parametrize("text", [PAYLOAD, ESCAPED], ids=["raw-unicode", "escaped-unicode"])
+def test_every_two_way_split(text):
+    for i in range(1, len(text)):
+        assert feed_all([text[:i], text[i:]]) == expected(), f"split at {i}: {text[:i]!r}"
+
+
+@pytest.mark.parametrize("text", [PAYLOAD, ESCAPED], ids=["raw-unicode", "escaped-unicode"])
+def test_one_character_at_a_time(text):
+    assert feed_all(list(text)) == expected()
+
+
+def test_split_inside_escape_sequences():
+    text = '{"a": "x\\"y", "b": "\\u00e9", "c": "\\ud83d\\ude80"}'
+    for marker in ('\\"', "\\u00", "\\ude"):
+        i = text.index(marker) + 1
+        assert feed_all([text[:i], text[i:]]) == [("a", 'x"y'), ("b", "é"), ("c", "\U0001F680")]
+
+
+def test_scalar_waits_for_terminator():
+    parser = JsonFieldStream()
+    assert parser.feed('{"viral_score": 7') == []
+    assert parser.feed('2, "ratio": 1.') == [("viral_score", 72)]
+    assert parser.feed("5}") == [("ratio", 1.5)]
+
+
+def test_fields_emitted_as_soon_as_complete():
+    parser = JsonFieldStream()
+    assert parser.feed('{"a": [1, 2') == []
+    assert parser.feed('], "b"') == [("a", [1, 2])]
+    assert parser.feed(': {"c": "d"}}') == [("b", {"c": "d"})]
+
+
+def test_markdown_fence_and_preamble_are_skipped():
+    assert feed_all(['```json\n', '{"a": 1', '}\n```']) == [("a", 1)]
+
+
+def test_malformed_input_stops_without_raising():
+    parser = JsonFieldStream()
+    assert parser.feed('{"a": 1, b: 2, "c": 3}') == [("a", 1)]
+    assert parser.done
+    assert parser.feed('{"d": 4}') == []
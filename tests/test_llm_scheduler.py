@@ -0,0 +1,158 @@
+import asyncio
+
+import server
+from server import PriorityScheduler
+
+WEIGHTS = {"free": 1.0, "pro": 3.0, "premium": 6.0}
+NO_SLO = {"free": 1e9, "pro": 1e9, "premium": 1e9}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+async def admission_order(sched, waiters, releases, before_release=None):
+    """Hold every slot, queue `waiters` [(name, plan)], then release one slot at
+    a time and return the names in the order they were admitted."""
+    for _ in range(sched.capacity):
+        await sched.acquire("free", 1)
+    order = []
+
+    async def wait(name, plan):
+        await sched.acquire(plan, 60)
+        order.append(name)
+
+    tasks = [asyncio.create_task(wait(name, plan)) for name, plan in waiters]
+    await asyncio.sleep(0)
+    for i in range(releases):
+        if before_release:
+            before_release(i)
+        sched.release()
+        await asyncio.sleep(0)
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return order
+
+
+def test_capacity_is_never_exceeded():
+    async def run():
+        sched = PriorityScheduler(2, WEIGHTS, NO_SLO)
+        peak = 0
+        active = 0
+
+        async def work(plan):
+            nonlocal peak, active
+            await sched.acquire(plan, 5)
+            active += 1
+            peak = max(peak, active, sched.in_use)
+            await asyncio.sleep(0.001)
+            active -= 1
+            sched.release()
+
+        await asyncio.gather(*(work(p) for p in ["free", "pro", "premium"] * 5))
+        return peak, sched.in_use
+
+    assert asyncio.run(run()) == (2, 0)
+
+
+def test_stride_scheduling_shares_slots_by_weight():
+    waiters = [(f"free{i}", "free") for i in range(8)] + [(f"pro{i}", "pro") for i in range(8)]
+
+    async def run():
+        return await admission_order(PriorityScheduler(1, WEIGHTS, NO_SLO), waiters, releases=8)
+
+    order = asyncio.run(run())
+    # Weights 1:3, so free gets 2 of the first 8 slots; FIFO within a tier.
+    assert [n for n in order if n.startswith("free")] == ["free0", "free1"]
+    assert [n for n in order if n.startswith("pro")] == [f"pro{i}" for i in range(6)]
+
+
+def test_idle_tier_does_not_bank_credit():
+    async def run():
+        sched = PriorityScheduler(1, WEIGHTS, NO_SLO)
+        # Premium runs alone for a while, pushing its pass value up.
+        await admission_order(sched, [(f"p{i}", "premium") for i in range(12)], releases=12)
+        sched.release()
+        order = await admission_order(sched, [(f"f{i}", "free") for i in range(4)] +
+                                      [(f"x{i}", "premium") for i in range(4)], releases=4)
+        return order
+
+    order = asyncio.run(run())
+    # Free rejoins at premium's virtual time instead of taking every slot
+    # until it catches up with premium's accumulated pass.
+    assert order == ["f0", "x0", "x1", "x2"]
+
+
+def test_overdue_tier_preempts_stride_order():
+    clock = FakeClock()
+    slo = {"free": 1000.0, "pro": 1e9, "premium": 1e9}
+
+    async def run():
+        sched = PriorityScheduler(1, WEIGHTS, slo, clock=clock)
+        sched._pass["free"] = 10.0  # free has had far more than its share
+        waiters = [("free0", "free")] + [(f"prem{i}", "premium") for i in range(10)]
+
+        def before_release(i):
+            if i == 1:
+                clock.now += 1.5  # free0 has now waited past its 1000 ms SLO
+
+        order = await admission_order(sched, waiters, releases=3, before_release=before_release)
+        return order, sched.stats()["tiers"]["free"]
+
+    order, free_stats = asyncio.run(run())
+    # By pass value free0 would wait behind every premium request.
+    assert order == ["prem0", "free0", "prem1"]
+    assert free_stats["slo_violations"] == 1
+
+
+def test_timed_out_waiter_leaves_queue_and_frees_no_slot():
+    async def run():
+        sched = PriorityScheduler(1, WEIGHTS, NO_SLO)
+        await sched.acquire("free", 1)
+        try:
+            await sched.acquire("pro", 0.01)
+        except asyncio.TimeoutError:
+            pass
+        return sched.in_use, len(sched._waiters["pro"]), sched.stats()["tiers"]["pro"]["timed_out"]
+
+    assert asyncio.run(run()) == (1, 0, 1)
+
+
+def test_plan_semaphore_caps_concurrent_calls(monkeypatch):
+    async def run():
+        monkeypatch.setattr(server, "llm_scheduler", PriorityScheduler(10, WEIGHTS, NO_SLO))
+        monkeypatch.setattr(server, "llm_plan_semaphores", {"free": asyncio.Semaphore(2), "pro": asyncio.Semaphore(5)})
+        active = {"free": 0, "pro": 0}
+        peak = {"free": 0, "pro": 0}
+
+        async def hold(plan):
+            deadline = asyncio.get_running_loop().time() + 5
+            async with server.llm_capacity(plan, deadline):
+                active[plan] += 1
+                peak[plan] = max(peak[plan], active[plan])
+                await asyncio.sleep(0.005)
+                active[plan] -= 1
+
+        await asyncio.gather(*(hold("free") for _ in range(6)), *(hold("pro") for _ in range(6)))
+        return peak
+
+    assert asyncio.run(run()) == {"free": 2, "pro": 5}
+
+
+def test_plan_cap_wait_respects_deadline(monkeypatch):
+    async def run():
+        monkeypatch.setattr(server, "llm_plan_semaphores", {"free": asyncio.Semaphore(1)})
+        loop = asyncio.get_running_loop()
+        async with server.llm_capacity("free", loop.time() + 5):
+            try:
+                async with server.llm_capacity("free", loop.time() + 0.01):
+                    return "admitted"
+            except server.LLMUnavailable:
+                return "rejected"
+
+    assert asyncio.run(run()) == "rejected"
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import server
+
+
+def scrape(authorization=None):
+    headers = [(b"authorization", authorization.encode())] if authorization else []
+    return asyncio.run(server.metrics_endpoint(Request({"type": "http", "headers": headers})))
+
+
+def rejected(authorization=None):
+    with pytest.raises(HTTPException) as e:
+        scrape(authorization)
+    return e.value.status_code == 403
+
+
+@pytest.fixture
+def env(monkeypatch):
+    monkeypatch.setattr(server, "METRICS_TOKEN", None)
+    monkeypatch.setattr(server, "METRICS_PUBLIC", False)
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    return monkeypatch
+
+
+def test_closed_without_any_token(env):
+    assert rejected() and rejected("Bearer ")
+
+
+def test_metrics_token_required(env):
+    env.setattr(server, "METRICS_TOKEN", "m")
+    assert rejected() and rejected("Bearer x")
+    assert scrape("Bearer m").status_code == 200
+
+
+def test_falls_back_to_admin_token(env):
+    env.setenv("ADMIN_TOKEN", "adm")
+    assert rejected()
+    assert scrape("Bearer adm").status_code == 200
+
+
+def test_public_only_by_opt_in(env):
+    env.setattr(server, "METRICS_PUBLIC", True)
+    assert scrape().status_code == 200
@@ -0,0 +1,81 @@
+from starlette.requests import Request
+
+import server
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_burst_then_refill():
+    clock = Clock()
+    buckets = server.TokenBuckets(max_keys=10, clock=clock)
+    limits = [("k", 3, 1.0)]  # 3 requests, one more per second
+    assert [buckets.take(limits) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert buckets.take(limits) == 1.0
+    clock.now += 0.5
+    assert buckets.take(limits) == 0.5
+    clock.now += 0.5
+    assert buckets.take(limits) == 0.0
+    clock.now += 100  # refill is capped at capacity
+    assert [buckets.take(limits) for _ in range(4)][-1] > 0
+
+
+def test_rejection_takes_from_no_bucket():
+    clock = Clock()
+    buckets = server.TokenBuckets(max_keys=10, clock=clock)
+    assert buckets.take([("ip", 5, 1.0), ("user", 1, 1.0)]) == 0.0
+    assert buckets.take([("ip", 5, 1.0), ("user", 1, 1.0)]) == 1.0
+    # The user bucket was empty, so the IP bucket still has 4 tokens.
+    assert [buckets.take([("ip", 5, 1.0)]) for _ in range(4)] == [0.0] * 4
+    assert buckets.take([("ip", 5, 1.0)]) > 0
+
+
+def test_least_recently_used_bucket_is_evicted():
+    buckets = server.TokenBuckets(max_keys=2, clock=Clock())
+    for key in ("a", "b", "a", "c"):
+        buckets.take([(key, 1, 1.0)])
+    assert list(buckets._buckets) == ["a", "c"]
+
+
+def test_shed_probability_thresholds():
+    monitor = server.LoopLagMonitor(interval=0.5, threshold_ms=100)
+    for lag, expected in ((50, 0.0), (100, 0.0), (150, 0.5), (200, 1.0), (400, 1.0)):
+        monitor.lag_ms = lag
+        assert monitor.shed_probability() == expected
+
+
+def test_lag_rises_at_once_and_decays_gradually():
+    monitor = server.LoopLagMonitor(interval=0.5, threshold_ms=100)
+    monitor.observe(300)
+    assert monitor.lag_ms == 300
+    monitor.observe(0)
+    assert monitor.lag_ms == 210 and monitor.shed_probability() == 1.0
+    assert monitor.max_lag_ms == 300
+
+
+def request(headers=(), client=("10.0.0.9", 1234)):
+    return {"type": "http", "headers": [(k.encode(), v.encode()) for k, v in headers], "client": client}
+
+
+def test_client_ip_ignores_forwarded_for_by_default(monkeypatch):
+    scope = request([("x-forwarded-for", "1.1.1.1, 2.2.2.2")])
+    monkeypatch.setattr(server, "FORWARDED_PROXY_HOPS", 0)
+    assert server.client_ip(scope) == "10.0.0.9"
+    monkeypatch.setattr(server, "FORWARDED_PROXY_HOPS", 1)
+    assert server.client_ip(scope) == "2.2.2.2"
+
+
+def test_opaque_sessions_share_their_users_bucket(monkeypatch):
+    monkeypatch.setattr(server, "session_cache", server.TTLCache(maxsize=10, ttl=60))
+    for token in ("sess_a", "sess_b"):
+        server.session_cache.set(token, {"user": {"user_id": "u1"}})
+    keys = {server.session_rate_key(Request(request([("authorization", f"Bearer {t}")]))) for t in ("sess_a", "sess_b")}
+    assert keys == {"user:u1"}
+    # Unknown tokens get no user bucket of their own; only the IP bucket applies.
+    assert server.session_rate_key(Request(request([("authorization", "Bearer sess_new")]))) is None
+    assert server.session_cache.hits == 0 and server.session_cache.misses == 0
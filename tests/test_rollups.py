@@ -0,0 +1,133 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from pymongo.errors import DuplicateKeyError
+
+import server
+
+
+def matches(doc, flt):
+    if doc["user_id"] != flt["user_id"]:
+        return False
+    for cond in flt.get("$or", [{}]):
+        since = cond.get("since", {})
+        if "$exists" in since and ("since" in doc) == since["$exists"]:
+            return True
+        if "$lte" in since and "since" in doc and doc["since"] <= since["$lte"]:
+            return True
+    return "$or" not in flt
+
+
+class Rollups:
+    """One user's rollup document, with the updates the rollup code uses."""
+
+    def __init__(self, doc=None, races=0):
+        self.doc = doc
+        self.races = races
+        self.calls = 0
+
+    async def update_one(self, flt, update, upsert=False):
+        self.calls += 1
+        if self.races:
+            self.races -= 1
+            raise DuplicateKeyError("user_id_unique")
+        if self.doc is None and upsert:
+            self.doc = {"user_id": flt["user_id"]}
+        elif self.doc is None or not matches(self.doc, flt):
+            if upsert:
+                raise DuplicateKeyError("user_id_unique")
+            return SimpleNamespace(matched_count=0)
+        for k, v in update["$inc"].items():
+            target = self.doc
+            *path, leaf = k.split(".")
+            for part in path:
+                target = target.setdefault(part, {})
+            target[leaf] = target.get(leaf, 0) + v
+        for k, v in update.get("$min", {}).items():
+            self.doc[k] = min(self.doc.get(k, v), v)
+        for k, v in update.get("$max", {}).items():
+            self.doc[k] = max(self.doc.get(k, v), v)
+        return SimpleNamespace(matched_count=1)
+
+    async def replace_one(self, flt, doc, upsert=False):
+        self.doc = dict(doc)
+
+    async def find_one(self, flt, projection=None):
+        return dict(self.doc) if self.doc else None
+
+
+class Analyses:
+    def __init__(self, docs=()):
+        self.docs = list(docs)
+
+    def find(self, flt, projection=None):
+        cutoff = flt["created_at"]["$lt"]
+
+        async def gen():
+            for d in self.docs:
+                if d["created_at"] < cutoff:
+                    yield d
+        return gen()
+
+
+def analysis(score, platform="tiktok", age=timedelta(0)):
+    return {"user_id": "u1", "platform": platform, "result": {"viral_score": score},
+            "created_at": (datetime.now(timezone.utc) - age).isoformat()}
+
+
+def install(monkeypatch, rollups, analyses=()):
+    db = SimpleNamespace(user_rollups=rollups, analyses=Analyses(analyses))
+    monkeypatch.setattr(server, "db", db)
+    return db
+
+
+def test_update_upserts_deltas(monkeypatch):
+    rollups = Rollups()
+    install(monkeypatch, rollups)
+    asyncio.run(server.update_user_rollup("u1", [analysis(72, "TikTok"), analysis(18)]))
+    doc = rollups.doc
+    assert (doc["count"], doc["score_sum"], doc["score_min"], doc["score_max"]) == (2, 90, 18, 72)
+    assert doc["platforms"] == {"tiktok": {"count": 2, "score_sum": 90}}
+    assert doc["histogram"] == {"70": 1, "10": 1}
+
+
+def test_lost_insert_race_is_retried(monkeypatch):
+    rollups = Rollups(races=1)
+    install(monkeypatch, rollups)
+    asyncio.run(server.update_user_rollup("u1", [analysis(50)]))
+    assert rollups.calls == 2 and rollups.doc["count"] == 1
+
+
+def test_rebuild_with_live_traffic_counts_every_analysis_once(monkeypatch):
+    monkeypatch.setattr(server, "ROLLUP_REBUILD_LEAD", timedelta(milliseconds=20))
+    monkeypatch.setattr(server, "ROLLUP_REBUILD_SETTLE", timedelta(milliseconds=20))
+    history = [analysis(40, age=timedelta(days=9)), analysis(60, "youtube", age=timedelta(days=2))]
+    # The live document only has the newer analysis, from before the backfill.
+    rollups = Rollups({"user_id": "u1", "count": 1, "score_sum": 60})
+    db = install(monkeypatch, rollups, history)
+
+    async def run():
+        since = await server.reset_user_rollup("u1")
+        # Created before the cutoff, stored and reported while the rebuild waits.
+        early = analysis(80)
+        db.analyses.docs.append(early)
+        await server.update_user_rollup("u1", [early])
+        await server.wait_for_rollup_cutoff(since)
+        late = analysis(20)
+        db.analyses.docs.append(late)
+        fill = asyncio.create_task(server.fill_user_rollup("u1", since))
+        await server.update_user_rollup("u1", [late])
+        await fill
+
+    asyncio.run(run())
+    doc = rollups.doc
+    assert doc["count"] == 4 and doc["score_sum"] == 200
+    assert doc["score_min"] == 20 and doc["score_max"] == 80
+    assert doc["platforms"]["youtube"] == {"count": 1, "score_sum": 60}
+
+
+def test_missing_rollup_reads_as_empty(monkeypatch):
+    install(monkeypatch, Rollups())
+    rollup = asyncio.run(server.get_user_rollup("u1"))
+    assert server.rollup_summary(rollup)["total_analyses"] == 0
@@ -0,0 +1,38 @@
+import asyncio
+
+import server
+from server import TTLCache
+
+
+def session_entry(user_id, issued_ms=0):
+    return {"user": {"user_id": user_id}, "expires_at": None, "issued_ms": issued_ms}
+
+
+def test_invalidate_group_drops_only_that_users_sessions():
+    cache = TTLCache(maxsize=10, ttl=60, index=lambda v: v["user"]["user_id"])
+    cache.set("t1", session_entry("u1"))
+    cache.set("t2", session_entry("u1"))
+    cache.set("t3", session_entry("u2"))
+    assert cache.invalidate_group("u1") == 2
+    assert cache.get("t1") is None and cache.get("t2") is None
+    assert cache.get("t3") is not None
+    assert cache.invalidate_group("u1") == 0
+
+
+def test_group_index_follows_eviction_and_overwrite():
+    cache = TTLCache(maxsize=2, ttl=60, index=lambda v: v["user"]["user_id"])
+    cache.set("t1", session_entry("u1"))
+    cache.set("t1", session_entry("u2"))
+    cache.set("t2", session_entry("u2"))
+    cache.set("t3", session_entry("u3"))  # evicts t1
+    assert cache._groups == {"u2": {"t2"}, "u3": {"t3"}}
+    cache.pop("t2")
+    assert "u2" not in cache._groups
+
+
+def test_user_cutoff_revokes_cached_opaque_sessions():
+    revocations = server.SessionRevocations()
+    revocations.user_cutoffs["u1"] = 2_000
+    assert asyncio.run(revocations.is_opaque_revoked("sess_a", "u1", 1_000))
+    assert not asyncio.run(revocations.is_opaque_revoked("sess_b", "u1", 2_000))
+    assert not asyncio.run(revocations.is_opaque_revoked("sess_c", "u2", 1_000))
@@ -0,0 +1,92 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from starlette.requests import Request
+
+import server
+
+
+class Users:
+    def __init__(self, plan):
+        self.plan = plan
+        self.reads = 0
+
+    async def find_one(self, flt, projection=None):
+        self.reads += 1
+        return {"user_id": flt["user_id"], "plan": self.plan}
+
+    async def update_one(self, flt, update):
+        self.plan = update["$set"]["plan"]
+
+
+class Revocations:
+    async def update_one(self, *a, **k):
+        pass
+
+
+def bearer(token):
+    return Request({"type": "http", "headers": [(b"authorization", f"Bearer {token}".encode())]})
+
+
+def setup(monkeypatch, plan):
+    users = Users(plan)
+    monkeypatch.setattr(server, "SESSION_SIGNING_KEYS", [b"k"])
+    monkeypatch.setattr(server, "db", SimpleNamespace(users=users, session_revocations=Revocations()))
+    monkeypatch.setattr(server, "session_revocations", server.SessionRevocations())
+    server.plan_cache.clear()
+    return users
+
+
+def test_plan_change_overrides_stale_signed_claim(monkeypatch):
+    users = setup(monkeypatch, "free")
+    token = server.sign_session("u1", "free")
+    time.sleep(0.002)
+
+    async def run():
+        await server.set_user_plan("u1", "pro")
+        first = await server.get_current_user(bearer(token))
+        second = await server.get_current_user(bearer(token))
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first["plan"] == second["plan"] == "pro"
+    assert users.reads == 1  # the second request is served from plan_cache
+
+
+def test_token_issued_after_the_change_is_trusted(monkeypatch):
+    users = setup(monkeypatch, "pro")
+
+    async def run():
+        await server.set_user_plan("u1", "pro")
+        await asyncio.sleep(0.002)
+        return await server.get_current_user(bearer(server.sign_session("u1", "pro")))
+
+    assert asyncio.run(run())["plan"] == "pro"
+    assert users.reads == 0
+
+
+def test_cached_plan_older_than_a_later_change_is_reread(monkeypatch):
+    users = setup(monkeypatch, "pro")
+    token = server.sign_session("u1", "free")
+    time.sleep(0.002)
+
+    async def run():
+        await server.set_user_plan("u1", "pro")
+        await server.get_current_user(bearer(token))
+        await asyncio.sleep(0.002)
+        # Another worker downgrades; only the synced change reaches this one.
+        users.plan = "free"
+        server.session_revocations.plan_changes["u1"] = int(time.time() * 1000)
+        return await server.get_current_user(bearer(token))
+
+    assert asyncio.run(run())["plan"] == "free"
+    assert users.reads == 2
+
+
+def test_plan_change_entries_keep_the_latest():
+    revocations = server.SessionRevocations()
+    bloom, cutoffs, plans = revocations.bloom, {}, {}
+    revocations._apply({"kind": "plan", "user_id": "u1", "changed_ms": 5}, bloom, cutoffs, plans)
+    revocations._apply({"kind": "plan", "user_id": "u1", "changed_ms": 3}, bloom, cutoffs, plans)
+    assert plans == {"u1": 5} and cutoffs == {}
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+import server
+from server import canonicalize_video_url
+
+
+@pytest.mark.parametrize("url", [
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=42s",
+    "youtube.com/watch?feature=share&v=dQw4w9WgXcQ",
+    "https://youtu.be/dQw4w9WgXcQ?si=abc",
+    "https://m.youtube.com/shorts/dQw4w9WgXcQ",
+    "https://www.youtube-nocookie.com/embed/dQw4w9WgXcQ",
+    "  HTTPS://WWW.YOUTUBE.COM/watch?v=dQw4w9WgXcQ  ",
+])
+def test_youtube_variants_share_one_key(url):
+    video = canonicalize_video_url(url)
+    assert video == {"platform": "youtube", "video_id": "dQw4w9WgXcQ",
+                     "url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ", "key": "youtube:dQw4w9WgXcQ"}
+
+
+def test_tiktok_video_drops_tracking_params():
+    a = canonicalize_video_url("https://www.tiktok.com/@creator/video/7234567890123456789?is_from_webapp=1&lang=en")
+    b = canonicalize_video_url("https://m.tiktok.com/@creator/video/7234567890123456789")
+    assert a["key"] == b["key"] == "tiktok:7234567890123456789"
+    assert a["url"] == "https://www.tiktok.com/@creator/video/7234567890123456789"
+
+
+def test_tiktok_short_links_key_on_code():
+    assert canonicalize_video_url("https://vm.tiktok.com/ZMabc123/")["key"] == "tiktok:short:ZMabc123"
+    assert canonicalize_video_url("https://www.tiktok.com/t/ZTxyz/")["key"] == "tiktok:short:ZTxyz"
+
+
+def test_instagram_reel_and_post_paths_match():
+    reel = canonicalize_video_url("https://www.instagram.com/reel/Cabc123/?igsh=xyz")
+    post = canonicalize_video_url("https://instagram.com/p/Cabc123")
+    assert reel["key"] == post["key"] == "instagram:Cabc123"
+    assert reel["url"] == "https://www.instagram.com/p/Cabc123/"
+
+
+def test_supported_site_without_video_path_keeps_full_url():
+    video = canonicalize_video_url("https://www.youtube.com/watch?v=short")
+    assert video["video_id"] is None and video["key"] == "youtube:url:https://www.youtube.com/watch?v=short"
+
+
+@pytest.mark.parametrize("url", ["https://example.com/watch?v=dQw4w9WgXcQ", "https://notyoutube.com/x", "", "http://[::1"])
+def test_unsupported_urls(url):
+    assert canonicalize_video_url(url) is None
+    assert server.detect_platform(url) is None
+
+
+def test_identical_concurrent_streams_share_one_llm_call(monkeypatch):
+    calls = []
+
+    async def fake_stream(system_msg, prompt, plan, session_prefix):
+        calls.append(prompt)
+        for chunk in ['{"viral_score": 8', '1, "summary": "ok"', "}"]:
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    monkeypatch.setattr(server, "llm_stream", fake_stream)
+
+    async def consume(outcome):
+        return [f async for f in server.coalesced_analysis_fields(
+            "test:key", "sys", "prompt", "free", "t", server.content_fallback_analysis, outcome)]
+
+    async def run():
+        first, second = {}, {}
+        fields = await asyncio.gather(consume(first), consume(second))
+        return fields, first, second
+
+    (a, b), first, second = asyncio.run(run())
+    assert calls == ["prompt"]
+    assert a == b == [("viral_score", 81), ("summary", "ok")]
+    assert first == second == {"analysis": {"viral_score": 81, "summary": "ok"}, "cacheable": True}